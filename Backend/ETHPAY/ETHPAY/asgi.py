@@ -2,6 +2,8 @@
 ASGI config for ETHPAY project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
+This is the application the project is served by (`uvicorn ETHPAY.asgi:application`),
+since the /api/events/ stream is only available over ASGI.
 
 For more information on this file, see
 https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
@@ -9,8 +11,14 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 
 import os
 
+from django.conf import settings
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'ETHPAY.settings')
 
 application = get_asgi_application()
+
+if settings.DEBUG:
+    # runserver served static files in development; uvicorn does not
+    from django.contrib.staticfiles.handlers import ASGIStaticFilesHandler
+    application = ASGIStaticFilesHandler(application)
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import sys
 from pathlib import Path
 from datetime import timedelta
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,6 +47,13 @@ CORS_ALLOW_HEADERS = [
     'user-agent',
     'x-csrftoken',
     'x-requested-with',
+    'idempotency-key',
+]
+# Keyset-paginated list endpoints return the next page's cursor in headers
+CORS_EXPOSE_HEADERS = [
+    'link',
+    'x-next-cursor',
+    'x-query-count',
 ]
 
 ALLOWED_HOSTS = ['localhost', '127.0.0.1']
@@ -54,7 +62,7 @@ from datetime import timedelta
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'api.authentication.ClaimsJWTAuthentication',
     ),
 }
 SIMPLE_JWT = {
@@ -94,10 +102,12 @@ INSTALLED_APPS = [
     'bank',
     'user',
     'rest_framework.authtoken',
+    'rest_framework_simplejwt.token_blacklist',
 ]
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'api.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -137,6 +147,13 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / "db.sqlite3",
+        # Settlements take their write lock up front (BEGIN IMMEDIATE) so
+        # concurrent payments queue on the lock instead of failing with
+        # "database is locked" when a read transaction tries to upgrade.
+        'OPTIONS': {
+            'transaction_mode': 'IMMEDIATE',
+            'timeout': 20,
+        },
     }
 
 }
@@ -160,6 +177,26 @@ AUTH_PASSWORD_VALIDATORS = [
     },
 ]
 
+# Algorithm and work factor (PBKDF2 iterations, bcrypt rounds, argon2 time
+# cost or scrypt work factor) used to hash passwords of each role;
+# 'bank_account' covers bank account passwords and 'default' anything else.
+# Stored hashes are upgraded or downgraded to these settings on the next
+# successful login. Size them with `python manage.py benchmark_password_hashing`.
+PASSWORD_HASHING_POLICY = {
+    'default': {'algorithm': 'pbkdf2_sha256', 'cost': 1000000},
+    'admin': {'algorithm': 'pbkdf2_sha256', 'cost': 1000000},
+    'merchant': {'algorithm': 'pbkdf2_sha256', 'cost': 1000000},
+    'endUser': {'algorithm': 'pbkdf2_sha256', 'cost': 600000},
+    'bank_account': {'algorithm': 'pbkdf2_sha256', 'cost': 600000},
+}
+
+# Run password hashing in a pool of PASSWORD_HASHING_WORKERS processes
+# (default: one per core) instead of on the request thread. When
+# PASSWORD_HASHING_MAX_PENDING checks (default: 4 per worker) are already
+# running or queued, further logins and bank verifications get a 429.
+PASSWORD_HASHING_POOL = os.getenv('PASSWORD_HASHING_POOL', '0') == '1'
+PASSWORD_HASHING_WORKERS = None
+PASSWORD_HASHING_MAX_PENDING = None
 
 # Internationalization
 # https://docs.djangoproject.com/en/5.2/topics/i18n/
@@ -191,4 +228,159 @@ STATICFILES_DIRS = [
 STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
 
 # For development, allow all origins
-CORS_ALLOW_ALL_ORIGINS = True
\ No newline at end of file
+CORS_ALLOW_ALL_ORIGINS = True
+
+# Number of balance shards for the hot merchant and service-fee settlement
+# accounts; credits are spread over the shards and folded back periodically
+# with `python manage.py fold_account_shards`.
+BANK_HOT_ACCOUNT_SHARDS = int(os.getenv('BANK_HOT_ACCOUNT_SHARDS', '8'))
+
+# Idempotency-Key handling for /api/bank/process/ and /api/payment/process/:
+# how long stored responses are replayed, how long a duplicate waits for the
+# request that owns the key, how long a claim may stay in progress before a
+# retry can take it over (longer than the slowest request), and the size/TTL
+# of the in-process front cache.
+IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+IDEMPOTENCY_WAIT_SECONDS = 5
+IDEMPOTENCY_LEASE_SECONDS = 60
+IDEMPOTENCY_CACHE_SIZE = 10000
+IDEMPOTENCY_CACHE_TTL = 300
+
+# Fee rules are cached per process; each worker compares its snapshot with
+# the stored version at most this often (seconds).
+FEE_RULES_VERSION_CHECK_SECONDS = 5
+
+# Largest number of amounts accepted by /api/fee/calculate/batch/, and the
+# largest amount either fee endpoint quotes (the largest storable amount)
+FEE_BATCH_MAX_ITEMS = 10000
+FEE_MAX_AMOUNT = '9999999999.99'
+
+# Audit logs (SystemLog) are queued in-process and written in batches by a
+# background thread: a batch is flushed at SYSTEM_LOG_BATCH_SIZE rows or every
+# SYSTEM_LOG_FLUSH_SECONDS, and callers flush synchronously once
+# SYSTEM_LOG_MAX_PENDING rows are waiting. Set SYSTEM_LOG_BUFFERED=0 to write
+# every entry immediately.
+SYSTEM_LOG_BUFFERED = os.getenv('SYSTEM_LOG_BUFFERED', '1') == '1'
+SYSTEM_LOG_BATCH_SIZE = 200
+SYSTEM_LOG_FLUSH_SECONDS = 1.0
+SYSTEM_LOG_MAX_PENDING = 10000
+
+# System logs older than SYSTEM_LOG_RETENTION_DAYS are moved to the
+# SystemLogArchive table (keyed by month, searched with /api/logs/?archived=1)
+# by `python manage.py archive_system_logs`. Archived audit logs are kept
+# forever unless SYSTEM_LOG_ARCHIVE_MONTHS is set (or --archive-months is
+# passed): the command then deletes archived months older than that.
+SYSTEM_LOG_RETENTION_DAYS = 90
+SYSTEM_LOG_ARCHIVE_MONTHS = int(os.getenv('SYSTEM_LOG_ARCHIVE_MONTHS', '0'))
+
+# SessionManager keeps validated session ids in a process-local cache for
+# SESSION_CACHE_TTL seconds (unknown/inactive ids for
+# SESSION_NEGATIVE_CACHE_TTL); a background thread deactivates expired sessions
+# every SESSION_SWEEP_SECONDS (0 disables it).
+SESSION_CACHE_SIZE = 10000
+SESSION_CACHE_TTL = 60
+SESSION_NEGATIVE_CACHE_TTL = 10
+SESSION_SWEEP_SECONDS = 300
+
+# `python manage.py expire_sessions` deletes sessions that expired more than
+# SESSION_RETENTION_DAYS ago
+SESSION_RETENTION_DAYS = 30
+
+# Lifetime (seconds) of the single-use token /api/bank/verify/ issues for
+# /api/bank/process/ in place of the account password
+BANK_VERIFICATION_TOKEN_TTL = 300
+
+# Users authenticated from tokens without role/status claims are looked up
+# once per USER_CLAIMS_CACHE_TTL seconds per process (api.authentication).
+# Tokens with the claims are revoked when the user's role or status changes;
+# other processes refuse them within TOKEN_BLACKLIST_FILTER_SYNC_SECONDS.
+USER_CLAIMS_CACHE_SIZE = 10000
+USER_CLAIMS_CACHE_TTL = 30
+
+# Refresh tokens are checked against the blacklist through a per-process
+# Bloom filter (api.tokens.TokenBlacklistFilter) sized for
+# TOKEN_BLACKLIST_FILTER_CAPACITY tokens at TOKEN_BLACKLIST_FILTER_ERROR_RATE
+# false positives. It picks up tokens blacklisted by other processes every
+# TOKEN_BLACKLIST_FILTER_SYNC_SECONDS (the longest a token revoked by another
+# process can still be refreshed) and is rebuilt every
+# TOKEN_BLACKLIST_FILTER_REBUILD_SECONDS.
+# Expired tokens are deleted by `python manage.py purge_token_blacklist`.
+TOKEN_BLACKLIST_FILTER_CAPACITY = 100000
+TOKEN_BLACKLIST_FILTER_ERROR_RATE = 0.001
+TOKEN_BLACKLIST_FILTER_SYNC_SECONDS = 5
+TOKEN_BLACKLIST_FILTER_REBUILD_SECONDS = 3600
+
+# Notification delivery (`python manage.py dispatch_notifications`): channel
+# class per notification type, claimed batch size, seconds before a claim of a
+# worker that died can be taken over, delivery attempts before a notification
+# is marked FAILED and the backoff between them (doubling from
+# NOTIFICATION_RETRY_BASE_SECONDS up to NOTIFICATION_RETRY_MAX_SECONDS,
+# jittered). FileChannel appends to NOTIFICATION_OUTBOX_DIR/<type>.log as a
+# stand-in for real gateways.
+NOTIFICATION_CHANNELS = {
+    'SMS': 'api.notifications.FileChannel',
+    'EMAIL': 'api.notifications.FileChannel',
+    'IN_APP': 'api.notifications.InAppChannel',
+}
+NOTIFICATION_OUTBOX_DIR = os.getenv('NOTIFICATION_OUTBOX_DIR', os.path.join(BASE_DIR, 'outbox'))
+NOTIFICATION_BATCH_SIZE = 500
+NOTIFICATION_CLAIM_TIMEOUT = 300
+NOTIFICATION_MAX_ATTEMPTS = 3
+NOTIFICATION_RETRY_BASE_SECONDS = 10
+NOTIFICATION_RETRY_MAX_SECONDS = 3600
+NOTIFICATION_IDLE_SECONDS = 1.0
+
+# Server-Sent Events at /api/events/ (api.events): served by the ASGI
+# application only, which is what the Dockerfile and render-ethpay.yaml run
+# (`uvicorn ETHPAY.asgi:application`). Events are published in-process, so
+# streams must be served by the process that handles the payment requests -
+# keep a single uvicorn process (no --workers) until publish() is backed by a
+# shared broker. Each stream buffers EVENT_STREAM_QUEUE_SIZE events
+# (a client that falls further behind is disconnected), sends a keep-alive
+# every EVENT_STREAM_HEARTBEAT_SECONDS and is closed after
+# EVENT_STREAM_MAX_SECONDS; clients reconnect after EVENT_STREAM_RETRY_MS.
+EVENT_STREAM_QUEUE_SIZE = 100
+EVENT_STREAM_HEARTBEAT_SECONDS = 15
+EVENT_STREAM_MAX_SECONDS = 300
+EVENT_STREAM_RETRY_MS = 3000
+
+# Merchant webhooks (api.webhooks, delivered by `python manage.py
+# dispatch_webhooks`): payment status changes are POSTed to the payment's
+# callback URL, signed with HMAC-SHA256 of the merchant's own webhook secret
+# (GET /api/webhooks/secret/) in the X-EthPay-Signature header. Callback URLs
+# must resolve to public addresses, both when the payment is created and when
+# a webhook is sent; WEBHOOK_ALLOW_PRIVATE_TARGETS lifts that for local
+# development against `python manage.py webhook_stub_server`.
+# WEBHOOK_CONCURRENCY requests run at a time over a keep-alive pool of
+# WEBHOOK_POOL_SIZE connections per host. Failed deliveries are retried after
+# WEBHOOK_RETRY_BASE_SECONDS, doubling up to WEBHOOK_RETRY_MAX_SECONDS, and
+# marked FAILED after WEBHOOK_MAX_ATTEMPTS. Latency percentiles over the last
+# WEBHOOK_STATS_WINDOW deliveries are served at /api/webhooks/stats/.
+WEBHOOK_ALLOW_PRIVATE_TARGETS = os.getenv('WEBHOOK_ALLOW_PRIVATE_TARGETS', '0') == '1'
+WEBHOOK_SIGNATURE_TOLERANCE = 300
+WEBHOOK_TIMEOUT_SECONDS = 10
+WEBHOOK_BATCH_SIZE = 100
+WEBHOOK_CONCURRENCY = 10
+WEBHOOK_POOL_SIZE = 50
+WEBHOOK_CLAIM_TIMEOUT = 300
+WEBHOOK_MAX_ATTEMPTS = 8
+WEBHOOK_RETRY_BASE_SECONDS = 10
+WEBHOOK_RETRY_MAX_SECONDS = 3600
+WEBHOOK_IDLE_SECONDS = 1.0
+WEBHOOK_STATS_WINDOW = 1000
+
+# Keyset pagination (api.pagination.KeysetPagination): default and largest
+# page size accepted through ?limit=
+API_PAGE_SIZE = 50
+API_MAX_PAGE_SIZE = 200
+
+# Rows fetched per database round trip by the streaming NDJSON/CSV exports
+EXPORT_CHUNK_SIZE = 2000
+
+# SQL statement counting (api.middleware.QueryBudgetMiddleware): every request
+# gets an X-Query-Count header, and views decorated with @query_budget(n) that
+# issue more than n statements print a warning, or fail outright when
+# QUERY_BUDGET_STRICT is set (the default under `manage.py test`).
+TESTING = sys.argv[1:2] == ['test']
+QUERY_BUDGET_ENABLED = DEBUG or TESTING
+QUERY_BUDGET_STRICT = TESTING
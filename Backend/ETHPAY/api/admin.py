@@ -2,8 +2,10 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from .models import (
     User, Session, Dashboard, Payment, Transaction, Receipt,
-    Notification, WalletIntegration, SystemLog, ServiceFeeCalculator
+    Notification, WalletIntegration, SystemLog, SystemLogArchive, ServiceFeeCalculator,
+    IdempotencyKey, FeeSchedule, FeeTier, WebhookDelivery
 )
+from .services import AuthenticationManager, ServiceFeeCalculatorService
 
 
 @admin.register(User)
@@ -20,12 +22,19 @@ class UserAdmin(BaseUserAdmin):
         ('Important dates', {'fields': ('created_at', 'date_joined')}),
     )
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        # Tokens carry role and status as claims - revoke them when those change
+        if change and {'role', 'status', 'is_active'} & set(form.changed_data):
+            AuthenticationManager.revoke_user_tokens(obj)
+
 
 @admin.register(Session)
 class SessionAdmin(admin.ModelAdmin):
     list_display = ('session_id', 'user_id', 'created_at', 'expires_at', 'is_active')
     list_filter = ('is_active', 'created_at')
     search_fields = ('session_id', 'user_id__email')
+    list_select_related = ('user_id',)
 
 
 @admin.register(Dashboard)
@@ -33,6 +42,7 @@ class DashboardAdmin(admin.ModelAdmin):
     list_display = ('dashboard_id', 'user_id', 'role', 'last_updated')
     list_filter = ('role', 'last_updated')
     search_fields = ('user_id__email',)
+    list_select_related = ('user_id',)
 
 
 @admin.register(Payment)
@@ -40,6 +50,7 @@ class PaymentAdmin(admin.ModelAdmin):
     list_display = ('payment_id', 'user_id', 'amount', 'currency', 'status', 'created_at')
     list_filter = ('status', 'payment_method', 'currency', 'created_at')
     search_fields = ('payment_id', 'user_id__email', 'recipient_id__email')
+    list_select_related = ('user_id',)
 
 
 @admin.register(Transaction)
@@ -47,6 +58,7 @@ class TransactionAdmin(admin.ModelAdmin):
     list_display = ('transaction_id', 'payment_id', 'user_id', 'amount', 'total_amount', 'status', 'created_at')
     list_filter = ('status', 'created_at')
     search_fields = ('transaction_id', 'payment_id', 'user_id__email')
+    list_select_related = ('payment_id', 'user_id')
 
 
 @admin.register(Receipt)
@@ -54,6 +66,7 @@ class ReceiptAdmin(admin.ModelAdmin):
     list_display = ('receipt_id', 'transaction_id', 'user_id', 'total_amount', 'issued_at', 'receipt_format')
     list_filter = ('receipt_format', 'issued_at')
     search_fields = ('receipt_id', 'transaction_id', 'user_id__email')
+    list_select_related = ('transaction_id', 'user_id')
 
 
 @admin.register(Notification)
@@ -61,6 +74,15 @@ class NotificationAdmin(admin.ModelAdmin):
     list_display = ('notification_id', 'user_id', 'type', 'status', 'sent_at')
     list_filter = ('type', 'status', 'sent_at')
     search_fields = ('user_id__email', 'message')
+    list_select_related = ('user_id',)
+
+
+@admin.register(WebhookDelivery)
+class WebhookDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('delivery_id', 'payment_id', 'event', 'status', 'attempts', 'response_status', 'latency_ms', 'next_attempt_at', 'delivered_at')
+    list_filter = ('status', 'event')
+    search_fields = ('payment_id__payment_id', 'url')
+    readonly_fields = ('payload', 'last_error')
 
 
 @admin.register(WalletIntegration)
@@ -75,8 +97,69 @@ class SystemLogAdmin(admin.ModelAdmin):
     list_filter = ('status', 'action', 'timestamp')
     search_fields = ('user_id__email', 'action', 'details')
     readonly_fields = ('timestamp',)
+    ordering = ('-timestamp',)
+    date_hierarchy = 'timestamp'
+    list_select_related = ('user_id',)
+    # Skip the unfiltered COUNT(*) over the whole table on every page
+    show_full_result_count = False
+
+
+@admin.register(SystemLogArchive)
+class SystemLogArchiveAdmin(admin.ModelAdmin):
+    list_display = ('log_id', 'partition', 'user_id', 'action', 'status', 'timestamp')
+    list_filter = ('partition', 'status')
+    search_fields = ('user_id__email', 'action', 'details')
+    ordering = ('-timestamp',)
+    list_select_related = ('user_id',)
+    show_full_result_count = False
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
 
 
 @admin.register(ServiceFeeCalculator)
 class ServiceFeeCalculatorAdmin(admin.ModelAdmin):
-    list_display = ('calculator_id', 'fee_percentage', 'minimum_fee', 'maximum_fee')
+    list_display = ('calculator_id', 'fee_percentage', 'minimum_fee', 'maximum_fee', 'version')
+    readonly_fields = ('version',)
+    
+    def save_model(self, request, obj, form, change):
+        # Bump the version so cached fee snapshots in every worker are refreshed
+        obj.version = (obj.version or 0) + 1
+        super().save_model(request, obj, form, change)
+
+
+class FeeTierInline(admin.TabularInline):
+    model = FeeTier
+    extra = 1
+
+
+@admin.register(FeeSchedule)
+class FeeScheduleAdmin(admin.ModelAdmin):
+    list_display = ('merchant_id', 'is_active', 'updated_at')
+    list_filter = ('is_active',)
+    search_fields = ('merchant_id__email', 'merchant_id__company_name')
+    list_select_related = ('merchant_id',)
+    inlines = [FeeTierInline]
+    
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # Recompile the fee lookup table in every worker
+        ServiceFeeCalculatorService.bump_version()
+    
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        ServiceFeeCalculatorService.bump_version()
+    
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        ServiceFeeCalculatorService.bump_version()
+
+
+@admin.register(IdempotencyKey)
+class IdempotencyKeyAdmin(admin.ModelAdmin):
+    list_display = ('scope', 'key', 'status', 'response_status', 'created_at', 'expires_at')
+    list_filter = ('scope', 'status')
+    search_fields = ('key',)
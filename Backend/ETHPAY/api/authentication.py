@@ -0,0 +1,76 @@
+# api/authentication.py
+import uuid
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .models import User
+from .services import TTLCache
+from .tokens import REFRESH_JTI_CLAIM, is_blacklisted
+
+# User fields AuthenticationManager.generate_token embeds in every token
+USER_CLAIMS = ('role', 'status')
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that does not load the user row on every request.
+
+    Tokens from AuthenticationManager.generate_token carry the user's role
+    and status, so request.user is built from the signed claims with User.from_db
+    and every other field deferred: the first read of one of them loads them
+    all in one query (User.refresh_from_db). Tokens without the claims fall
+    back to a lookup cached per process for USER_CLAIMS_CACHE_TTL seconds.
+
+    The claims are only trusted while the refresh token the access token was
+    issued from (REFRESH_JTI_CLAIM) is not blacklisted, checked through
+    TokenBlacklistFilter so it costs no query unless the filter hits.
+    AuthenticationManager.revoke_user_tokens blacklists a user's refresh tokens
+    when their role or status changes; other processes stop accepting the old
+    claims within TOKEN_BLACKLIST_FILTER_SYNC_SECONDS.
+    """
+    _users = TTLCache(
+        maxsize=getattr(settings, 'USER_CLAIMS_CACHE_SIZE', 10000),
+        ttl=getattr(settings, 'USER_CLAIMS_CACHE_TTL', 30)
+    )
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken('Token contained no recognizable user identification')
+
+        if REFRESH_JTI_CLAIM in validated_token and all(claim in validated_token for claim in USER_CLAIMS):
+            if is_blacklisted(validated_token[REFRESH_JTI_CLAIM]):
+                raise AuthenticationFailed('Token has been revoked', code='token_revoked')
+            values = {claim: validated_token[claim] for claim in USER_CLAIMS}
+            values['is_active'] = True
+        else:
+            values = self._users.get(user_id)
+            if values is None:
+                values = User.objects.filter(pk=user_id).values(*USER_CLAIMS, 'is_active').first()
+                if values is None:
+                    raise AuthenticationFailed('User not found', code='user_not_found')
+                self._users.set(user_id, values)
+
+        if not values['is_active']:
+            raise AuthenticationFailed('User is inactive', code='user_inactive')
+
+        try:
+            values = dict(values, userId=uuid.UUID(str(user_id)))
+        except ValueError:
+            raise InvalidToken('Token contained no recognizable user identification')
+        # from_db() expects the loaded fields in model order; the rest are deferred
+        field_names = [field.attname for field in User._meta.concrete_fields if field.attname in values]
+        return User.from_db(DEFAULT_DB_ALIAS, field_names, [values[name] for name in field_names])
+
+
+def full_user(user):
+    """Load every deferred field of a user built from token claims up front, in one query"""
+    deferred = user.get_deferred_fields()
+    if deferred:
+        user.refresh_from_db(fields=deferred)
+    return user
@@ -0,0 +1,154 @@
+# api/events.py
+import asyncio
+import json
+import threading
+import time
+
+from django.conf import settings
+from django.db import transaction
+
+
+class Subscription:
+    """One event stream's bounded queue, fed from any thread through its event loop"""
+
+    def __init__(self, topics, loop, maxsize):
+        self.topics = topics
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=maxsize)
+        # Set when the client fell behind and events were dropped; the stream then ends
+        # so the client reconnects and starts again from current state
+        self.overflowed = False
+
+    def _put(self, message):
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.overflowed = True
+            self.queue.get_nowait()
+            self.queue.put_nowait(None)
+
+
+class EventBroker:
+    """
+    In-process publish/subscribe for the /api/events/ stream.
+
+    Streams subscribe to topics ('user:<userId>', 'payment:<paymentID>') from
+    their event loop; publish() may be called from any thread (sync views run
+    in a thread pool under ASGI) and hands the event to each subscriber's loop.
+    Events only reach streams served by the same process, so run the event
+    stream in a single ASGI process or put a shared broker behind publish().
+    """
+    _subscriptions = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def subscribe(cls, topics):
+        """Subscribe the running event loop to topics"""
+        subscription = Subscription(
+            frozenset(topics), asyncio.get_running_loop(), getattr(settings, 'EVENT_STREAM_QUEUE_SIZE', 100)
+        )
+        with cls._lock:
+            for topic in subscription.topics:
+                cls._subscriptions.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    @classmethod
+    def unsubscribe(cls, subscription):
+        with cls._lock:
+            for topic in subscription.topics:
+                subscribers = cls._subscriptions.get(topic)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del cls._subscriptions[topic]
+
+    @classmethod
+    def publish(cls, topics, event, data):
+        """Send event to every subscriber of any of topics (once per subscriber) - Returns the number reached"""
+        with cls._lock:
+            subscriptions = set()
+            for topic in topics:
+                subscriptions.update(cls._subscriptions.get(topic, ()))
+
+        message = (event, json.dumps(data, default=str))
+        for subscription in subscriptions:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._put, message)
+            except RuntimeError:
+                # The stream's event loop is gone
+                cls.unsubscribe(subscription)
+        return len(subscriptions)
+
+
+def payment_topics(payment):
+    return [
+        f'payment:{payment.payment_id}',
+        f'user:{payment.user_id_id}',
+        f'user:{payment.recipient_id_id}',
+    ]
+
+
+def payment_event(payment):
+    return {
+        'paymentID': str(payment.payment_id),
+        'status': payment.status,
+        'amount': str(payment.amount),
+        'currency': payment.currency,
+        'processedAt': payment.processed_at.isoformat() if payment.processed_at else None,
+    }
+
+
+def publish_payment_status(payment):
+    """Publish payment's current status once the surrounding transaction commits"""
+    topics, data = payment_topics(payment), payment_event(payment)
+    transaction.on_commit(lambda: EventBroker.publish(topics, 'payment', data))
+
+
+def publish_notification(notification):
+    """Publish an IN_APP notification to its user once the surrounding transaction commits"""
+    topics = [f'user:{notification.user_id_id}']
+    data = {
+        'notificationID': str(notification.notification_id),
+        'message': notification.message,
+        'createdAt': notification.created_at.isoformat() if notification.created_at else None,
+    }
+    transaction.on_commit(lambda: EventBroker.publish(topics, 'notification', data))
+
+
+def _format(event, data):
+    return f'event: {event}\ndata: {data}\n\n'
+
+
+async def event_stream(topics, snapshot=None):
+    """
+    Server-Sent Events for topics: the (event, data) pairs returned by the
+    async snapshot() first, then every published event, with a comment line every
+    EVENT_STREAM_HEARTBEAT_SECONDS so proxies keep the connection open. The
+    stream ends after EVENT_STREAM_MAX_SECONDS; EventSource clients reconnect
+    on their own after the advertised retry delay.
+    """
+    subscription = EventBroker.subscribe(topics)
+    heartbeat = getattr(settings, 'EVENT_STREAM_HEARTBEAT_SECONDS', 15)
+    closes_at = time.monotonic() + getattr(settings, 'EVENT_STREAM_MAX_SECONDS', 300)
+    try:
+        yield f'retry: {getattr(settings, "EVENT_STREAM_RETRY_MS", 3000)}\n\n'
+        # Read after subscribing, so a change committed in between is not missed
+        for event, data in (await snapshot() if snapshot else ()):
+            yield _format(event, json.dumps(data, default=str))
+
+        while True:
+            remaining = closes_at - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                message = await asyncio.wait_for(subscription.queue.get(), timeout=min(heartbeat, remaining))
+            except asyncio.TimeoutError:
+                yield ': keep-alive\n\n'
+                continue
+            if message is None:
+                break
+            yield _format(*message)
+    finally:
+        EventBroker.unsubscribe(subscription)
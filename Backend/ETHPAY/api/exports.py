@@ -0,0 +1,89 @@
+# api/exports.py
+import csv
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+EXPORT_CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to the caller"""
+
+    def write(self, value):
+        return value
+
+
+def parse_time_param(value, default=None):
+    """Parse an ISO date or datetime query parameter - Raises ValueError when invalid"""
+    if not value:
+        return default
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(value)
+        parsed = datetime.combine(day, datetime.min.time())
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def time_range_filter(field, start=None, end=None):
+    """
+    Filter arguments limiting field to the ISO date or datetime query parameters
+    start and end, both inclusive. A date-only end covers that whole day, so it
+    becomes an exclusive bound at the next midnight - Raises ValueError when invalid
+    """
+    filters = {}
+    if start:
+        filters[f'{field}__gte'] = parse_time_param(start)
+    if end:
+        try:
+            day = parse_date(end)
+        except ValueError:
+            day = None
+        if day is not None:
+            filters[f'{field}__lt'] = parse_time_param((day + timedelta(days=1)).isoformat())
+        else:
+            filters[f'{field}__lte'] = parse_time_param(end)
+    return filters
+
+
+def stream_export(queryset, fields, output, filename):
+    """
+    Stream queryset as NDJSON or CSV without materializing it.
+
+    fields is a list of (column name, queryset lookup) pairs. Rows are read
+    with values_list().iterator(), so only EXPORT_CHUNK_SIZE rows are held in
+    memory at a time whatever the size of the export.
+    """
+    columns = [column for column, _ in fields]
+    rows = queryset.values_list(*[lookup for _, lookup in fields]).iterator(
+        chunk_size=getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+    )
+
+    if output == 'csv':
+        writer = csv.writer(_Echo())
+
+        def lines():
+            yield writer.writerow(columns)
+            for row in rows:
+                yield writer.writerow(row)
+    else:
+        encoder = DjangoJSONEncoder()
+
+        def lines():
+            for row in rows:
+                yield encoder.encode(dict(zip(columns, row))) + '\n'
+
+    response = StreamingHttpResponse(lines(), content_type=EXPORT_CONTENT_TYPES[output])
+    response['Content-Disposition'] = f'attachment; filename="{filename}.{output}"'
+    return response
@@ -0,0 +1,152 @@
+# api/hashing.py
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.contrib.auth import hashers
+from rest_framework.exceptions import Throttled
+
+# Hasher attribute that holds the work factor of each algorithm
+COST_ATTRIBUTES = {
+    'pbkdf2_sha256': 'iterations',
+    'pbkdf2_sha1': 'iterations',
+    'argon2': 'time_cost',
+    'bcrypt_sha256': 'rounds',
+    'bcrypt': 'rounds',
+    'scrypt': 'work_factor',
+}
+
+
+class PasswordHashingPolicy:
+    """
+    Password hashing driven by the PASSWORD_HASHING_POLICY setting.
+
+    The policy maps a role ('admin', 'merchant', 'endUser', 'bank_account', ...)
+    to an algorithm and work factor, with 'default' for anything not listed.
+    check_password() rehashes a correct password whose stored hash uses a
+    different algorithm or cost than the policy asks for, so raising and
+    lowering the cost both take effect on the next successful login.
+    """
+    _hashers = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def setting_for(cls, role=None):
+        policy = getattr(settings, 'PASSWORD_HASHING_POLICY', {})
+        return policy.get(role) or policy.get('default') or {}
+
+    @classmethod
+    def hasher_for(cls, role=None):
+        """Hasher instance configured with the algorithm and cost of role's policy"""
+        setting = cls.setting_for(role)
+        return cls.get_hasher(setting.get('algorithm', 'default'), setting.get('cost'))
+
+    @classmethod
+    def get_hasher(cls, algorithm='default', cost=None):
+        """Registered PASSWORD_HASHERS entry for algorithm, with its work factor set to cost"""
+        base = hashers.get_hasher(algorithm)
+        if cost is None:
+            return base
+
+        key = (base.algorithm, cost)
+        hasher = cls._hashers.get(key)
+        if hasher is None:
+            attribute = COST_ATTRIBUTES.get(base.algorithm)
+            if attribute is None:
+                raise ValueError(f"No configurable cost for password hashing algorithm '{base.algorithm}'")
+            hasher_class = type(type(base).__name__, (type(base),), {attribute: cost})
+            with cls._lock:
+                hasher = cls._hashers.setdefault(key, hasher_class())
+        return hasher
+
+    @classmethod
+    def make_password(cls, raw_password, role=None):
+        setting = cls.setting_for(role)
+        return HashingExecutor.run(_make_password, raw_password, setting.get('algorithm', 'default'), setting.get('cost'))
+
+    @classmethod
+    def check_password(cls, raw_password, encoded, setter=None, role=None):
+        """
+        Verify raw_password against encoded; when it matches but the hash does not
+        follow role's policy, setter(raw_password) is called to store a new hash
+        """
+        setting = cls.setting_for(role)
+        is_correct, must_update = HashingExecutor.run(
+            _verify_password, raw_password, encoded, setting.get('algorithm', 'default'), setting.get('cost')
+        )
+        if setter and is_correct and must_update:
+            setter(raw_password)
+        return is_correct
+
+
+# Module-level so they can run in HashingExecutor's worker processes
+def _make_password(raw_password, algorithm, cost):
+    return hashers.make_password(raw_password, hasher=PasswordHashingPolicy.get_hasher(algorithm, cost))
+
+
+def _verify_password(raw_password, encoded, algorithm, cost):
+    return hashers.verify_password(raw_password, encoded, preferred=PasswordHashingPolicy.get_hasher(algorithm, cost))
+
+
+def _init_worker():
+    # Worker processes started with spawn have to load the project first
+    import django
+    django.setup()
+
+
+class HashingPoolSaturated(Throttled):
+    default_detail = 'Too many password checks in progress, please retry shortly.'
+
+
+class HashingExecutor:
+    """
+    Optional process pool that runs password hashing off the request threads.
+
+    Enabled with PASSWORD_HASHING_POOL; it runs PASSWORD_HASHING_WORKERS
+    processes (one per core by default). At most PASSWORD_HASHING_MAX_PENDING
+    jobs may be running or queued. Beyond that, callers get
+    HashingPoolSaturated right away, which DRF turns into a 429 response, so a
+    login burst can't tie up every worker thread. Disabled, jobs run inline.
+    """
+    _executor = None
+    _pid = None
+    _slots = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def run(cls, func, *args):
+        if not getattr(settings, 'PASSWORD_HASHING_POOL', False):
+            return func(*args)
+
+        executor, slots = cls._ensure_executor()
+        if not slots.acquire(blocking=False):
+            raise HashingPoolSaturated(wait=1)
+        try:
+            return executor.submit(func, *args).result()
+        except BrokenProcessPool:
+            # A worker died; start a new pool for the next job and finish this one inline
+            print("Password hashing pool broken, restarting it")
+            with cls._lock:
+                if cls._executor is executor:
+                    cls._executor = None
+            return func(*args)
+        finally:
+            slots.release()
+
+    @classmethod
+    def _ensure_executor(cls):
+        # Created lazily, and again in a worker forked from a process that already had one
+        executor, slots = cls._executor, cls._slots
+        if executor is not None and cls._pid == os.getpid():
+            return executor, slots
+        with cls._lock:
+            if cls._executor is None or cls._pid != os.getpid():
+                workers = getattr(settings, 'PASSWORD_HASHING_WORKERS', None) or os.cpu_count() or 1
+                cls._pid = os.getpid()
+                cls._executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+                cls._slots = threading.BoundedSemaphore(
+                    getattr(settings, 'PASSWORD_HASHING_MAX_PENDING', None) or 4 * workers
+                )
+            return cls._executor, cls._slots
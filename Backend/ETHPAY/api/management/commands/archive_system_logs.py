@@ -0,0 +1,51 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from api.models import SystemLogArchive
+from api.services import SystemLogService
+
+
+class Command(BaseCommand):
+    help = ('Move old system logs into the archive table; with --archive-months (or '
+            'SYSTEM_LOG_ARCHIVE_MONTHS) also delete archived months older than that')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.SYSTEM_LOG_RETENTION_DAYS,
+                            help='Keep this many days of logs in the live table')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Logs moved per transaction')
+        parser.add_argument('--archive-months', type=int, default=settings.SYSTEM_LOG_ARCHIVE_MONTHS,
+                            help='Delete archived logs older than this many months (default 0 = keep forever)')
+        parser.add_argument('--vacuum', action='store_true', help='Compact the SQLite database file afterwards')
+
+    def handle(self, *args, **options):
+        # Flush this process's queue so nothing older than the cutoff is written after the move
+        SystemLogService.flush()
+
+        before = timezone.now() - timedelta(days=options['days'])
+        started = time.perf_counter()
+        moved = SystemLogService.archive_logs(before, batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f'Archived {moved} logs older than {before:%Y-%m-%d} in {elapsed:.2f}s'
+            + (f' ({moved / elapsed:.0f} logs/s)' if moved and elapsed else '')
+        )
+
+        if options['archive_months']:
+            today = timezone.localdate()
+            month_index = today.year * 12 + today.month - 1 - options['archive_months']
+            cutoff = f'{month_index // 12:04d}-{month_index % 12 + 1:02d}'
+            deleted = SystemLogService.purge_archived_logs(cutoff)
+            self.stdout.write(f'Deleted {deleted} archived logs from before {cutoff}')
+
+        if options['vacuum'] and connection.vendor == 'sqlite':
+            with connection.cursor() as cursor:
+                cursor.execute('VACUUM')
+            self.stdout.write('Database compacted')
+
+        months = SystemLogArchive.objects.values_list('partition', flat=True).distinct().order_by('partition')
+        self.stdout.write(self.style.SUCCESS(f'Archived months: {", ".join(months) or "none"}'))
@@ -0,0 +1,34 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+
+from api.services import ServiceFeeCalculatorService
+
+
+class Command(BaseCommand):
+    help = 'Measure fee calculations per second with and without the cached rule snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=20000, help='Fee calculations per run')
+
+    def handle(self, *args, **options):
+        calls = options['calls']
+        amounts = [Decimal(index % 5000) + Decimal('0.99') for index in range(calls)]
+
+        # Before: every calculation re-reads the calculator row
+        started = time.perf_counter()
+        for amount in amounts:
+            ServiceFeeCalculatorService.apply_rules(amount, ServiceFeeCalculatorService.load_rules())
+        uncached = calls / (time.perf_counter() - started)
+
+        # After: pure arithmetic on the cached snapshot
+        ServiceFeeCalculatorService.invalidate_rules()
+        started = time.perf_counter()
+        for amount in amounts:
+            ServiceFeeCalculatorService.calculate_fee(amount)
+        cached = calls / (time.perf_counter() - started)
+
+        self.stdout.write(f'Uncached: {uncached:,.0f} fee calls/s')
+        self.stdout.write(f'Cached:   {cached:,.0f} fee calls/s')
+        self.stdout.write(self.style.SUCCESS(f'Speed-up: {cached / uncached:.1f}x'))
@@ -0,0 +1,82 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.hashing import PasswordHashingPolicy
+
+BENCH_PASSWORD = 'Bench-password-123'
+
+
+def _verify(algorithm, cost, encoded, count):
+    hasher = PasswordHashingPolicy.get_hasher(algorithm, cost)
+    for _ in range(count):
+        if not hasher.verify(BENCH_PASSWORD, encoded):
+            raise RuntimeError('Verification failed')
+    return count
+
+
+class Command(BaseCommand):
+    help = 'Measure password verifications per second per core for each hashing setting'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hashers', nargs='*', default=None, metavar='ALGORITHM:COST',
+                            help='Settings to measure, e.g. pbkdf2_sha256:600000 (default: every PASSWORD_HASHING_POLICY entry)')
+        parser.add_argument('--verifications', type=int, default=20, help='Verifications per process and setting')
+        parser.add_argument('--processes', type=int, default=1,
+                            help='Also measure with this many processes verifying in parallel')
+
+    def handle(self, *args, **options):
+        cores = os.cpu_count() or 1
+        count = options['verifications']
+        self.stdout.write(f'{cores} cores available, {count} verifications per process and setting')
+
+        for algorithm, cost, roles in self._settings(options['hashers']):
+            label = f'{algorithm}:{cost if cost is not None else "default"}'
+            try:
+                hasher = PasswordHashingPolicy.get_hasher(algorithm, cost)
+                encoded = hasher.encode(BENCH_PASSWORD, hasher.salt())
+            except ValueError as e:
+                self.stdout.write(self.style.WARNING(f'{label}: skipped ({e})'))
+                continue
+
+            started = time.perf_counter()
+            _verify(algorithm, cost, encoded, count)
+            per_core = count / (time.perf_counter() - started)
+            line = (
+                f'{label}: {per_core:.1f} verifications/s per core, {1000 / per_core:.1f} ms each, '
+                f'~{per_core * cores:.0f}/s on {cores} cores'
+            )
+
+            if options['processes'] > 1:
+                processes = options['processes']
+                with ProcessPoolExecutor(max_workers=processes) as pool:
+                    started = time.perf_counter()
+                    total = sum(pool.map(
+                        _verify, [algorithm] * processes, [cost] * processes, [encoded] * processes, [count] * processes
+                    ))
+                    line += f', measured {total / (time.perf_counter() - started):.0f}/s with {processes} processes'
+
+            if roles:
+                line += f' [{", ".join(roles)}]'
+            self.stdout.write(line)
+
+    def _settings(self, requested):
+        """(algorithm, cost, roles using it) for every setting to measure"""
+        if requested:
+            measured = []
+            for value in requested:
+                algorithm, _, cost = value.partition(':')
+                try:
+                    measured.append((algorithm, int(cost) if cost else None, []))
+                except ValueError:
+                    raise CommandError(f'Invalid cost in {value}')
+            return measured
+
+        measured = {}
+        for role, setting in getattr(settings, 'PASSWORD_HASHING_POLICY', {}).items():
+            key = (setting.get('algorithm', 'default'), setting.get('cost'))
+            measured.setdefault(key, []).append(role)
+        return [(algorithm, cost, roles) for (algorithm, cost), roles in measured.items()]
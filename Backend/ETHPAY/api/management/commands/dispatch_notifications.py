@@ -0,0 +1,62 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.models import Notification
+from api.notifications import NotificationDispatcher
+
+
+class Command(BaseCommand):
+    help = 'Deliver pending notifications in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='Dispatcher threads in this process')
+        parser.add_argument('--batch-size', type=int, default=settings.NOTIFICATION_BATCH_SIZE,
+                            help='Notifications claimed per batch')
+        parser.add_argument('--once', action='store_true', help='Exit once no notification is pending')
+
+    def handle(self, *args, **options):
+        totals = {'sent': 0, 'failed': 0}
+        totals_lock = threading.Lock()
+        stop = threading.Event()
+
+        def work():
+            dispatcher = NotificationDispatcher(batch_size=options['batch_size'])
+            try:
+                if not options['once']:
+                    dispatcher.run(stop)
+                    return
+                while True:
+                    sent, failed = dispatcher.run_once()
+                    if not sent and not failed:
+                        return
+                    with totals_lock:
+                        totals['sent'] += sent
+                        totals['failed'] += failed
+            finally:
+                connection.close()
+
+        pending = Notification.objects.filter(status='PENDING').count()
+        self.stdout.write(f'{pending} notifications pending, starting {options["workers"]} workers')
+        started = time.perf_counter()
+        threads = [threading.Thread(target=work, name=f'notification-dispatcher-{index}')
+                   for index in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - started
+
+        delivered = totals['sent'] + totals['failed']
+        self.stdout.write(self.style.SUCCESS(
+            f'Sent {totals["sent"]} notifications, {totals["failed"]} failed, in {elapsed:.2f}s'
+            + (f' ({delivered / elapsed:.0f} notifications/s)' if delivered and elapsed else '')
+        ))
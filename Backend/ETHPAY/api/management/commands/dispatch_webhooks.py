@@ -0,0 +1,74 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from api.models import WebhookDelivery
+from api.webhooks import WebhookDispatcher
+
+
+class Command(BaseCommand):
+    help = 'Deliver queued merchant webhooks, retrying failed ones with backoff'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='Dispatcher threads in this process')
+        parser.add_argument('--batch-size', type=int, default=settings.WEBHOOK_BATCH_SIZE,
+                            help='Deliveries claimed per batch')
+        parser.add_argument('--concurrency', type=int, default=settings.WEBHOOK_CONCURRENCY,
+                            help='Requests in flight per worker')
+        parser.add_argument('--once', action='store_true', help='Exit once no delivery is due')
+
+    def handle(self, *args, **options):
+        totals = {'delivered': 0, 'retrying': 0, 'failed': 0}
+        totals_lock = threading.Lock()
+        stop = threading.Event()
+
+        def work():
+            dispatcher = WebhookDispatcher(batch_size=options['batch_size'], concurrency=options['concurrency'])
+            try:
+                if not options['once']:
+                    dispatcher.run(stop)
+                    return
+                while True:
+                    delivered, retrying, failed = dispatcher.run_once()
+                    if not delivered and not retrying and not failed:
+                        return
+                    with totals_lock:
+                        totals['delivered'] += delivered
+                        totals['retrying'] += retrying
+                        totals['failed'] += failed
+            finally:
+                connection.close()
+
+        pending = WebhookDelivery.objects.filter(status='PENDING').count()
+        self.stdout.write(f'{pending} webhooks pending, starting {options["workers"]} workers')
+        started = time.perf_counter()
+        threads = [threading.Thread(target=work, name=f'webhook-dispatcher-{index}')
+                   for index in range(options['workers'])]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            stop.set()
+            for thread in threads:
+                thread.join()
+        elapsed = time.perf_counter() - started
+
+        attempted = sum(totals.values())
+        self.stdout.write(self.style.SUCCESS(
+            f'Delivered {totals["delivered"]} webhooks, {totals["retrying"]} to retry, {totals["failed"]} failed, '
+            f'in {elapsed:.2f}s' + (f' ({attempted / elapsed:.0f} attempts/s)' if attempted and elapsed else '')
+        ))
+
+        stats = WebhookDispatcher.stats()
+        if stats['window']:
+            delivery, request = stats['delivery_ms'], stats['request_ms']
+            self.stdout.write(
+                f'Last {stats["window"]} deliveries: enqueue to delivery p50 {delivery["p50"]} ms, '
+                f'p95 {delivery["p95"]} ms, p99 {delivery["p99"]} ms; request p50 {request["p50"]} ms, '
+                f'p95 {request["p95"]} ms, p99 {request["p99"]} ms; {stats["retried"]} needed retries'
+            )
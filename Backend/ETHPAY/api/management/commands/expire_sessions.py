@@ -0,0 +1,51 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from api.services import SessionManager
+
+
+class Command(BaseCommand):
+    help = 'Deactivate expired sessions and delete old ones in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Sessions updated or deleted per statement')
+        parser.add_argument('--retention-days', type=int, default=settings.SESSION_RETENTION_DAYS,
+                            help='Delete sessions that expired more than this many days ago (0 = keep)')
+        parser.add_argument('--every', type=int, default=0,
+                            help='Keep running and sweep every this many seconds (0 = run once)')
+
+    def handle(self, *args, **options):
+        while True:
+            self._sweep(options['batch_size'], options['retention_days'])
+            if not options['every']:
+                return
+            time.sleep(options['every'])
+            close_old_connections()
+
+    def _sweep(self, batch_size, retention_days):
+        now = timezone.now()
+
+        started = time.perf_counter()
+        expired = SessionManager.sweep_expired(now, batch_size=batch_size)
+        self._report(f'Expired {expired} sessions', expired, time.perf_counter() - started)
+
+        if retention_days:
+            before = now - timedelta(days=retention_days)
+            started = time.perf_counter()
+            deleted = SessionManager.purge_sessions(before, batch_size=batch_size)
+            self._report(
+                f'Deleted {deleted} sessions that expired before {before:%Y-%m-%d}',
+                deleted,
+                time.perf_counter() - started
+            )
+
+    def _report(self, message, rows, elapsed):
+        self.stdout.write(
+            f'{message} in {elapsed:.2f}s'
+            + (f' ({rows / elapsed:.0f} rows/s)' if rows and elapsed else '')
+        )
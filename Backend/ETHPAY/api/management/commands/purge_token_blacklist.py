@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.services import AuthenticationManager
+
+
+class Command(BaseCommand):
+    help = 'Delete expired refresh tokens and their blacklist entries in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000, help='Tokens deleted per statement')
+        parser.add_argument('--every', type=int, default=0,
+                            help='Keep running and purge every this many seconds (0 = run once)')
+
+    def handle(self, *args, **options):
+        while True:
+            started = time.perf_counter()
+            tokens, blacklisted = AuthenticationManager.purge_expired_tokens(batch_size=options['batch_size'])
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'Deleted {tokens} expired refresh tokens ({blacklisted} blacklisted) in {elapsed:.2f}s'
+                + (f' ({tokens / elapsed:.0f} rows/s)' if tokens and elapsed else '')
+            )
+            if not options['every']:
+                return
+            time.sleep(options['every'])
+            close_old_connections()
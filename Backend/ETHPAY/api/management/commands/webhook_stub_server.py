@@ -0,0 +1,127 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+from api.webhooks import DELIVERY_HEADER, EVENT_HEADER, SIGNATURE_HEADER, verify_signature
+
+
+class WebhookStubServer:
+    """
+    Local merchant endpoint for exercising webhook delivery.
+
+    Accepts POSTs on any path, answers 401 to a signature not made with
+    secret (the merchant's webhook secret), fails fail_rate of the valid
+    requests with a 503 and delays every response by delay_ms. Valid requests
+    are kept in received, one dict per request. Usable in-process:
+    `with WebhookStubServer(secret) as stub:` serves on stub.url until the
+    block exits.
+    """
+
+    def __init__(self, secret, host='127.0.0.1', port=0, fail_rate=0.0, delay_ms=0, quiet=True):
+        self.fail_rate = fail_rate
+        self.delay_ms = delay_ms
+        self.secret = secret
+        self.quiet = quiet
+        self.received = []
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}/webhook'
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Keep-alive responses are written in two parts; don't let Nagle hold back the body
+            disable_nagle_algorithm = True
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if stub.delay_ms:
+                    time.sleep(stub.delay_ms / 1000)
+                if not verify_signature(body, self.headers.get(SIGNATURE_HEADER), stub.secret):
+                    with stub._lock:
+                        stub.rejected += 1
+                    return self._reply(401, {'error': 'invalid signature'})
+                if stub.fail_rate and random.random() < stub.fail_rate:
+                    return self._reply(503, {'error': 'simulated failure'})
+                with stub._lock:
+                    stub.received.append({
+                        'delivery_id': self.headers.get(DELIVERY_HEADER),
+                        'event': self.headers.get(EVENT_HEADER),
+                        'host': self.headers.get('Host'),
+                        'payload': json.loads(body),
+                    })
+                self._reply(200, {'received': True})
+
+            def _reply(self, status_code, data):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                if not stub.quiet:
+                    super().log_message(format, *args)
+
+        return Handler
+
+    def serve(self):
+        """Serve in the calling thread until interrupted"""
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='webhook-stub-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+class Command(BaseCommand):
+    help = (
+        'Run a local merchant webhook endpoint that checks signatures (for trying out dispatch_webhooks '
+        'with WEBHOOK_ALLOW_PRIVATE_TARGETS=1)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('secret', help="The merchant's webhook secret (GET /api/webhooks/secret/)")
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8009)
+        parser.add_argument('--fail-rate', type=float, default=0.0, help='Fraction of valid requests answered with 503')
+        parser.add_argument('--delay-ms', type=int, default=0, help='Delay before every response')
+
+    def handle(self, *args, **options):
+        stub = WebhookStubServer(
+            options['secret'], options['host'], options['port'], options['fail_rate'], options['delay_ms'], quiet=False
+        )
+        self.stdout.write(f'Accepting webhooks on {stub.url} (Ctrl+C to stop)')
+        try:
+            stub.serve()
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f'{len(stub.received)} webhooks received, {stub.rejected} rejected signatures')
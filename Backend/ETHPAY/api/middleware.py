@@ -0,0 +1,65 @@
+# api/middleware.py
+from django.conf import settings
+from django.db import connection
+
+
+class QueryBudgetExceeded(AssertionError):
+    """Raised in strict mode when a view issues more SQL statements than its declared budget"""
+
+
+def query_budget(max_queries):
+    """
+    Declare how many SQL statements a view may issue per request.
+    Apply it above @api_view so the budget is set on the final view callable.
+    """
+    def decorator(view_func):
+        view_func.query_budget = max_queries
+        return view_func
+    return decorator
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class QueryBudgetMiddleware:
+    """
+    Development/test middleware that counts the SQL statements of every request.
+
+    The count is returned in the X-Query-Count header. When the view declared a
+    budget with @query_budget and exceeded it, the request fails with
+    QueryBudgetExceeded if QUERY_BUDGET_STRICT is set (the default under
+    `manage.py test`), otherwise a warning is printed. Disabled unless
+    QUERY_BUDGET_ENABLED is set.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.enabled = getattr(settings, 'QUERY_BUDGET_ENABLED', settings.DEBUG)
+        self.strict = getattr(settings, 'QUERY_BUDGET_STRICT', False)
+
+    def __call__(self, request):
+        if not self.enabled:
+            return self.get_response(request)
+
+        counter = _QueryCounter()
+        with connection.execute_wrapper(counter):
+            response = self.get_response(request)
+
+        response['X-Query-Count'] = str(counter.count)
+        budget = getattr(request, '_query_budget', None)
+        if budget is not None and counter.count > budget:
+            message = f'{request.method} {request.path} issued {counter.count} SQL statements, budget is {budget}'
+            if self.strict:
+                raise QueryBudgetExceeded(message)
+            print(f"Query budget exceeded: {message}")
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        request._query_budget = getattr(view_func, 'query_budget', None)
+        return None
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicefeecalculator',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:12
+
+import django.db.models.deletion
+import uuid
+from decimal import Decimal
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_servicefeecalculator_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeeSchedule',
+            fields=[
+                ('schedule_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('is_active', models.BooleanField(default=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('merchant_id', models.OneToOneField(db_column='merchant_id', on_delete=django.db.models.deletion.CASCADE, related_name='fee_schedule', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='FeeTier',
+            fields=[
+                ('tier_id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('threshold', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=12)),
+                ('fee_percentage', models.DecimalField(decimal_places=4, default=Decimal('0.0200'), max_digits=5)),
+                ('minimum_fee', models.DecimalField(decimal_places=2, default=Decimal('0.50'), max_digits=10)),
+                ('maximum_fee', models.DecimalField(decimal_places=2, default=Decimal('100.00'), max_digits=10)),
+                ('schedule_id', models.ForeignKey(db_column='schedule_id', on_delete=django.db.models.deletion.CASCADE, related_name='tiers', to='api.feeschedule')),
+            ],
+            options={
+                'ordering': ['threshold'],
+                'constraints': [models.UniqueConstraint(fields=('schedule_id', 'threshold'), name='unique_fee_tier_threshold'), models.CheckConstraint(condition=models.Q(('fee_percentage__gte', 0), ('fee_percentage__lte', 0.1)), name='fee_tier_percentage_range'), models.CheckConstraint(condition=models.Q(('maximum_fee__gt', models.F('minimum_fee'))), name='fee_tier_max_greater_than_min')],
+            },
+        ),
+    ]
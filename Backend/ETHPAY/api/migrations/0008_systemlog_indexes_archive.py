@@ -0,0 +1,60 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_systemlog_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SystemLogArchive',
+            fields=[
+                ('log_id', models.UUIDField(editable=False, primary_key=True, serialize=False)),
+                ('partition', models.CharField(max_length=7)),
+                ('action', models.CharField(max_length=100)),
+                ('timestamp', models.DateTimeField()),
+                ('status', models.CharField(choices=[('SUCCESS', 'Success'), ('FAILED', 'Failed'), ('PENDING', 'Pending')], default='SUCCESS', max_length=20)),
+                ('details', models.TextField(blank=True, null=True)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='systemlog',
+            index=models.Index(fields=['-timestamp'], name='systemlog_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='systemlog',
+            index=models.Index(fields=['user_id', '-timestamp'], name='systemlog_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='systemlog',
+            index=models.Index(fields=['status', '-timestamp'], name='systemlog_status_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='systemlog',
+            index=models.Index(fields=['action', '-timestamp'], name='systemlog_action_time_idx'),
+        ),
+        migrations.AddField(
+            model_name='systemlogarchive',
+            name='user_id',
+            field=models.ForeignKey(blank=True, db_column='user_id', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_logs', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='systemlogarchive',
+            index=models.Index(fields=['partition', '-timestamp'], name='syslogarch_part_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='systemlogarchive',
+            index=models.Index(fields=['user_id', '-timestamp'], name='syslogarch_user_time_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='systemlogarchive',
+            index=models.Index(fields=['status', '-timestamp'], name='syslogarch_status_time_idx'),
+        ),
+    ]
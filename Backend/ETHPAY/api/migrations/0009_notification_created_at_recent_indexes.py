@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:23
+
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_created_at(apps, schema_editor):
+    # Sent notifications were created no later than they were sent
+    Notification = apps.get_model('api', 'Notification')
+    Notification.objects.filter(sent_at__isnull=False).update(created_at=F('sent_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_systemlog_indexes_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='notification',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.RunPython(backfill_created_at, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user_id', '-created_at', '-notification_id'], name='notification_user_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['user_id', '-created_at', '-transaction_id'], name='transaction_user_recent_idx'),
+        ),
+    ]
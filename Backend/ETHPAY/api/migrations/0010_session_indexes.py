@@ -0,0 +1,21 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_notification_created_at_recent_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['user_id', 'is_active', 'expires_at'], name='session_user_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='session',
+            index=models.Index(fields=['is_active', 'expires_at'], name='session_active_expiry_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 09:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_notification_next_attempt_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='webhook_secret',
+            field=models.CharField(blank=True, default='', max_length=64),
+        ),
+    ]
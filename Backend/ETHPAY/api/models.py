@@ -1,7 +1,9 @@
 # api/models.py
 import uuid
 from django.db import models
+from django.utils import timezone
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager, PermissionsMixin, Group, Permission
+from .hashing import PasswordHashingPolicy
 
 # Custom User Manager
 class UserManager(BaseUserManager):
@@ -49,6 +51,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     is_active = models.BooleanField(default=True)
     is_staff = models.BooleanField(default=False)
     date_joined = models.DateTimeField(auto_now_add=True)
+    # Merchants: HMAC key their payment webhooks are signed with (api.webhooks)
+    webhook_secret = models.CharField(max_length=64, blank=True, default='')
 
     # Fix for clash errors
     groups = models.ManyToManyField(
@@ -75,6 +79,28 @@ class User(AbstractBaseUser, PermissionsMixin):
     def __str__(self):
         return self.email
     
+    def set_password(self, raw_password):
+        """Hash with the algorithm and cost that PASSWORD_HASHING_POLICY sets for the user's role"""
+        self.password = PasswordHashingPolicy.make_password(raw_password, self.role)
+        self._password = raw_password
+    
+    def check_password(self, raw_password):
+        """Verify the password, rehashing it when the role's hashing policy changed"""
+        def setter(raw_password):
+            self.set_password(raw_password)
+            # Password hash upgrades shouldn't be considered password changes
+            self._password = None
+            self.save(update_fields=['password'])
+        return PasswordHashingPolicy.check_password(raw_password, self.password, setter, self.role)
+
+    def refresh_from_db(self, using=None, fields=None, from_queryset=None):
+        """Reading one deferred field loads every deferred field, so a user built from token claims costs one query"""
+        if fields is not None:
+            deferred = self.get_deferred_fields()
+            if deferred & set(fields):
+                fields = set(fields) | deferred
+        super().refresh_from_db(using=using, fields=fields, from_queryset=from_queryset)
+
     class Meta:
         constraints = [
             models.UniqueConstraint(
@@ -93,6 +119,14 @@ class Session(models.Model):
     expires_at = models.DateTimeField()
     is_active = models.BooleanField(default=True)
     
+    class Meta:
+        indexes = [
+            # create_session's "active session of this user" lookup
+            models.Index(fields=['user_id', 'is_active', 'expires_at'], name='session_user_active_idx'),
+            # Expiry sweeps and purges
+            models.Index(fields=['is_active', 'expires_at'], name='session_active_expiry_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.session_id} - {self.user_id.email}"
 
@@ -156,6 +190,8 @@ class Payment(models.Model):
     ])
     created_at = models.DateTimeField(auto_now_add=True)
     processed_at = models.DateTimeField(null=True, blank=True)
+    # Merchant endpoint notified of status changes (api.webhooks)
+    callback_url = models.URLField(max_length=500, blank=True, default='')
     
     def __str__(self):
         return f"Payment {self.payment_id} - {self.amount} {self.currency}"
@@ -178,6 +214,11 @@ class Transaction(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', '-created_at', '-transaction_id'], name='transaction_user_recent_idx'),
+        ]
+    
     def __str__(self):
         return f"Transaction {self.transaction_id} - {self.status}"
 
@@ -217,11 +258,58 @@ class Notification(models.Model):
         ('SENT', 'Sent'),
         ('FAILED', 'Failed')
     ])
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Set while a dispatch worker delivers the notification (api.notifications)
+    claimed_by = models.CharField(max_length=64, blank=True, default='')
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    # A failed delivery is retried from here on
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_id', '-created_at', '-notification_id'], name='notification_user_recent_idx'),
+            # Dispatch workers claim the pending notifications that are due, oldest first
+            models.Index(fields=['status', 'next_attempt_at'], name='notification_dispatch_idx'),
+        ]
     
     def __str__(self):
         return f"Notification {self.notification_id} - {self.type}"
 
 
+# WebhookDelivery - queued merchant callback (api.webhooks)
+class WebhookDelivery(models.Model):
+    delivery_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    payment_id = models.ForeignKey(Payment, on_delete=models.CASCADE, related_name='webhook_deliveries', db_column='payment_id')
+    event = models.CharField(max_length=50)
+    url = models.URLField(max_length=500)
+    payload = models.JSONField()
+    status = models.CharField(max_length=20, default='PENDING', choices=[
+        ('PENDING', 'Pending'),
+        ('DELIVERED', 'Delivered'),
+        ('FAILED', 'Failed')
+    ])
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    claimed_by = models.CharField(max_length=64, blank=True, default='')
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    latency_ms = models.PositiveIntegerField(null=True, blank=True)  # Duration of the last attempt
+    created_at = models.DateTimeField(auto_now_add=True)
+    delivered_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        indexes = [
+            # Dispatch workers claim the due pending deliveries
+            models.Index(fields=['status', 'next_attempt_at'], name='webhook_dispatch_idx'),
+            models.Index(fields=['status', '-delivered_at'], name='webhook_delivered_idx'),
+        ]
+    
+    def __str__(self):
+        return f"Webhook {self.delivery_id} - {self.event} ({self.status})"
+
+
 # WalletIntegration / BankAPI - CLASS 31
 class WalletIntegration(models.Model):
     api_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
@@ -243,7 +331,7 @@ class SystemLog(models.Model):
     log_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     user_id = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, db_column='user_id')
     action = models.CharField(max_length=100)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)  # Set when logged, not when the buffered row is written
     status = models.CharField(max_length=20, default='SUCCESS', choices=[
         ('SUCCESS', 'Success'),
         ('FAILED', 'Failed'),
@@ -251,8 +339,74 @@ class SystemLog(models.Model):
     ])
     details = models.TextField(blank=True, null=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['-timestamp'], name='systemlog_time_idx'),
+            models.Index(fields=['user_id', '-timestamp'], name='systemlog_user_time_idx'),
+            models.Index(fields=['status', '-timestamp'], name='systemlog_status_time_idx'),
+            models.Index(fields=['action', '-timestamp'], name='systemlog_action_time_idx'),
+        ]
+    
     def __str__(self):
         return f"Log {self.log_id} - {self.action} - {self.status}"
+
+# SystemLogArchive - SystemLog rows moved out of the live table. partition (the
+# month) leads the main index so month ranges are index range scans; the table
+# itself is not partitioned by the database.
+class SystemLogArchive(models.Model):
+    log_id = models.UUIDField(primary_key=True, editable=False)
+    partition = models.CharField(max_length=7)  # YYYY-MM of the timestamp
+    user_id = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, db_column='user_id',
+                                related_name='archived_logs')
+    action = models.CharField(max_length=100)
+    timestamp = models.DateTimeField()
+    status = models.CharField(max_length=20, default='SUCCESS', choices=[
+        ('SUCCESS', 'Success'),
+        ('FAILED', 'Failed'),
+        ('PENDING', 'Pending')
+    ])
+    details = models.TextField(blank=True, null=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['partition', '-timestamp'], name='syslogarch_part_time_idx'),
+            models.Index(fields=['user_id', '-timestamp'], name='syslogarch_user_time_idx'),
+            models.Index(fields=['status', '-timestamp'], name='syslogarch_status_time_idx'),
+        ]
+    
+    @staticmethod
+    def partition_for(timestamp):
+        return timezone.localtime(timestamp).strftime('%Y-%m')
+    
+    def __str__(self):
+        return f"Archived log {self.log_id} - {self.action} - {self.status}"
+
+# IdempotencyKey - stored responses for retried payment requests
+class IdempotencyKey(models.Model):
+    scope = models.CharField(max_length=50)  # Endpoint the key belongs to
+    key = models.CharField(max_length=255)  # Idempotency-Key header (prefixed with the user id when authenticated)
+    status = models.CharField(max_length=20, default='IN_PROGRESS', choices=[
+        ('IN_PROGRESS', 'In Progress'),
+        ('COMPLETED', 'Completed')
+    ])
+    response_status = models.PositiveSmallIntegerField(null=True, blank=True)
+    response_body = models.JSONField(null=True, blank=True)
+    request_hash = models.CharField(max_length=64, blank=True, default='')  # Keyed hash of the request body
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+    # An IN_PROGRESS key whose lease ran out (its worker died) can be claimed again
+    lease_expires_at = models.DateTimeField(null=True, blank=True)
+    
+    def __str__(self):
+        return f"{self.scope}:{self.key} - {self.status}"
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['scope', 'key'], name='unique_idempotency_key')
+        ]
+
+
 # In api/models.py - Update the ServiceFeeCalculator model
 from decimal import Decimal
 
@@ -264,6 +418,7 @@ class ServiceFeeCalculator(models.Model):
     fee_percentage = models.DecimalField(max_digits=5, decimal_places=4, default=Decimal('0.0200'))  # Changed to 4 decimal places
     minimum_fee = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.50'))
     maximum_fee = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('100.00'))
+    version = models.PositiveIntegerField(default=1)  # Bumped on every rule change to invalidate cached snapshots
     
     def __str__(self):
         return f"Fee Calculator - {float(self.fee_percentage)*100}%"
@@ -278,4 +433,42 @@ class ServiceFeeCalculator(models.Model):
                 check=models.Q(maximum_fee__gt=models.F('minimum_fee')),
                 name='max_fee_greater_than_min'
             )
-        ]
\ No newline at end of file
+        ]
+
+
+# FeeSchedule - per-merchant tiered fee rules, overriding ServiceFeeCalculator
+class FeeSchedule(models.Model):
+    schedule_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    merchant_id = models.OneToOneField(User, on_delete=models.CASCADE, related_name='fee_schedule', db_column='merchant_id')
+    is_active = models.BooleanField(default=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return f"Fee Schedule - {self.merchant_id.email}"
+
+
+# FeeTier - rate applied to payments of at least `threshold`
+class FeeTier(models.Model):
+    tier_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    schedule_id = models.ForeignKey(FeeSchedule, on_delete=models.CASCADE, related_name='tiers', db_column='schedule_id')
+    threshold = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    fee_percentage = models.DecimalField(max_digits=5, decimal_places=4, default=Decimal('0.0200'))
+    minimum_fee = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('0.50'))
+    maximum_fee = models.DecimalField(max_digits=10, decimal_places=2, default=Decimal('100.00'))
+    
+    def __str__(self):
+        return f"Fee Tier >= {self.threshold} - {float(self.fee_percentage)*100}%"
+    
+    class Meta:
+        ordering = ['threshold']
+        constraints = [
+            models.UniqueConstraint(fields=['schedule_id', 'threshold'], name='unique_fee_tier_threshold'),
+            models.CheckConstraint(
+                check=models.Q(fee_percentage__gte=0) & models.Q(fee_percentage__lte=0.10),
+                name='fee_tier_percentage_range'
+            ),
+            models.CheckConstraint(
+                check=models.Q(maximum_fee__gt=models.F('minimum_fee')),
+                name='fee_tier_max_greater_than_min'
+            )
+        ]
@@ -0,0 +1,205 @@
+# api/notifications.py
+import json
+import os
+import random
+import socket
+import threading
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import Notification
+
+
+# Delivery channels - one instance per notification type
+class NotificationChannel:
+    """
+    Delivers a batch of notifications of one type.
+    send() returns {notification_id: error} for the ones that could not be
+    delivered; raising fails the whole batch.
+    """
+
+    def send(self, notifications):
+        raise NotImplementedError
+
+
+class ConsoleChannel(NotificationChannel):
+    """Prints notifications - local stand-in for an SMS or email gateway"""
+
+    def send(self, notifications):
+        for notification in notifications:
+            print(f"[{notification.type}] to {_recipient(notification)}: {notification.message}")
+        return {}
+
+
+class FileChannel(NotificationChannel):
+    """Appends notifications as JSON lines to NOTIFICATION_OUTBOX_DIR/<type>.log - local stand-in for a gateway"""
+    _lock = threading.Lock()
+
+    def send(self, notifications):
+        if not notifications:
+            return {}
+        outbox = settings.NOTIFICATION_OUTBOX_DIR
+        os.makedirs(outbox, exist_ok=True)
+        lines = ''.join(
+            json.dumps({
+                'notification_id': str(notification.notification_id),
+                'to': _recipient(notification),
+                'message': notification.message,
+                'created_at': notification.created_at.isoformat(),
+            }) + '\n'
+            for notification in notifications
+        )
+        with self._lock, open(os.path.join(outbox, f'{notifications[0].type.lower()}.log'), 'a') as outbox_file:
+            outbox_file.write(lines)
+        return {}
+
+
+class InAppChannel(NotificationChannel):
+    """In-app notifications are pushed on /api/events/ when created and read through /api/notifications/; delivery only marks them sent"""
+
+    def send(self, notifications):
+        return {}
+
+
+def _recipient(notification):
+    user = notification.user_id
+    return user.phone_number if notification.type == 'SMS' else user.email
+
+
+class NotificationDispatcher:
+    """
+    Claims PENDING notifications in batches and delivers them through the
+    channel NOTIFICATION_CHANNELS configures for their type.
+
+    A batch is claimed by stamping claimed_by/claimed_at on the oldest unclaimed
+    rows with one conditional UPDATE, so concurrent workers (threads or
+    processes) never claim the same notification; where the database supports
+    it, candidates are first selected with SELECT ... FOR UPDATE SKIP LOCKED so
+    workers don't contend for the same rows. Results are written back with one
+    UPDATE for the sent rows and one per outcome for the failed ones. A claim
+    older than NOTIFICATION_CLAIM_TIMEOUT seconds (a worker that died mid-batch)
+    can be claimed again. A failed notification is retried after
+    NOTIFICATION_RETRY_BASE_SECONDS * 2^(attempts - 1), capped at
+    NOTIFICATION_RETRY_MAX_SECONDS and jittered, and marked FAILED after
+    NOTIFICATION_MAX_ATTEMPTS failed deliveries.
+    """
+
+    def __init__(self, batch_size=None, worker_id=None):
+        self.batch_size = batch_size or getattr(settings, 'NOTIFICATION_BATCH_SIZE', 500)
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+        self.channels = {
+            notification_type: import_string(path)()
+            for notification_type, path in settings.NOTIFICATION_CHANNELS.items()
+        }
+
+    def claim(self):
+        """Claim up to batch_size deliverable notifications, oldest first"""
+        now = timezone.now()
+        claimable = Notification.objects.filter(status='PENDING', next_attempt_at__lte=now).filter(
+            Q(claimed_at__isnull=True) |
+            Q(claimed_at__lt=now - timedelta(seconds=getattr(settings, 'NOTIFICATION_CLAIM_TIMEOUT', 300)))
+        )
+
+        with transaction.atomic():
+            candidates = claimable.order_by('next_attempt_at')
+            if connection.features.has_select_for_update_skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True)
+            ids = list(candidates.values_list('notification_id', flat=True)[:self.batch_size])
+            if not ids:
+                return []
+            # Re-checked by the UPDATE itself, so a row another worker claimed in the meantime is skipped
+            claimable.filter(notification_id__in=ids).update(claimed_by=self.worker_id, claimed_at=now)
+
+        return list(
+            Notification.objects.filter(notification_id__in=ids, claimed_by=self.worker_id, claimed_at=now)
+            .select_related('user_id')
+            .only(
+                'notification_id', 'message', 'type', 'created_at', 'attempts',
+                'user_id', 'user_id__email', 'user_id__phone_number'
+            )
+        )
+
+    def deliver(self, notifications):
+        """Send notifications grouped by type - Returns {notification_id: error} for the failed ones"""
+        by_type = {}
+        for notification in notifications:
+            by_type.setdefault(notification.type, []).append(notification)
+
+        failed = {}
+        for notification_type, batch in by_type.items():
+            channel = self.channels.get(notification_type)
+            if channel is None:
+                failed.update({n.notification_id: f'No channel for {notification_type}' for n in batch})
+                continue
+            try:
+                failed.update(channel.send(batch))
+            except Exception as e:
+                print(f"Notification channel {notification_type} failed: {str(e)}")
+                failed.update({n.notification_id: str(e) for n in batch})
+        return failed
+
+    def retry_delay(self, attempts):
+        """Seconds before retrying a notification that has failed attempts times"""
+        base = getattr(settings, 'NOTIFICATION_RETRY_BASE_SECONDS', 10)
+        delay = min(base * 2 ** (attempts - 1), getattr(settings, 'NOTIFICATION_RETRY_MAX_SECONDS', 3600))
+        # Jitter so notifications that failed together (a gateway outage) don't all retry together
+        return delay * random.uniform(0.5, 1.0)
+
+    def complete(self, notifications, failed):
+        """Record the outcome of a delivered batch"""
+        now = timezone.now()
+        max_attempts = getattr(settings, 'NOTIFICATION_MAX_ATTEMPTS', 3)
+        sent_ids = [n.notification_id for n in notifications if n.notification_id not in failed]
+        # Failed notifications by the number of attempts they had already failed
+        failed_ids = {}
+        for notification in notifications:
+            if notification.notification_id in failed:
+                failed_ids.setdefault(notification.attempts, []).append(notification.notification_id)
+
+        # Skip rows another worker took over after our claim timed out
+        mine = Notification.objects.filter(claimed_by=self.worker_id)
+        with transaction.atomic():
+            if sent_ids:
+                mine.filter(notification_id__in=sent_ids).update(
+                    status='SENT', sent_at=now, claimed_by='', claimed_at=None
+                )
+            for attempts, ids in failed_ids.items():
+                if attempts + 1 >= max_attempts:
+                    # Out of attempts: give up
+                    outcome = {'status': 'FAILED'}
+                else:
+                    outcome = {'next_attempt_at': now + timedelta(seconds=self.retry_delay(attempts + 1))}
+                mine.filter(notification_id__in=ids).update(
+                    attempts=F('attempts') + 1, claimed_by='', claimed_at=None, **outcome
+                )
+        return len(sent_ids), len(failed)
+
+    def run_once(self):
+        """Claim, deliver and complete one batch - Returns (sent, failed), (0, 0) when nothing was pending"""
+        notifications = self.claim()
+        if not notifications:
+            return 0, 0
+        return self.complete(notifications, self.deliver(notifications))
+
+    def run(self, stop_event=None, idle_seconds=None):
+        """Dispatch until stop_event is set, sleeping idle_seconds whenever nothing was sent"""
+        from django.db import close_old_connections
+
+        idle_seconds = idle_seconds if idle_seconds is not None else getattr(settings, 'NOTIFICATION_IDLE_SECONDS', 1.0)
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            close_old_connections()
+            try:
+                sent, failed = self.run_once()
+            except Exception as e:
+                print(f"Notification dispatch failed: {str(e)}")
+                sent = failed = 0
+            # Also back off when a whole batch failed, rather than spin on a broken channel
+            if not sent:
+                stop_event.wait(idle_seconds)
@@ -0,0 +1,82 @@
+# api/pagination.py
+from django.conf import settings
+from django.core import signing
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Newest-first keyset pagination on (ordering_field, pk).
+
+    A page is fetched with a WHERE (ordering_field, pk) < cursor ... LIMIT n
+    query, so deep pages cost the same as the first one. Cursors are signed
+    and opaque to clients. The response body is left as the view builds it
+    (a plain list, or the page inside the view's own object); the next cursor
+    is always sent in the X-Next-Cursor and Link headers, never in the body.
+    """
+    cursor_query_param = 'cursor'
+    limit_query_param = 'limit'
+    salt = 'api.pagination.keyset'
+
+    def __init__(self, ordering_field='created_at', page_size=None):
+        self.ordering_field = ordering_field
+        self.page_size = page_size or getattr(settings, 'API_PAGE_SIZE', 50)
+        self.next_cursor = None
+        self.request = None
+
+    def get_limit(self, request):
+        try:
+            limit = int(request.query_params.get(self.limit_query_param, self.page_size))
+        except (TypeError, ValueError):
+            return self.page_size
+        return max(1, min(limit, getattr(settings, 'API_MAX_PAGE_SIZE', 200)))
+
+    def encode_cursor(self, item):
+        value = getattr(item, self.ordering_field)
+        return signing.dumps([value.isoformat(), str(item.pk)], salt=self.salt, compress=True)
+
+    def decode_cursor(self, cursor):
+        try:
+            value, pk = signing.loads(cursor, salt=self.salt)
+        except (signing.BadSignature, TypeError, ValueError):
+            raise NotFound('Invalid cursor')
+        value = parse_datetime(value)
+        if value is None:
+            raise NotFound('Invalid cursor')
+        return value, pk
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """Return one page of queryset (newest first) and remember the cursor of the next page"""
+        self.request = request
+        limit = self.get_limit(request)
+        queryset = queryset.order_by(f'-{self.ordering_field}', '-pk')
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if cursor:
+            value, pk = self.decode_cursor(cursor)
+            queryset = queryset.filter(
+                Q(**{f'{self.ordering_field}__lt': value}) |
+                Q(**{self.ordering_field: value, 'pk__lt': pk})
+            )
+
+        # Fetch one extra row to learn whether there is a next page
+        items = list(queryset[:limit + 1])
+        self.next_cursor = self.encode_cursor(items[limit - 1]) if len(items) > limit else None
+        return items[:limit]
+
+    def get_next_link(self):
+        if not self.next_cursor:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, self.next_cursor)
+
+    def get_paginated_response(self, data):
+        response = Response(data)
+        if self.next_cursor:
+            response['X-Next-Cursor'] = self.next_cursor
+            response['Link'] = f'<{self.get_next_link()}>; rel="next"'
+        return response
@@ -152,7 +152,7 @@ class LoginSerializer(serializers.Serializer):
 
 # Serializer for displaying user data
 class UserSerializer(serializers.ModelSerializer):
-    userId = serializers.UUIDField(source='userId', read_only=True)
+    userId = serializers.UUIDField(read_only=True)
     fullName = serializers.CharField(source='full_name', read_only=True)
     companyName = serializers.CharField(source='company_name', read_only=True)
     phoneNumber = serializers.CharField(source='phone_number', read_only=True)
@@ -166,8 +166,8 @@ class UserSerializer(serializers.ModelSerializer):
 # Serializer for Payment
 class PaymentSerializer(serializers.ModelSerializer):
     paymentID = serializers.UUIDField(source='payment_id', read_only=True)
-    userID = serializers.UUIDField(source='user_id', read_only=True)
-    recipientID = serializers.UUIDField(source='recipient_id', read_only=True)
+    userID = serializers.UUIDField(source='user_id_id', read_only=True)
+    recipientID = serializers.UUIDField(source='recipient_id_id', read_only=True)
     createdAt = serializers.DateTimeField(source='created_at', read_only=True)
     processedAt = serializers.DateTimeField(source='processed_at', read_only=True)
 
@@ -179,8 +179,8 @@ class PaymentSerializer(serializers.ModelSerializer):
 # Serializer for Transaction
 class TransactionSerializer(serializers.ModelSerializer):
     transactionID = serializers.UUIDField(source='transaction_id', read_only=True)
-    paymentID = serializers.UUIDField(source='payment_id', read_only=True)
-    userID = serializers.UUIDField(source='user_id', read_only=True)
+    paymentID = serializers.UUIDField(source='payment_id_id', read_only=True)
+    userID = serializers.UUIDField(source='user_id_id', read_only=True)
     createdAt = serializers.DateTimeField(source='created_at', read_only=True)
     completedAt = serializers.DateTimeField(source='completed_at', read_only=True)
 
@@ -192,8 +192,8 @@ class TransactionSerializer(serializers.ModelSerializer):
 # Serializer for Receipt
 class ReceiptSerializer(serializers.ModelSerializer):
     receiptID = serializers.UUIDField(source='receipt_id', read_only=True)
-    transactionID = serializers.UUIDField(source='transaction_id', read_only=True)
-    userID = serializers.UUIDField(source='user_id', read_only=True)
+    transactionID = serializers.UUIDField(source='transaction_id_id', read_only=True)
+    userID = serializers.UUIDField(source='user_id_id', read_only=True)
     issuedAt = serializers.DateTimeField(source='issued_at', read_only=True)
 
     class Meta:
@@ -204,7 +204,7 @@ class ReceiptSerializer(serializers.ModelSerializer):
 # Serializer for Dashboard
 class DashboardSerializer(serializers.ModelSerializer):
     dashboardID = serializers.UUIDField(source='dashboard_id', read_only=True)
-    userID = serializers.UUIDField(source='user_id', read_only=True)
+    userID = serializers.UUIDField(source='user_id_id', read_only=True)
     lastUpdated = serializers.DateTimeField(source='last_updated', read_only=True)
 
     class Meta:
@@ -215,7 +215,7 @@ class DashboardSerializer(serializers.ModelSerializer):
 # Serializer for Notification
 class NotificationSerializer(serializers.ModelSerializer):
     notificationID = serializers.UUIDField(source='notification_id', read_only=True)
-    userID = serializers.UUIDField(source='user_id', read_only=True)
+    userID = serializers.UUIDField(source='user_id_id', read_only=True)
     sentAt = serializers.DateTimeField(source='sent_at', read_only=True)
 
     class Meta:
@@ -223,6 +223,16 @@ class NotificationSerializer(serializers.ModelSerializer):
         fields = ['notificationID', 'userID', 'message', 'type', 'sentAt', 'status']
 
 
+# Serializer for SystemLog (and SystemLogArchive, which has the same fields)
+class SystemLogSerializer(serializers.ModelSerializer):
+    logID = serializers.UUIDField(source='log_id', read_only=True)
+    userID = serializers.UUIDField(source='user_id_id', read_only=True)
+
+    class Meta:
+        model = SystemLog
+        fields = ['logID', 'userID', 'action', 'timestamp', 'status', 'details']
+
+
 # Serializer for WalletIntegration
 class WalletIntegrationSerializer(serializers.ModelSerializer):
     apiID = serializers.UUIDField(source='api_id', read_only=True)
@@ -1,13 +1,28 @@
 # api/services.py
+import atexit
 import os
 import secrets
 import hashlib
+import hmac
+import json
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from rest_framework_simplejwt.tokens import RefreshToken
+from functools import wraps
+from rest_framework.response import Response
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
 from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
 from django.utils import timezone
-from django.contrib.auth.hashers import make_password, check_password
-from .models import User, Session, ServiceFeeCalculator, SystemLog
+from .hashing import PasswordHashingPolicy
+from .tokens import REFRESH_JTI_CLAIM, BlacklistRefreshToken, TokenBlacklistFilter
+from .models import (
+    User, Session, ServiceFeeCalculator, SystemLog, SystemLogArchive, IdempotencyKey, FeeSchedule, FeeTier
+)
 import uuid
 # Try to import bcrypt, but use Django's hashing as fallback
 try:
@@ -33,38 +48,40 @@ class AuthenticationManager:
         return cls._secret_key
     
     @classmethod
-    def hash_password(cls, raw_password):
-        """Hash password using Django's password hasher (or bcrypt if available)"""
+    def hash_password(cls, raw_password, role=None):
+        """Hash password with the algorithm and cost PASSWORD_HASHING_POLICY sets for role"""
         if not raw_password or len(raw_password) < 8:
             raise ValueError("Password must be at least 8 characters")
         
-        if USE_BCRYPT:
-            salt = bcrypt.gensalt()
-            hashed = bcrypt.hashpw(raw_password.encode('utf-8'), salt)
-            return hashed.decode('utf-8')
-        else:
-            # Use Django's built-in password hashing (PBKDF2)
-            return make_password(raw_password)
+        return PasswordHashingPolicy.make_password(raw_password, role)
     
     @classmethod
-    def compare_password(cls, raw_password, hashed_password):
-        """Compare raw password with hashed password"""
+    def compare_password(cls, raw_password, hashed_password, setter=None, role=None):
+        """Compare raw password with hashed password - setter(raw_password) is called when it needs a rehash"""
         if not raw_password or not hashed_password:
             return False
         
         if USE_BCRYPT and hashed_password.startswith('$2b$'):
-            # bcrypt hash format
-            return bcrypt.checkpw(raw_password.encode('utf-8'), hashed_password.encode('utf-8'))
+            # Raw bcrypt hash from before the hashing policy
+            if not bcrypt.checkpw(raw_password.encode('utf-8'), hashed_password.encode('utf-8')):
+                return False
+            if setter:
+                setter(raw_password)
+            return True
         else:
             # Django's password hashing
-            return check_password(raw_password, hashed_password)
+            return PasswordHashingPolicy.check_password(raw_password, hashed_password, setter, role)
     
     @classmethod
     def generate_token(cls, user):
-        """Generate JWT token pair for user"""
-        refresh = RefreshToken.for_user(user)
+        """Generate JWT token pair for user - role and status travel as claims (see api.authentication)"""
+        refresh = BlacklistRefreshToken.for_user(user)
+        refresh['role'] = user.role
+        refresh['status'] = user.status
+        access = refresh.access_token
+        access[REFRESH_JTI_CLAIM] = refresh[api_settings.JTI_CLAIM]
         return {
-            'access': str(refresh.access_token),
+            'access': str(access),
             'refresh': str(refresh)
         }
     
@@ -76,10 +93,17 @@ class AuthenticationManager:
     
     @classmethod
     def refresh_token(cls, refresh_token):
-        """Refresh access token using refresh token"""
-        refresh = RefreshToken(refresh_token)
+        """Refresh access token using refresh token - the role and status claims are re-read from the user"""
+        refresh = BlacklistRefreshToken(refresh_token)
+        access = refresh.access_token
+        claims = User.objects.filter(pk=refresh[api_settings.USER_ID_CLAIM]).values('role', 'status', 'is_active').first()
+        if not claims or not claims.pop('is_active'):
+            raise ValueError("User not found or inactive")
+        for claim, value in claims.items():
+            access[claim] = value
+        access[REFRESH_JTI_CLAIM] = refresh[api_settings.JTI_CLAIM]
         return {
-            'access': str(refresh.access_token),
+            'access': str(access),
             'refresh': str(refresh)
         }
     
@@ -87,11 +111,94 @@ class AuthenticationManager:
     def logout_user(cls, refresh_token):
         """Invalidate refresh token"""
         try:
-            token = RefreshToken(refresh_token)
+            token = BlacklistRefreshToken(refresh_token)
             token.blacklist()
             return True
         except Exception:
             return False
+    
+    @classmethod
+    def revoke_user_tokens(cls, user):
+        """
+        Blacklist every unexpired refresh token of user, and with them the access
+        tokens issued from them - call when the user's role, status or is_active
+        changes so the old claims stop authenticating. Returns the number revoked.
+        """
+        tokens = list(
+            OutstandingToken.objects.filter(user=user, expires_at__gt=timezone.now(), blacklistedtoken__isnull=True)
+            .values_list('id', 'jti')
+        )
+        BlacklistedToken.objects.bulk_create(
+            [BlacklistedToken(token_id=token_id) for token_id, _ in tokens], ignore_conflicts=True
+        )
+        for _, jti in tokens:
+            TokenBlacklistFilter.add(jti)
+        return len(tokens)
+    
+    @classmethod
+    def purge_expired_tokens(cls, before=None, batch_size=5000):
+        """
+        Delete outstanding refresh tokens that expired before before (default now),
+        with their blacklist entries, in batches of batch_size tokens.
+        Returns (tokens deleted, blacklist entries deleted).
+        """
+        before = before or timezone.now()
+        tokens = blacklisted = 0
+        while True:
+            batch = list(
+                OutstandingToken.objects.filter(expires_at__lt=before).values_list('id', flat=True)[:batch_size]
+            )
+            if not batch:
+                return tokens, blacklisted
+            # The blacklist entries go with their token (one DELETE per table)
+            _, deleted = OutstandingToken.objects.filter(id__in=batch).delete()
+            tokens += deleted.get(OutstandingToken._meta.label, 0)
+            blacklisted += deleted.get(BlacklistedToken._meta.label, 0)
+
+
+# Process-local LRU cache with per-entry expiry
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries expire ttl seconds after they are set
+    """
+    
+    def __init__(self, maxsize=1024, ttl=60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        """Return the cached value, or default when missing or expired"""
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, expires = item
+            if expires <= time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+    
+    def set(self, key, value, ttl=None):
+        """Cache value, evicting the least recently used entries beyond maxsize"""
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+    
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def __len__(self):
+        return len(self._data)
 
 
 # Session Manager - CLASS 7
@@ -99,7 +206,25 @@ class AuthenticationManager:
 class SessionManager:
     """
     Manages user sessions
+    
+    Validation is served from a process-local TTL cache of session id ->
+    (user pk, expires_at), with short-lived negative entries for unknown or
+    inactive ids, so the hot path never touches the Session table. Other
+    workers see a termination once their entry expires (SESSION_CACHE_TTL).
+    Expired rows are deactivated in bulk by a background sweeper every
+    SESSION_SWEEP_SECONDS instead of one save() per validation.
     """
+    _cache = TTLCache(
+        maxsize=getattr(settings, 'SESSION_CACHE_SIZE', 10000),
+        ttl=getattr(settings, 'SESSION_CACHE_TTL', 60)
+    )
+    _user_sessions = TTLCache(
+        maxsize=getattr(settings, 'SESSION_CACHE_SIZE', 10000),
+        ttl=getattr(settings, 'SESSION_CACHE_TTL', 60)
+    )
+    _sweeper = None
+    _sweeper_pid = None
+    _sweeper_lock = threading.Lock()
     
     @staticmethod
     def generate_session_id():
@@ -120,18 +245,26 @@ class SessionManager:
                 # It's already a User object
                 user_obj = user
             
-            # Check if user has active session
+            cls._ensure_sweeper()
+            now = timezone.now()
+            
+            # Reuse the user's active session, from the cache when possible
+            session_id = cls._user_sessions.get(user_obj.pk)
+            if session_id and cls._cached_expiry(session_id, now):
+                return session_id
+            
             existing_session = Session.objects.filter(
                 user_id=user_obj,
                 is_active=True,
-                expires_at__gt=timezone.now()
+                expires_at__gt=now
             ).first()
             
             if existing_session:
+                cls._remember(existing_session.session_id, user_obj.pk, existing_session.expires_at)
                 return existing_session.session_id
             
             session_id = cls.generate_session_id()
-            expires_at = timezone.now() + timedelta(hours=expiry_hours)
+            expires_at = now + timedelta(hours=expiry_hours)
             
             session = Session.objects.create(
                 session_id=session_id,
@@ -140,6 +273,7 @@ class SessionManager:
                 is_active=True
             )
             
+            cls._remember(session.session_id, user_obj.pk, expires_at)
             return str(session.session_id)
         except UserModel.DoesNotExist:
             raise ValueError(f"User does not exist")
@@ -150,30 +284,113 @@ class SessionManager:
     @classmethod
     def validate_session(cls, session_id):
         """Validate if session is active and not expired"""
-        try:
-            session = Session.objects.get(session_id=session_id)
-            if not session.is_active:
-                return False
-            
-            if session.expires_at <= timezone.now():
-                session.is_active = False
-                session.save()
-                return False
-            
-            return True
-        except Session.DoesNotExist:
+        cls._ensure_sweeper()
+        now = timezone.now()
+        
+        entry = cls._cache.get(session_id, False)
+        if entry is False:
+            row = Session.objects.filter(session_id=session_id).values_list(
+                'user_id', 'is_active', 'expires_at'
+            ).first()
+            if row and row[1] and row[2] > now:
+                cls._remember(session_id, row[0], row[2])
+                return True
+            cls._forget(session_id)
             return False
+        
+        return cls._cached_expiry(session_id, now) is not None
     
     @classmethod
     def terminate_session(cls, session_id):
         """Terminate a session"""
-        try:
-            session = Session.objects.get(session_id=session_id)
-            session.is_active = False
-            session.save()
-            return True
-        except Session.DoesNotExist:
-            return False
+        terminated = Session.objects.filter(session_id=session_id).update(is_active=False)
+        cls._forget(session_id)
+        return terminated > 0
+    
+    @classmethod
+    def sweep_expired(cls, now=None, batch_size=5000):
+        """
+        Deactivate every expired session with one UPDATE per batch_size rows.
+        Returns the number of sessions expired.
+        """
+        now = now or timezone.now()
+        expired = 0
+        while True:
+            batch = list(
+                Session.objects.filter(is_active=True, expires_at__lte=now)
+                .values_list('session_id', flat=True)[:batch_size]
+            )
+            if not batch:
+                return expired
+            expired += Session.objects.filter(session_id__in=batch).update(is_active=False)
+    
+    @classmethod
+    def purge_sessions(cls, before, batch_size=5000):
+        """
+        Delete sessions that expired before before, active or not, with one
+        DELETE per batch_size rows. Returns the number of sessions deleted.
+        """
+        deleted = 0
+        while True:
+            batch = list(
+                Session.objects.filter(expires_at__lt=before)
+                .values_list('session_id', flat=True)[:batch_size]
+            )
+            if not batch:
+                return deleted
+            count, _ = Session.objects.filter(session_id__in=batch).delete()
+            deleted += count
+    
+    @classmethod
+    def _cached_expiry(cls, session_id, now):
+        """expires_at of a cached active session, None when it is unknown, inactive or expired"""
+        entry = cls._cache.get(session_id)
+        if entry is None:
+            return None
+        if entry[1] <= now:
+            # Expired in the meantime; the sweeper deactivates the row
+            cls._forget(session_id)
+            return None
+        return entry[1]
+    
+    @classmethod
+    def _remember(cls, session_id, user_pk, expires_at):
+        cls._cache.set(session_id, (user_pk, expires_at))
+        cls._user_sessions.set(user_pk, session_id)
+    
+    @classmethod
+    def _forget(cls, session_id):
+        # Negative entry, so repeated checks of a dead id stay off the database too
+        cls._cache.set(session_id, None, ttl=getattr(settings, 'SESSION_NEGATIVE_CACHE_TTL', 10))
+    
+    @classmethod
+    def _ensure_sweeper(cls):
+        # Started lazily, and again in a worker forked from a process that already had one
+        interval = getattr(settings, 'SESSION_SWEEP_SECONDS', 300)
+        if not interval or (cls._sweeper is not None and cls._sweeper_pid == os.getpid()):
+            return
+        with cls._sweeper_lock:
+            if cls._sweeper is not None and cls._sweeper_pid == os.getpid():
+                return
+            cls._sweeper_pid = os.getpid()
+            cls._sweeper = threading.Thread(target=cls._run_sweeper, args=(interval,), name='session-sweeper', daemon=True)
+            cls._sweeper.start()
+    
+    @classmethod
+    def _run_sweeper(cls, interval):
+        from django.db import close_old_connections
+        
+        while True:
+            time.sleep(interval)
+            close_old_connections()
+            try:
+                expired = cls.sweep_expired()
+                if expired:
+                    print(f"Session sweeper expired {expired} sessions")
+            except Exception as e:
+                print(f"Session sweep failed: {str(e)}")
+
+
 # Validator - CLASS 10
 class Validator:
     """
@@ -288,13 +505,27 @@ from decimal import Decimal
 class ServiceFeeCalculatorService:
     """
     Service for calculating fees
+    
+    Fee rules are kept as a process-local snapshot stamped with the calculator's
+    version. The snapshot is revalidated with a single-column version query at
+    most every FEE_RULES_VERSION_CHECK_SECONDS, so calculate_fee is pure
+    arithmetic on the hot path; update_fee_rules bumps the version so every
+    worker picks up the change on its next check.
+    
+    Per-merchant FeeSchedules are compiled into the same snapshot as a sorted
+    threshold list per merchant, so picking a tier is a bisect lookup. Amounts
+    below a merchant's first threshold use the global calculator rules.
     """
+    DEFAULT_CALCULATOR_ID = '00000000-0000-0000-0000-000000000001'
+    _rules = None
+    _checked_at = 0.0
+    _lock = threading.Lock()
     
     @classmethod
     def get_calculator(cls):
         """Get or create default fee calculator"""
         calculator, created = ServiceFeeCalculator.objects.get_or_create(
-            calculator_id='00000000-0000-0000-0000-000000000001',
+            calculator_id=cls.DEFAULT_CALCULATOR_ID,
             defaults={
                 'fee_percentage': Decimal('0.02'),  # 2% as Decimal
                 'minimum_fee': Decimal('0.50'),
@@ -304,10 +535,88 @@ class ServiceFeeCalculatorService:
         return calculator
     
     @classmethod
-    def calculate_fee(cls, amount):
-        """Calculate service fee based on rules - Returns Decimal"""
+    def load_rules(cls):
+        """Read the fee rules and compiled merchant schedules into a snapshot dict"""
         calculator = cls.get_calculator()
         
+        schedules = {}
+        tiers = FeeTier.objects.filter(schedule_id__is_active=True).values_list(
+            'schedule_id__merchant_id', 'threshold', 'fee_percentage', 'minimum_fee', 'maximum_fee'
+        ).order_by('schedule_id__merchant_id', 'threshold')
+        for merchant_id, threshold, fee_percentage, minimum_fee, maximum_fee in tiers:
+            thresholds, tier_rules = schedules.setdefault(merchant_id, ([], []))
+            thresholds.append(threshold)
+            tier_rules.append({
+                'fee_percentage': fee_percentage,
+                'minimum_fee': minimum_fee,
+                'maximum_fee': maximum_fee,
+            })
+        
+        return {
+            'version': calculator.version,
+            'fee_percentage': Decimal(str(calculator.fee_percentage)),
+            'minimum_fee': Decimal(str(calculator.minimum_fee)),
+            'maximum_fee': Decimal(str(calculator.maximum_fee)),
+            'schedules': schedules,
+        }
+    
+    @classmethod
+    def get_rules(cls):
+        """Get the cached fee rule snapshot, reloading it when the stored version changed"""
+        rules = cls._rules
+        interval = getattr(settings, 'FEE_RULES_VERSION_CHECK_SECONDS', 5)
+        if rules is not None and time.monotonic() - cls._checked_at < interval:
+            return rules
+        
+        with cls._lock:
+            if cls._rules is None:
+                cls._rules = cls.load_rules()
+            elif time.monotonic() - cls._checked_at >= interval:
+                version = ServiceFeeCalculator.objects.filter(
+                    calculator_id=cls.DEFAULT_CALCULATOR_ID
+                ).values_list('version', flat=True).first()
+                if version != cls._rules['version']:
+                    cls._rules = cls.load_rules()
+            cls._checked_at = time.monotonic()
+            return cls._rules
+    
+    @classmethod
+    def rules_for(cls, amount, merchant=None, rules=None):
+        """Pick the rules that apply to amount for merchant (a User or its primary key)"""
+        rules = rules or cls.get_rules()
+        if merchant is None or not rules['schedules']:
+            return rules
+        merchant_id = getattr(merchant, 'pk', merchant)
+        if not isinstance(merchant_id, uuid.UUID):
+            try:
+                merchant_id = uuid.UUID(str(merchant_id))
+            except ValueError:
+                return rules
+        schedule = rules['schedules'].get(merchant_id)
+        if schedule is None:
+            return rules
+        thresholds, tier_rules = schedule
+        index = bisect_right(thresholds, amount) - 1
+        return tier_rules[index] if index >= 0 else rules
+    
+    @classmethod
+    def bump_version(cls):
+        """Invalidate every worker's snapshot after fee rules or schedules changed"""
+        cls.get_calculator()
+        ServiceFeeCalculator.objects.filter(calculator_id=cls.DEFAULT_CALCULATOR_ID).update(
+            version=F('version') + 1
+        )
+        cls.invalidate_rules()
+    
+    @classmethod
+    def invalidate_rules(cls):
+        """Drop the local snapshot so the next fee calculation reloads it"""
+        with cls._lock:
+            cls._rules = None
+    
+    @classmethod
+    def apply_rules(cls, amount, rules):
+        """Calculate the fee for amount under a rule snapshot - Returns Decimal"""
         # Convert amount to Decimal if it's not already
         if not isinstance(amount, Decimal):
             try:
@@ -316,20 +625,91 @@ class ServiceFeeCalculatorService:
                 amount = Decimal('0.00')
         
         # Calculate fee using Decimal arithmetic
-        fee = amount * Decimal(str(calculator.fee_percentage))
+        fee = amount * rules['fee_percentage']
         
         # Apply minimum fee
-        if fee < Decimal(str(calculator.minimum_fee)):
-            fee = Decimal(str(calculator.minimum_fee))
+        if fee < rules['minimum_fee']:
+            fee = rules['minimum_fee']
         
         # Apply maximum fee
-        if fee > Decimal(str(calculator.maximum_fee)):
-            fee = Decimal(str(calculator.maximum_fee))
+        if fee > rules['maximum_fee']:
+            fee = rules['maximum_fee']
         
         # Round to 2 decimal places for currency
-        fee = fee.quantize(Decimal('0.01'))
+        try:
+            return fee.quantize(Decimal('0.01'))
+        except ArithmeticError:
+            raise ValueError(f"Invalid amount: {amount}")
+    
+    @classmethod
+    def calculate_fee(cls, amount, merchant=None):
+        """Calculate service fee based on rules (and the merchant's fee schedule) - Returns Decimal"""
+        if not isinstance(amount, Decimal):
+            try:
+                amount = Decimal(str(amount))
+            except:
+                amount = Decimal('0.00')
+        return cls.apply_rules(amount, cls.rules_for(amount, merchant))
+    
+    @classmethod
+    def quote_fee(cls, amount, merchant=None):
+        """
+        Calculate the fee for amount together with the rate and snapshot version
+        it was calculated under - Returns a dict with 'fee' and 'fee_percentage'
+        (Decimal fractions) and 'version'
+        """
+        if not isinstance(amount, Decimal):
+            amount = Decimal(str(amount))
+        rules = cls.get_rules()
+        tier = cls.rules_for(amount, merchant, rules)
+        return {
+            'fee': cls.apply_rules(amount, tier),
+            'fee_percentage': tier['fee_percentage'],
+            'version': rules['version'],
+        }
+    
+    @staticmethod
+    def format_rate(fee_percentage):
+        """A fee_percentage fraction as a percentage string, e.g. Decimal('0.0150') -> '1.5%'"""
+        percent = (fee_percentage * 100).normalize()
+        return f"{percent:f}%"
+    
+    @staticmethod
+    def validate_amount(amount):
+        """Amount as a Decimal - Raises ValueError unless it is a number above 0 and at most FEE_MAX_AMOUNT"""
+        try:
+            value = amount if isinstance(amount, Decimal) else Decimal(str(amount))
+        except Exception:
+            raise ValueError(f"Invalid amount: {amount}")
+        if not value.is_finite() or value <= 0:
+            raise ValueError(f"Invalid amount: {amount}")
+        if value > Decimal(str(getattr(settings, 'FEE_MAX_AMOUNT', '9999999999.99'))):
+            raise ValueError(f"Amount exceeds the maximum of {getattr(settings, 'FEE_MAX_AMOUNT', '9999999999.99')}")
+        return value
+    
+    @classmethod
+    def calculate_fees(cls, amounts, merchant=None):
+        """
+        Calculate service fees for many amounts in one pass over a single rule
+        snapshot - Returns a dict with per-item 'amounts' and 'fees' plus
+        'total_amount' and 'total_fees' (all Decimal). Raises ValueError for
+        invalid amounts (see validate_amount).
+        """
+        rules = cls.get_rules()
+        decimals = []
+        for index, amount in enumerate(amounts):
+            try:
+                decimals.append(cls.validate_amount(amount))
+            except ValueError as e:
+                raise ValueError(f"Item {index}: {e}")
         
-        return fee
+        fees = [cls.apply_rules(amount, cls.rules_for(amount, merchant, rules)) for amount in decimals]
+        return {
+            'amounts': decimals,
+            'fees': fees,
+            'total_amount': sum(decimals, Decimal('0.00')),
+            'total_fees': sum(fees, Decimal('0.00'))
+        }
     
     @classmethod
     def calculate_fee_float(cls, amount):
@@ -340,16 +720,13 @@ class ServiceFeeCalculatorService:
     @classmethod
     def validate_fee_range(cls, fee):
         """Validate if fee is within allowed range"""
-        calculator = cls.get_calculator()
+        rules = cls.get_rules()
         
         # Ensure inputs are Decimal
         if not isinstance(fee, Decimal):
             fee = Decimal(str(fee))
         
-        min_fee = Decimal(str(calculator.minimum_fee))
-        max_fee = Decimal(str(calculator.maximum_fee))
-        
-        return min_fee <= fee <= max_fee
+        return rules['minimum_fee'] <= fee <= rules['maximum_fee']
     
     @classmethod
     def update_fee_rules(cls, fee_percentage, minimum_fee, maximum_fee):
@@ -360,25 +737,86 @@ class ServiceFeeCalculatorService:
         calculator.fee_percentage = Decimal(str(fee_percentage))
         calculator.minimum_fee = Decimal(str(minimum_fee))
         calculator.maximum_fee = Decimal(str(maximum_fee))
+        # Bump the version so other workers drop their cached snapshot
+        calculator.version = F('version') + 1
         
         calculator.save()
+        calculator.refresh_from_db(fields=['version'])
+        cls.invalidate_rules()
         return calculator
+    
+    @classmethod
+    def update_fee_schedule(cls, merchant, tiers):
+        """
+        Replace a merchant's tiered fee schedule (admin only).
+        tiers is a list of dicts with threshold, fee_percentage, minimum_fee and
+        maximum_fee; an empty list removes the schedule.
+        """
+        with transaction.atomic():
+            if not tiers:
+                FeeSchedule.objects.filter(merchant_id=merchant).delete()
+                cls.bump_version()
+                return None
+            
+            schedule, created = FeeSchedule.objects.update_or_create(
+                merchant_id=merchant,
+                defaults={'is_active': True}
+            )
+            FeeTier.objects.filter(schedule_id=schedule).delete()
+            FeeTier.objects.bulk_create([
+                FeeTier(
+                    schedule_id=schedule,
+                    threshold=Decimal(str(tier['threshold'])),
+                    fee_percentage=Decimal(str(tier['fee_percentage'])),
+                    minimum_fee=Decimal(str(tier['minimum_fee'])),
+                    maximum_fee=Decimal(str(tier['maximum_fee']))
+                )
+                for tier in tiers
+            ])
+            cls.bump_version()
+        return schedule
 # System Log Service
 class SystemLogService:
     """
     Service for creating system logs
+    
+    Log entries are handed to SystemLogBuffer and written in batches by a
+    background thread, so requests do not wait for audit-log INSERTs. Entries
+    created inside a transaction are only queued once it commits.
     """
     
     @staticmethod
     def create_log(user_id=None, action="", status="SUCCESS", details=""):
-        """Create a system log entry"""
-        log = SystemLog.objects.create(
-            user_id=user_id,
-            action=action,
-            status=status,
-            details=details
-        )
-        return str(log.log_id)
+        """Create a system log entry - Returns the log ID (the row is written asynchronously)"""
+        return SystemLogService.create_logs([{
+            'user_id': user_id,
+            'action': action,
+            'status': status,
+            'details': details
+        }])[0]
+    
+    @staticmethod
+    def create_logs(entries):
+        """
+        Create several system log entries, written together in one batch.
+        Each entry takes create_log's keyword arguments; user_id may be a User or its primary key.
+        """
+        logs = []
+        for entry in entries:
+            user = entry.get('user_id')
+            logs.append(SystemLog(
+                user_id_id=getattr(user, 'pk', user),
+                action=entry.get('action', ""),
+                status=entry.get('status', "SUCCESS"),
+                details=entry.get('details', "")
+            ))
+        transaction.on_commit(lambda: SystemLogBuffer.enqueue(logs))
+        return [str(log.log_id) for log in logs]
+    
+    @staticmethod
+    def flush():
+        """Write every buffered log entry now"""
+        SystemLogBuffer.flush()
     
     @staticmethod
     def get_log_details(log_id):
@@ -398,13 +836,13 @@ class SystemLogService:
     
     @staticmethod
     def filter_logs(user_id=None, action=None, status=None, date_from=None, date_to=None):
-        """Filter logs based on criteria"""
+        """Filter logs based on criteria; action must match exactly so systemlog_action_time_idx applies"""
         logs = SystemLog.objects.all()
         
         if user_id:
             logs = logs.filter(user_id=user_id)
         if action:
-            logs = logs.filter(action__icontains=action)
+            logs = logs.filter(action=action)
         if status:
             logs = logs.filter(status=status)
         if date_from:
@@ -413,4 +851,403 @@ class SystemLogService:
             logs = logs.filter(timestamp__lte=date_to)
         
         return logs.order_by('-timestamp')
+    
+    @staticmethod
+    def filter_archived_logs(user_id=None, action=None, status=None, date_from=None, date_to=None):
+        """Filter archived logs; the date range is also applied to the month column, which leads the archive's index"""
+        logs = SystemLogArchive.objects.all()
+        
+        if date_from:
+            logs = logs.filter(partition__gte=SystemLogArchive.partition_for(date_from), timestamp__gte=date_from)
+        if date_to:
+            logs = logs.filter(partition__lte=SystemLogArchive.partition_for(date_to), timestamp__lte=date_to)
+        if user_id:
+            logs = logs.filter(user_id=user_id)
+        if action:
+            logs = logs.filter(action=action)
+        if status:
+            logs = logs.filter(status=status)
+        
+        return logs.order_by('-timestamp')
+    
+    @staticmethod
+    def archive_logs(before, batch_size=5000):
+        """
+        Move logs older than before into SystemLogArchive, oldest first.
+        Each batch is copied and deleted in its own transaction. Returns the
+        number of logs moved.
+        """
+        fields = ['log_id', 'user_id_id', 'action', 'timestamp', 'status', 'details']
+        moved = 0
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    SystemLog.objects.filter(timestamp__lt=before)
+                    .order_by('timestamp')
+                    .values(*fields)[:batch_size]
+                )
+                if not batch:
+                    return moved
+                SystemLogArchive.objects.bulk_create(
+                    [
+                        SystemLogArchive(partition=SystemLogArchive.partition_for(row['timestamp']), **row)
+                        for row in batch
+                    ],
+                    ignore_conflicts=True
+                )
+                SystemLog.objects.filter(log_id__in=[row['log_id'] for row in batch]).delete()
+            moved += len(batch)
+    
+    @staticmethod
+    def purge_archived_logs(before_partition):
+        """Delete archived logs from months before before_partition (YYYY-MM) - Returns the number of logs deleted"""
+        deleted, _ = SystemLogArchive.objects.filter(partition__lt=before_partition).delete()
+        return deleted
+
+
+# Buffered SystemLog writer
+class SystemLogBuffer:
+    """
+    In-process queue of SystemLog rows flushed with bulk_create by a daemon thread.
+    
+    A batch is written once SYSTEM_LOG_BATCH_SIZE rows are queued, otherwise
+    every SYSTEM_LOG_FLUSH_SECONDS, and whatever is left is flushed at
+    interpreter exit. When SYSTEM_LOG_MAX_PENDING rows are waiting the caller
+    flushes synchronously instead of dropping audit entries. With
+    SYSTEM_LOG_BUFFERED = False every enqueue is written immediately.
+    """
+    
+    _pending = []
+    _condition = threading.Condition()
+    _flush_lock = threading.Lock()
+    _thread = None
+    _pid = None
+    _stats = {
+        'queued': 0,
+        'written': 0,
+        'batches': 0,
+        'last_batch_size': 0,
+        'max_batch_size': 0,
+        'failed': 0,
+    }
+    
+    @classmethod
+    def enqueue(cls, logs):
+        if not getattr(settings, 'SYSTEM_LOG_BUFFERED', True):
+            cls._write(list(logs))
+            return
+        
+        cls._ensure_thread()
+        with cls._condition:
+            cls._pending.extend(logs)
+            cls._stats['queued'] += len(logs)
+            pending = len(cls._pending)
+            if pending >= getattr(settings, 'SYSTEM_LOG_BATCH_SIZE', 200):
+                cls._condition.notify()
+        
+        if pending >= getattr(settings, 'SYSTEM_LOG_MAX_PENDING', 10000):
+            # The writer is falling behind; apply back-pressure on the caller
+            cls.flush()
+    
+    @classmethod
+    def flush(cls):
+        """Write every queued row in batches of SYSTEM_LOG_BATCH_SIZE"""
+        batch_size = getattr(settings, 'SYSTEM_LOG_BATCH_SIZE', 200)
+        with cls._flush_lock:
+            while True:
+                with cls._condition:
+                    batch = cls._pending[:batch_size]
+                    del cls._pending[:batch_size]
+                if not batch:
+                    return
+                cls._write(batch)
+    
+    @classmethod
+    def stats(cls):
+        """Counters for the current process, including the number of rows still queued"""
+        with cls._condition:
+            return dict(cls._stats, pending=len(cls._pending))
+    
+    @classmethod
+    def _write(cls, batch):
+        try:
+            try:
+                SystemLog.objects.bulk_create(batch)
+            except IntegrityError:
+                # A user was deleted while their entries were queued; keep the entries without the user
+                existing = set(User.objects.filter(
+                    pk__in={log.user_id_id for log in batch if log.user_id_id}
+                ).values_list('pk', flat=True))
+                for log in batch:
+                    if log.user_id_id not in existing:
+                        log.user_id_id = None
+                SystemLog.objects.bulk_create(batch, ignore_conflicts=True)
+        except Exception as e:
+            print(f"Failed to write {len(batch)} system logs: {str(e)}")
+            with cls._condition:
+                cls._stats['failed'] += len(batch)
+            return
+        
+        with cls._condition:
+            cls._stats['written'] += len(batch)
+            cls._stats['batches'] += 1
+            cls._stats['last_batch_size'] = len(batch)
+            cls._stats['max_batch_size'] = max(cls._stats['max_batch_size'], len(batch))
+    
+    @classmethod
+    def _ensure_thread(cls):
+        # Started lazily, and again in a worker forked from a process that already had one
+        if cls._thread is not None and cls._pid == os.getpid():
+            return
+        with cls._condition:
+            if cls._thread is not None and cls._pid == os.getpid():
+                return
+            cls._pid = os.getpid()
+            cls._thread = threading.Thread(target=cls._run, name='system-log-writer', daemon=True)
+            cls._thread.start()
+    
+    @classmethod
+    def _run(cls):
+        from django.db import close_old_connections
+        
+        while True:
+            interval = getattr(settings, 'SYSTEM_LOG_FLUSH_SECONDS', 1.0)
+            with cls._condition:
+                cls._condition.wait_for(
+                    lambda: len(cls._pending) >= getattr(settings, 'SYSTEM_LOG_BATCH_SIZE', 200),
+                    timeout=interval
+                )
+            close_old_connections()
+            cls.flush()
+
+
+atexit.register(SystemLogBuffer.flush)
+
 
+# Idempotency Service
+class IdempotencyKeyTaken(Exception):
+    """Another worker completed an Idempotency-Key this request had claimed"""
+
+
+class IdempotencyService:
+    """
+    Stores the response of a request carrying an Idempotency-Key header so that
+    retries replay it instead of running the request again.
+    
+    The unique (scope, key) row decides which concurrent duplicate runs; the others
+    wait up to IDEMPOTENCY_WAIT_SECONDS for its response. The row keeps a keyed
+    hash of the request body, so a key reused for a different request is refused
+    instead of replaying an unrelated response. A claim is leased for
+    IDEMPOTENCY_LEASE_SECONDS: if its worker dies mid-request, a retry can take
+    the key over once the lease has run out. Completed responses are kept in a
+    process-local LRU so most retries never reach the database.
+    
+    The response is stored in the same transaction as the request's writes
+    (see idempotent), so a crash can't leave a settled payment behind a key
+    that a retry would take over and settle again.
+    """
+    _cache = TTLCache(
+        maxsize=getattr(settings, 'IDEMPOTENCY_CACHE_SIZE', 10000),
+        ttl=getattr(settings, 'IDEMPOTENCY_CACHE_TTL', 300)
+    )
+    _inflight = {}  # (scope, key) -> threading.Event for requests running in this process
+    _inflight_lock = threading.Lock()
+    
+    MISMATCH = (422, {
+        'success': False,
+        'error': 'This Idempotency-Key was already used with a different request'
+    }, False)
+    
+    @staticmethod
+    def request_hash(data):
+        """Hash of a request body, keyed with SECRET_KEY since bodies may contain passwords"""
+        canonical = json.dumps(data, sort_keys=True, separators=(',', ':'), default=str)
+        return hmac.new(settings.SECRET_KEY.encode('utf-8'), canonical.encode('utf-8'), hashlib.sha256).hexdigest()
+    
+    @classmethod
+    def claim(cls, scope, key, request_hash=''):
+        """
+        Claim a key for the current request.
+        Returns None when the caller must run the request, otherwise a
+        (status, body, replayed) tuple to answer with.
+        """
+        cached = cls._cache.get((scope, key))
+        if cached is not None:
+            cached_hash, result = cached
+            return result if cached_hash == request_hash else cls.MISMATCH
+        
+        deadline = time.monotonic() + getattr(settings, 'IDEMPOTENCY_WAIT_SECONDS', 5)
+        while True:
+            now = timezone.now()
+            lease_expires_at = now + timedelta(seconds=getattr(settings, 'IDEMPOTENCY_LEASE_SECONDS', 60))
+            try:
+                with transaction.atomic():
+                    IdempotencyKey.objects.create(
+                        scope=scope,
+                        key=key,
+                        request_hash=request_hash,
+                        expires_at=now + timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400)),
+                        lease_expires_at=lease_expires_at
+                    )
+                cls._start(scope, key)
+                return None
+            except IntegrityError:
+                pass
+            
+            record = IdempotencyKey.objects.filter(scope=scope, key=key).first()
+            if record is None:
+                # The previous owner failed and released the key - try to claim it again
+                continue
+            if record.expires_at <= now:
+                IdempotencyKey.objects.filter(pk=record.pk, expires_at__lte=now).delete()
+                continue
+            if record.request_hash != request_hash:
+                return cls.MISMATCH
+            if record.status == 'COMPLETED':
+                result = (record.response_status, record.response_body, True)
+                cls._cache.set((scope, key), (request_hash, result))
+                return result
+            if record.lease_expires_at is None or record.lease_expires_at <= now:
+                # The owner died without completing or releasing the key - take it over
+                taken = IdempotencyKey.objects.filter(
+                    pk=record.pk, status='IN_PROGRESS', lease_expires_at=record.lease_expires_at
+                ).update(lease_expires_at=lease_expires_at)
+                if taken:
+                    cls._start(scope, key)
+                    return None
+                continue
+            
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return (409, {
+                    'success': False,
+                    'error': 'A request with this Idempotency-Key is still being processed'
+                }, False)
+            event = cls._inflight.get((scope, key))
+            if event is not None:
+                event.wait(min(remaining, 0.5))
+            else:
+                time.sleep(min(remaining, 0.05))
+    
+    @classmethod
+    def _start(cls, scope, key):
+        with cls._inflight_lock:
+            cls._inflight[(scope, key)] = threading.Event()
+    
+    @classmethod
+    def complete(cls, scope, key, status_code, body, request_hash=''):
+        """
+        Store the response of a claimed key and wake up waiting duplicates once
+        the surrounding transaction commits. Returns False when another worker
+        that took over the key has already completed it; the caller must then
+        roll back its own changes.
+        """
+        stored = IdempotencyKey.objects.filter(scope=scope, key=key, status='IN_PROGRESS').update(
+            status='COMPLETED',
+            response_status=status_code,
+            response_body=body,
+            lease_expires_at=None
+        )
+        if not stored:
+            return False
+        
+        def completed():
+            cls._cache.set((scope, key), (request_hash, (status_code, body, True)))
+            cls._finish(scope, key)
+        transaction.on_commit(completed)
+        return True
+    
+    @classmethod
+    def stored_response(cls, scope, key, request_hash=''):
+        """(status, body, replayed) of a completed key, or None"""
+        record = IdempotencyKey.objects.filter(scope=scope, key=key, status='COMPLETED').first()
+        if record is None:
+            return None
+        if record.request_hash != request_hash:
+            return cls.MISMATCH
+        return (record.response_status, record.response_body, True)
+    
+    @classmethod
+    def release(cls, scope, key):
+        """Forget a claimed key after a server error so the client can retry"""
+        IdempotencyKey.objects.filter(scope=scope, key=key, status='IN_PROGRESS').delete()
+        cls._finish(scope, key)
+    
+    @classmethod
+    def _finish(cls, scope, key):
+        with cls._inflight_lock:
+            event = cls._inflight.pop((scope, key), None)
+        if event is not None:
+            event.set()
+    
+    @classmethod
+    def purge_expired(cls):
+        """Delete expired keys, returns the number of rows removed"""
+        deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=timezone.now()).delete()
+        return deleted
+
+
+def idempotent(scope, key_fields=()):
+    """
+    View decorator honouring the Idempotency-Key header.
+    Place it below @api_view/@permission_classes so it sees the authenticated user.
+    Keys are scoped to the authenticated user, otherwise to the request's
+    key_fields (e.g. the account number), so clients can't replay each other's
+    responses. Responses below 500 are stored and replayed; server errors release the key.
+    The view runs in a transaction that also marks the key completed, so its
+    writes and the stored response commit (or roll back) together.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            key = request.META.get('HTTP_IDEMPOTENCY_KEY')
+            if not key:
+                return view(request, *args, **kwargs)
+            if len(key) > 200:
+                return Response({
+                    'success': False,
+                    'error': 'Idempotency-Key must be at most 200 characters'
+                }, status=400)
+            if request.user and request.user.is_authenticated:
+                key = f"{request.user.pk}:{key}"
+            elif key_fields:
+                owner = '|'.join(str(request.data.get(field, '')) for field in key_fields)
+                key = f"{hashlib.sha256(owner.encode('utf-8')).hexdigest()[:32]}:{key}"
+            request_hash = IdempotencyService.request_hash(request.data)
+            
+            def stored_response(stored):
+                status_code, body, replayed = stored
+                response = Response(body, status=status_code)
+                if replayed:
+                    response['Idempotent-Replayed'] = 'true'
+                return response
+            
+            stored = IdempotencyService.claim(scope, key, request_hash)
+            if stored is not None:
+                return stored_response(stored)
+            
+            try:
+                with transaction.atomic():
+                    response = view(request, *args, **kwargs)
+                    if response.status_code < 500 and not IdempotencyService.complete(
+                        scope, key, response.status_code, getattr(response, 'data', None), request_hash
+                    ):
+                        raise IdempotencyKeyTaken()
+            except IdempotencyKeyTaken:
+                # Our lease ran out and the worker that took the key over finished first;
+                # its response stands and this run's changes were rolled back
+                IdempotencyService._finish(scope, key)
+                stored = IdempotencyService.stored_response(scope, key, request_hash)
+                return stored_response(stored or (409, {
+                    'success': False,
+                    'error': 'A request with this Idempotency-Key is still being processed'
+                }, False))
+            except Exception:
+                IdempotencyService.release(scope, key)
+                raise
+            
+            if response.status_code >= 500:
+                IdempotencyService.release(scope, key)
+            return response
+        return wrapped
+    return decorator
@@ -1,3 +1,1067 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime, timedelta
+from io import StringIO
+from decimal import Decimal
+from unittest import mock
+from urllib.parse import urlsplit
 
-# Create your tests here.
+import requests
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.http import HttpResponse
+from django.db import connection, transaction
+from django.test import RequestFactory, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+from rest_framework.test import APIClient, APIRequestFactory
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenError
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from bank.models import BankAccount
+from bank.services import BankPaymentService
+from .authentication import ClaimsJWTAuthentication
+from .exports import stream_export, time_range_filter
+from .hashing import HashingExecutor, HashingPoolSaturated, PasswordHashingPolicy
+from .management.commands.webhook_stub_server import WebhookStubServer
+from .middleware import QueryBudgetExceeded, QueryBudgetMiddleware, query_budget
+from .models import (
+    IdempotencyKey, Notification, Payment, Session, SystemLog, SystemLogArchive, Transaction, User, WebhookDelivery
+)
+from .notifications import NotificationDispatcher
+from .services import (
+    AuthenticationManager, IdempotencyService, ServiceFeeCalculatorService, SessionManager, SystemLogBuffer,
+    SystemLogService, idempotent
+)
+from .tokens import BlacklistRefreshToken, TokenBlacklistFilter
+from .webhooks import (
+    PinnedHostAdapter, WebhookDispatcher, check_callback_url, enqueue_payment_event, merchant_secret, pinned_url
+)
+
+
+class IdempotencyTests(TestCase):
+    """Idempotency-Key scoping, request matching and lease takeover"""
+
+    def setUp(self):
+        IdempotencyService._cache.clear()
+        self.calls = 0
+
+        @api_view(['POST'])
+        @permission_classes([AllowAny])
+        @idempotent('test-process', key_fields=('account_number',))
+        def view(request):
+            self.calls += 1
+            return Response({'call': self.calls, 'account': request.data['account_number']})
+
+        self.view = view
+        self.factory = APIRequestFactory()
+
+    def post(self, data, key='key-1'):
+        return self.view(self.factory.post('/process/', data, format='json', HTTP_IDEMPOTENCY_KEY=key))
+
+    def test_retry_replays_response(self):
+        first = self.post({'account_number': '100', 'amount': '10'})
+        retry = self.post({'account_number': '100', 'amount': '10'})
+
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(retry.data, first.data)
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+
+    def test_key_is_scoped_to_account(self):
+        self.post({'account_number': '100', 'amount': '10'})
+        other = self.post({'account_number': '200', 'amount': '10'})
+
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(other.data['account'], '200')
+
+    def test_reused_key_with_different_body_is_refused(self):
+        self.post({'account_number': '100', 'amount': '10'})
+        IdempotencyService._cache.clear()
+        response = self.post({'account_number': '100', 'amount': '99'})
+
+        self.assertEqual(response.status_code, 422)
+        self.assertEqual(self.calls, 1)
+
+    def test_expired_lease_can_be_taken_over(self):
+        self.post({'account_number': '100', 'amount': '10'})
+        # Simulate a worker that died holding the key
+        IdempotencyService._cache.clear()
+        IdempotencyKey.objects.update(
+            status='IN_PROGRESS', response_status=None, response_body=None,
+            lease_expires_at=timezone.now() - timedelta(seconds=1)
+        )
+
+        response = self.post({'account_number': '100', 'amount': '10'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.calls, 2)
+        self.assertEqual(IdempotencyKey.objects.get().status, 'COMPLETED')
+
+    def writing_view(self, during=None):
+        @api_view(['POST'])
+        @permission_classes([AllowAny])
+        @idempotent('test-write', key_fields=('account_number',))
+        def view(request):
+            self.calls += 1
+            User.objects.create(
+                email=f'run{self.calls}@idempotency.test', full_name='Run', phone_number='+251900000000',
+                role='endUser', status='active'
+            )
+            if during:
+                during()
+            return Response({'call': self.calls})
+        return lambda: view(self.factory.post('/write/', {'account_number': '100'}, format='json', HTTP_IDEMPOTENCY_KEY='key-1'))
+
+    def test_response_commits_with_view_changes(self):
+        def crash():
+            # Dies after its writes, before the response reaches the client
+            raise RuntimeError('worker died')
+
+        with self.assertRaises(RuntimeError):
+            self.writing_view(crash)()
+
+        self.assertFalse(User.objects.filter(email__endswith='@idempotency.test').exists())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        response = self.writing_view()()
+        self.assertEqual(response.data, {'call': 2})
+        self.assertEqual(User.objects.filter(email__endswith='@idempotency.test').count(), 1)
+
+    def test_run_that_lost_its_key_is_rolled_back(self):
+        def taken_over():
+            # Our lease ran out and the worker that took the key over finished first
+            IdempotencyKey.objects.update(status='COMPLETED', response_status=200, response_body={'call': 'other'})
+
+        response = self.writing_view(taken_over)()
+
+        # Within one test transaction the other worker's response is rolled back with ours
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(User.objects.filter(email__endswith='@idempotency.test').exists())
+        self.assertEqual(self.calls, 1)
+
+
+class FeeQuoteTests(TestCase):
+    """Amount validation of the fee quote endpoints"""
+
+    def setUp(self):
+        user = User.objects.create(
+            email='quote@fees.test', full_name='Quote', phone_number='+251900000000', role='endUser', status='active'
+        )
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(user)
+
+    def quote(self, amounts):
+        return self.client.post('/api/fee/calculate/batch/', {'amounts': amounts}, format='json')
+
+    def test_batch_quote(self):
+        response = self.quote(['100.00', 250])
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], 2)
+
+    def test_out_of_range_amounts_are_rejected(self):
+        for amount in ['1e999999999', '-5', '0', '10000000000', 'NaN', 'abc']:
+            with self.subTest(amount=amount):
+                response = self.quote(['10.00', amount])
+                self.assertEqual(response.status_code, 400)
+                self.assertTrue(response.data['error'].startswith('Item 1:'))
+
+    def test_single_quote_rejects_overflow(self):
+        response = self.client.get('/api/fee/calculate/', {'amount': '1e999999999'})
+
+        self.assertEqual(response.status_code, 400)
+
+
+class FeeScheduleTests(TestCase):
+    """Merchant fee tiers and the process-local rule snapshot"""
+
+    def setUp(self):
+        ServiceFeeCalculatorService.invalidate_rules()
+        self.addCleanup(ServiceFeeCalculatorService.invalidate_rules)
+        self.merchant = User.objects.create(
+            email='tiers@fees.test', full_name='Tiers', phone_number='+251900000000', role='merchant', status='active'
+        )
+        ServiceFeeCalculatorService.update_fee_schedule(self.merchant, [
+            {'threshold': '100.00', 'fee_percentage': '0.015', 'minimum_fee': '1.00', 'maximum_fee': '50.00'},
+            {'threshold': '1000.00', 'fee_percentage': '0.01', 'minimum_fee': '1.00', 'maximum_fee': '50.00'},
+        ])
+
+    def rate(self, amount, merchant=None):
+        return ServiceFeeCalculatorService.rules_for(Decimal(amount), merchant or self.merchant)['fee_percentage']
+
+    def test_tier_boundaries(self):
+        # Below the first threshold the global rules apply; each threshold starts its tier
+        for amount, rate in [('99.99', '0.02'), ('100.00', '0.015'), ('999.99', '0.015'), ('1000.00', '0.01'), ('5000', '0.01')]:
+            with self.subTest(amount=amount):
+                self.assertEqual(self.rate(amount), Decimal(rate))
+
+    def test_merchant_may_be_given_by_key(self):
+        self.assertEqual(self.rate('1000.00', str(self.merchant.pk)), Decimal('0.01'))
+        self.assertEqual(self.rate('1000.00', 'not-a-merchant'), Decimal('0.02'))
+
+    def test_other_merchants_use_global_rules(self):
+        other = User.objects.create(
+            email='flat@fees.test', full_name='Flat', phone_number='+251900000000', role='merchant', status='active'
+        )
+
+        self.assertEqual(self.rate('1000.00', other), Decimal('0.02'))
+        self.assertEqual(ServiceFeeCalculatorService.calculate_fee(Decimal('10.00'), other), Decimal('0.50'))
+
+    def test_quote_reports_rate_and_version(self):
+        quote = ServiceFeeCalculatorService.quote_fee(Decimal('200.00'), self.merchant)
+
+        self.assertEqual(quote['fee'], Decimal('3.00'))
+        self.assertEqual(ServiceFeeCalculatorService.format_rate(quote['fee_percentage']), '1.5%')
+        self.assertEqual(quote['version'], ServiceFeeCalculatorService.get_calculator().version)
+
+    def test_schedule_update_invalidates_snapshot(self):
+        version = ServiceFeeCalculatorService.get_rules()['version']
+
+        ServiceFeeCalculatorService.update_fee_schedule(self.merchant, [
+            {'threshold': '0', 'fee_percentage': '0.005', 'minimum_fee': '0.10', 'maximum_fee': '50.00'},
+        ])
+
+        self.assertEqual(ServiceFeeCalculatorService.get_rules()['version'], version + 1)
+        self.assertEqual(self.rate('50.00'), Decimal('0.005'))
+
+    def test_other_workers_reload_after_version_check(self):
+        stale = ServiceFeeCalculatorService.get_rules()
+        ServiceFeeCalculatorService.update_fee_schedule(self.merchant, [])
+        # A worker still holding the old snapshot keeps it until its next version check
+        ServiceFeeCalculatorService._rules = stale
+        ServiceFeeCalculatorService._checked_at = time.monotonic()
+        self.assertEqual(self.rate('1000.00'), Decimal('0.01'))
+
+        ServiceFeeCalculatorService._checked_at -= settings.FEE_RULES_VERSION_CHECK_SECONDS
+        self.assertEqual(self.rate('1000.00'), Decimal('0.02'))
+
+
+class TimeRangeTests(TestCase):
+    """from/to query parameters of the exports"""
+
+    def test_date_only_end_covers_the_whole_day(self):
+        filters = time_range_filter('created_at', '2026-01-01', '2026-01-31')
+
+        self.assertEqual(filters['created_at__gte'].isoformat()[:19], '2026-01-01T00:00:00')
+        self.assertEqual(filters['created_at__lt'].isoformat()[:19], '2026-02-01T00:00:00')
+        self.assertNotIn('created_at__lte', filters)
+
+    def test_datetime_end_is_inclusive(self):
+        filters = time_range_filter('created_at', end='2026-01-31T12:30:00')
+
+        self.assertEqual(filters['created_at__lte'].isoformat()[:19], '2026-01-31T12:30:00')
+
+    def test_invalid_value_is_rejected(self):
+        with self.assertRaises(ValueError):
+            time_range_filter('created_at', end='yesterday')
+
+
+class ExportTests(TestCase):
+    """Transaction exports streamed as NDJSON or CSV"""
+
+    FIELDS = [('transactionID', 'transaction_id'), ('amount', 'amount'), ('createdAt', 'created_at')]
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='export@stream.test', full_name='Export', phone_number='+251900000000', role='endUser', status='active'
+        )
+        payment = Payment.objects.create(
+            user_id=self.user, recipient_id=self.user, amount=Decimal('10.00'), payment_method='BankTransfer'
+        )
+        self.transactions = []
+        for amount, created_at in (
+            ('10.00', datetime(2025, 12, 31, 23, 59)),
+            ('20.00', datetime(2026, 1, 1, 0, 0)),
+            ('30.00', datetime(2026, 1, 31, 23, 59, 59)),
+            ('40.00', datetime(2026, 2, 1, 0, 0)),
+        ):
+            transaction_row = Transaction.objects.create(
+                payment_id=payment, user_id=self.user, amount=Decimal(amount), total_amount=Decimal(amount)
+            )
+            Transaction.objects.filter(pk=transaction_row.pk).update(created_at=timezone.make_aware(created_at))
+            self.transactions.append(transaction_row)
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.user)
+
+    def export(self, **params):
+        response = self.client.get('/api/transactions/export/', params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_ndjson_covers_the_whole_end_date(self):
+        response, content = self.export(**{'from': '2026-01-01', 'to': '2026-01-31'})
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="transactions.ndjson"')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual([row['amount'] for row in rows], ['20.00', '30.00'])
+        self.assertEqual(rows[1]['transactionID'], str(self.transactions[2].pk))
+        self.assertEqual(rows[1]['createdAt'], '2026-01-31T23:59:59Z')
+
+    def test_csv_has_header_and_datetime_end_is_inclusive(self):
+        response, content = self.export(output='csv', to='2026-01-31T23:59:59')
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(content.splitlines()))
+        self.assertEqual(rows[0][:3], ['transactionID', 'paymentID', 'amount'])
+        self.assertEqual([row[2] for row in rows[1:]], ['10.00', '20.00', '30.00'])
+
+    def test_invalid_parameters_are_rejected(self):
+        for params in ({'output': 'xml'}, {'to': 'yesterday'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/transactions/export/', params).status_code, 400)
+
+    @override_settings(EXPORT_CHUNK_SIZE=2)
+    def test_rows_are_read_while_streaming(self):
+        with self.assertNumQueries(0):
+            response = stream_export(Transaction.objects.order_by('created_at'), self.FIELDS, 'csv', 'export')
+
+        lines = iter(response.streaming_content)
+        self.assertEqual(next(lines), b'transactionID,amount,createdAt\r\n')
+        with self.assertNumQueries(1):
+            rows = [line.decode() for line in lines]
+        self.assertEqual([row.split(',')[1] for row in rows], ['10.00', '20.00', '30.00', '40.00'])
+
+
+class SystemLogBufferTests(TestCase):
+    """System log entries queued on commit and written in batches"""
+
+    def setUp(self):
+        self.write_now = SystemLogBuffer.flush
+        # Keep the writer thread (started by any earlier buffered log) off this test's rows
+        self.background_flush = self.enterContext(mock.patch.object(SystemLogBuffer, 'flush'))
+        self.enterContext(mock.patch.object(SystemLogBuffer, '_pending', []))
+
+    def test_entries_are_queued_on_commit_and_written_in_batches(self):
+        before = SystemLogBuffer.stats()
+
+        with override_settings(SYSTEM_LOG_BATCH_SIZE=2):
+            with self.captureOnCommitCallbacks() as callbacks:
+                log_ids = SystemLogService.create_logs([{'action': f'Action {number}'} for number in range(3)])
+            self.assertEqual(SystemLogBuffer.stats()['pending'], 0)
+
+            callbacks[0]()
+            self.assertEqual(SystemLogBuffer.stats()['pending'], 3)
+            self.assertFalse(SystemLog.objects.exists())
+
+            with self.assertNumQueries(2):
+                self.write_now()
+
+        self.assertEqual(sorted(str(pk) for pk in SystemLog.objects.values_list('log_id', flat=True)), sorted(log_ids))
+        stats = SystemLogBuffer.stats()
+        self.assertEqual(stats['pending'], 0)
+        self.assertEqual(stats['written'] - before['written'], 3)
+        self.assertEqual(stats['batches'] - before['batches'], 2)
+        self.assertEqual(stats['last_batch_size'], 1)
+
+    def test_rolled_back_entries_are_dropped(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            with self.assertRaises(ValueError), transaction.atomic():
+                SystemLogService.create_log(action='Rolled back')
+                raise ValueError
+
+        self.assertEqual(callbacks, [])
+
+    @override_settings(SYSTEM_LOG_MAX_PENDING=2)
+    def test_full_queue_is_flushed_by_the_caller(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            SystemLogService.create_log(action='First')
+        self.background_flush.assert_not_called()
+
+        with self.captureOnCommitCallbacks(execute=True):
+            SystemLogService.create_log(action='Second')
+        self.background_flush.assert_called_once_with()
+
+    @override_settings(SYSTEM_LOG_BUFFERED=False)
+    def test_unbuffered_entries_are_written_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            log_id = SystemLogService.create_log(action='Immediate')
+
+        self.assertTrue(SystemLog.objects.filter(log_id=log_id, action='Immediate').exists())
+        self.assertEqual(SystemLogBuffer.stats()['pending'], 0)
+
+
+class SystemLogArchiveTests(TestCase):
+    """Archiving, opt-in retention and the admin log search"""
+
+    def setUp(self):
+        self.admin = User.objects.create(
+            email='admin@logs.test', full_name='Admin', phone_number='+251900000000', role='admin', status='active'
+        )
+        self.now = timezone.now()
+        self.old = self.log('Payment Processed', days=200)
+        self.older = self.log('User Login', days=1000)
+        self.recent = self.log('Payment Processed', days=10)
+        self.client = APIClient(SERVER_NAME='localhost')
+        self.client.force_authenticate(self.admin)
+
+    def log(self, action, days):
+        return SystemLog.objects.create(
+            user_id=self.admin, action=action, status='SUCCESS', timestamp=self.now - timedelta(days=days)
+        )
+
+    def archive(self, **options):
+        call_command('archive_system_logs', stdout=StringIO(), **options)
+
+    def test_archive_moves_only_old_logs(self):
+        moved = SystemLogService.archive_logs(self.now - timedelta(days=90), batch_size=1)
+
+        self.assertEqual(moved, 2)
+        self.assertEqual(list(SystemLog.objects.values_list('log_id', flat=True)), [self.recent.log_id])
+        archived = SystemLogArchive.objects.get(log_id=self.old.log_id)
+        self.assertEqual(archived.partition, SystemLogArchive.partition_for(self.old.timestamp))
+        self.assertEqual((archived.action, archived.timestamp), (self.old.action, self.old.timestamp))
+
+    def test_archived_logs_are_kept_by_default(self):
+        self.archive()
+
+        self.assertEqual(SystemLogArchive.objects.count(), 2)
+
+    def test_purge_when_asked(self):
+        self.archive(archive_months=24)
+
+        self.assertEqual(list(SystemLogArchive.objects.values_list('log_id', flat=True)), [self.old.log_id])
+        self.assertTrue(SystemLog.objects.filter(log_id=self.recent.log_id).exists())
+
+    def search(self, **params):
+        response = self.client.get('/api/logs/', params)
+        self.assertEqual(response.status_code, 200, response.data)
+        return [log['logID'] for log in response.data]
+
+    def test_search_live_logs(self):
+        self.assertEqual(self.search(action='Payment Processed'), [str(self.recent.log_id), str(self.old.log_id)])
+        self.assertEqual(self.search(action='Payment'), [])
+        self.assertEqual(self.search(to=self.old.timestamp.date().isoformat()), [str(self.old.log_id), str(self.older.log_id)])
+
+    def test_search_archived_logs(self):
+        self.archive()
+
+        self.assertEqual(self.search(archived='1'), [str(self.old.log_id), str(self.older.log_id)])
+        day = self.old.timestamp.date().isoformat()
+        self.assertEqual(self.search(archived='1', **{'from': day, 'to': day}), [str(self.old.log_id)])
+
+    def test_search_is_admin_only(self):
+        self.admin.role = 'merchant'
+        self.admin.save()
+
+        self.assertEqual(self.client.get('/api/logs/').status_code, 403)
+
+
+@override_settings(QUERY_BUDGET_ENABLED=True, QUERY_BUDGET_STRICT=True)
+class QueryBudgetTests(TestCase):
+    """Dashboard, analytics and list endpoints stay within their @query_budget as rows grow"""
+
+    def setUp(self):
+        accounts = {}
+        for name, role, account_number in (
+            ('customer', 'endUser', '910800001'), ('merchant', 'merchant', '910800002'), ('service', 'admin', '910800003')
+        ):
+            user = User.objects.create(
+                email=f'{name}@budget.test', full_name=name.title(), phone_number='+251900000000', role=role, status='active'
+            )
+            accounts[name] = BankAccount.objects.create(
+                user=user, account_number=account_number, bank_name='Test Bank', account_holder_name=name.title(),
+                password_hash='!', current_balance=Decimal('1000.00') if name == 'customer' else Decimal('0.00')
+            )
+        for index in range(5):
+            payment = Payment.objects.create(
+                user_id=accounts['customer'].user, recipient_id=accounts['merchant'].user,
+                amount=Decimal('10.00'), payment_method='BankTransfer'
+            )
+            result = BankPaymentService.settle_payment(
+                str(payment.payment_id), accounts['customer'], accounts['merchant'], accounts['service'], Decimal('10.00')
+            )
+            self.assertTrue(result['success'], result.get('error'))
+        for index in range(5):
+            Notification.objects.create(user_id=accounts['customer'].user, message=f'Notice {index}')
+
+        self.customer = accounts['customer'].user
+        self.merchant = accounts['merchant'].user
+        self.client = APIClient(SERVER_NAME='localhost')
+
+    def get(self, user, path, **params):
+        self.client.force_authenticate(user)
+        response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200, getattr(response, 'data', None))
+        self.assertIn('X-Query-Count', response)
+        return response
+
+    def test_merchant_dashboard(self):
+        response = self.get(self.merchant, '/api/bank/merchant/dashboard/')
+
+        self.assertEqual(len(response.data['recent_transactions']), 5)
+
+    def test_merchant_analytics(self):
+        for granularity in ('hour', 'day', 'month'):
+            with self.subTest(granularity=granularity):
+                self.get(self.merchant, '/api/bank/merchant/analytics/', granularity=granularity)
+
+    def test_cursor_is_sent_in_headers(self):
+        for user, path, key in (
+            (self.merchant, '/api/bank/merchant/dashboard/', 'recent_transactions'),
+            (self.customer, '/api/transactions/', None),
+            (self.customer, '/api/notifications/', None),
+        ):
+            with self.subTest(path=path):
+                first = self.get(user, path, limit=3)
+                self.assertNotIn('next_cursor', first.data if key else {})
+                rest = self.get(user, path, limit=3, cursor=first['X-Next-Cursor'])
+                self.assertNotIn('X-Next-Cursor', rest)
+                pages = [page.data[key] if key else page.data for page in (first, rest)]
+                self.assertEqual([len(page) for page in pages], [3, 2])
+
+    def test_list_endpoints(self):
+        for path in ('/api/transactions/', '/api/notifications/'):
+            with self.subTest(path=path):
+                self.assertEqual(len(self.get(self.customer, path).data), 5)
+
+    def test_over_budget_view_raises(self):
+        @query_budget(1)
+        def view(request):
+            list(User.objects.all())
+            list(Notification.objects.all())
+            return HttpResponse()
+
+        request = RequestFactory().get('/over-budget/')
+        middleware = QueryBudgetMiddleware(lambda request: view(request))
+        middleware.process_view(request, view, (), {})
+
+        with self.assertRaises(QueryBudgetExceeded):
+            middleware(request)
+
+
+@override_settings(PASSWORD_HASHING_POLICY={
+    'default': {'algorithm': 'pbkdf2_sha256', 'cost': 1000},
+    'admin': {'algorithm': 'pbkdf2_sha256', 'cost': 2000},
+})
+class PasswordHashingTests(TestCase):
+    """Per-role hashing policy and the optional hashing process pool"""
+
+    def setUp(self):
+        HashingExecutor._executor = None
+        self.addCleanup(self.shut_down_pool)
+
+    def shut_down_pool(self):
+        if HashingExecutor._executor is not None and HashingExecutor._pid == os.getpid():
+            HashingExecutor._executor.shutdown()
+        HashingExecutor._executor = None
+
+    def test_hash_follows_role_policy(self):
+        self.assertTrue(PasswordHashingPolicy.make_password('secret', 'admin').startswith('pbkdf2_sha256$2000$'))
+        self.assertTrue(PasswordHashingPolicy.make_password('secret', 'endUser').startswith('pbkdf2_sha256$1000$'))
+
+    def test_hash_off_policy_is_replaced_on_check(self):
+        encoded = PasswordHashingPolicy.make_password('secret', 'endUser')
+        setter = mock.Mock()
+
+        self.assertTrue(PasswordHashingPolicy.check_password('secret', encoded, setter, 'endUser'))
+        setter.assert_not_called()
+        self.assertFalse(PasswordHashingPolicy.check_password('wrong', encoded, setter, 'admin'))
+        setter.assert_not_called()
+        self.assertTrue(PasswordHashingPolicy.check_password('secret', encoded, setter, 'admin'))
+        setter.assert_called_once_with('secret')
+
+    def test_disabled_pool_runs_inline(self):
+        self.assertEqual(HashingExecutor.run(os.getpid), os.getpid())
+        self.assertIsNone(HashingExecutor._executor)
+
+    @override_settings(PASSWORD_HASHING_POOL=True, PASSWORD_HASHING_WORKERS=1)
+    def test_pool_hashes_in_worker_process(self):
+        self.assertNotEqual(HashingExecutor.run(os.getpid), os.getpid())
+
+        encoded = PasswordHashingPolicy.make_password('secret', 'admin')
+        self.assertTrue(encoded.startswith('pbkdf2_sha256$2000$'))
+        self.assertTrue(PasswordHashingPolicy.check_password('secret', encoded, role='admin'))
+
+    @override_settings(PASSWORD_HASHING_POOL=True)
+    def test_saturated_pool_refuses_login(self):
+        user = User.objects.create(
+            email='hash@pool.test', full_name='Hash', phone_number='+251900000000', role='endUser', status='active'
+        )
+        user.set_password('secret')
+        user.save()
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        executor = mock.Mock()
+
+        with mock.patch.object(HashingExecutor, '_ensure_executor', return_value=(executor, slots)):
+            with self.assertRaises(HashingPoolSaturated):
+                HashingExecutor.run(os.getpid)
+            response = APIClient(SERVER_NAME='localhost').post(
+                '/api/auth/login/', {'email': 'hash@pool.test', 'password': 'secret'}, format='json'
+            )
+
+        self.assertEqual(response.status_code, 429)
+        executor.submit.assert_not_called()
+
+    @override_settings(PASSWORD_HASHING_POOL=True)
+    def test_broken_pool_finishes_inline_and_is_replaced(self):
+        executor = mock.Mock()
+        executor.submit.return_value.result.side_effect = BrokenProcessPool()
+        slots = threading.BoundedSemaphore(1)
+        HashingExecutor._executor, HashingExecutor._slots, HashingExecutor._pid = executor, slots, os.getpid()
+
+        self.assertEqual(HashingExecutor.run(os.getpid), os.getpid())
+
+        self.assertIsNone(HashingExecutor._executor)
+        # The slot was given back
+        self.assertTrue(slots.acquire(blocking=False))
+
+
+@override_settings(SESSION_SWEEP_SECONDS=0)
+class SessionManagerTests(TestCase):
+    """Session validation served from the process-local cache"""
+
+    def setUp(self):
+        SessionManager._cache.clear()
+        SessionManager._user_sessions.clear()
+        self.user = User.objects.create(
+            email='session@cache.test', full_name='Session', phone_number='+251900000000', role='endUser', status='active'
+        )
+
+    def create_session(self, session_id, expires_in, is_active=True):
+        return Session.objects.create(
+            session_id=session_id, user_id=self.user, expires_at=timezone.now() + expires_in, is_active=is_active
+        )
+
+    def test_new_session_validates_from_cache(self):
+        session_id = SessionManager.create_session(self.user)
+
+        with self.assertNumQueries(0):
+            self.assertTrue(SessionManager.validate_session(session_id))
+            self.assertEqual(SessionManager.create_session(self.user), session_id)
+
+    def test_session_is_read_once_then_cached(self):
+        self.create_session('known', timedelta(hours=1))
+
+        with self.assertNumQueries(1):
+            self.assertTrue(SessionManager.validate_session('known'))
+            self.assertTrue(SessionManager.validate_session('known'))
+
+    def test_unknown_and_inactive_ids_are_cached_as_invalid(self):
+        self.create_session('inactive', timedelta(hours=1), is_active=False)
+
+        with self.assertNumQueries(2):
+            for _ in range(2):
+                self.assertFalse(SessionManager.validate_session('unknown'))
+                self.assertFalse(SessionManager.validate_session('inactive'))
+
+    def test_terminated_session_is_refused(self):
+        session_id = SessionManager.create_session(self.user)
+
+        self.assertTrue(SessionManager.terminate_session(session_id))
+
+        self.assertFalse(SessionManager.validate_session(session_id))
+        self.assertFalse(Session.objects.get(session_id=session_id).is_active)
+        self.assertNotEqual(SessionManager.create_session(self.user), session_id)
+
+    def test_cached_session_expires_without_query(self):
+        session_id = SessionManager.create_session(self.user, expiry_hours=1)
+        later = timezone.now() + timedelta(hours=2)
+
+        with mock.patch('django.utils.timezone.now', return_value=later), self.assertNumQueries(0):
+            self.assertFalse(SessionManager.validate_session(session_id))
+
+
+@override_settings(SESSION_SWEEP_SECONDS=0)
+class SessionExpiryTests(TestCase):
+    """Batched expiry sweeps, the expire_sessions purge and the sweeper thread"""
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='session@expiry.test', full_name='Session', phone_number='+251900000000', role='endUser',
+            status='active'
+        )
+
+    def create_session(self, session_id, expires_in):
+        return Session.objects.create(session_id=session_id, user_id=self.user, expires_at=timezone.now() + expires_in)
+
+    def test_sweep_deactivates_expired_sessions_in_batches(self):
+        for number in range(3):
+            self.create_session(f'expired-{number}', -timedelta(minutes=1))
+        self.create_session('live', timedelta(hours=1))
+
+        self.assertEqual(SessionManager.sweep_expired(batch_size=2), 3)
+
+        self.assertEqual(list(Session.objects.filter(is_active=True).values_list('session_id', flat=True)), ['live'])
+        self.assertEqual(SessionManager.sweep_expired(), 0)
+
+    def test_expire_sessions_deletes_past_retention(self):
+        self.create_session('old', -timedelta(days=31))
+        self.create_session('recent', -timedelta(days=1))
+        self.create_session('live', timedelta(hours=1))
+
+        call_command('expire_sessions', retention_days=30, batch_size=1, stdout=StringIO())
+
+        self.assertEqual(
+            dict(Session.objects.values_list('session_id', 'is_active')), {'recent': False, 'live': True}
+        )
+
+    @override_settings(SESSION_SWEEP_SECONDS=300)
+    def test_sweeper_starts_once_per_process(self):
+        self.addCleanup(setattr, SessionManager, '_sweeper', SessionManager._sweeper)
+        self.addCleanup(setattr, SessionManager, '_sweeper_pid', SessionManager._sweeper_pid)
+        SessionManager._sweeper = None
+
+        with mock.patch('api.services.threading.Thread') as thread:
+            SessionManager._ensure_sweeper()
+            SessionManager._ensure_sweeper()
+            self.assertEqual(thread.call_count, 1)
+            thread.return_value.start.assert_called_once_with()
+
+            # A forked worker inherits the attribute but not the thread
+            SessionManager._sweeper_pid = -1
+            SessionManager._ensure_sweeper()
+            self.assertEqual(thread.call_count, 2)
+
+
+class TokenBlacklistFilterTests(TestCase):
+    """Blacklist checks of refresh tokens through the per-process Bloom filter"""
+
+    def setUp(self):
+        TokenBlacklistFilter._filter = None
+        self.user = User.objects.create(
+            email='holder@tokens.test', full_name='Holder', phone_number='+251900000000', role='endUser', status='active'
+        )
+
+    def test_miss_does_not_query(self):
+        token = BlacklistRefreshToken.for_user(self.user)
+        TokenBlacklistFilter.might_contain('warm-up')
+
+        with self.assertNumQueries(0):
+            self.assertFalse(TokenBlacklistFilter.might_contain(token['jti']))
+            BlacklistRefreshToken(str(token))
+
+    def test_token_blacklisted_here_is_refused(self):
+        token = BlacklistRefreshToken.for_user(self.user)
+        TokenBlacklistFilter.might_contain('warm-up')
+        BlacklistRefreshToken(str(token)).blacklist()
+
+        with self.assertRaises(TokenError):
+            BlacklistRefreshToken(str(token))
+
+    def test_token_blacklisted_elsewhere_is_refused_after_sync(self):
+        token = BlacklistRefreshToken.for_user(self.user)
+        TokenBlacklistFilter.might_contain('warm-up')
+        # Written directly, as another process would, so this process's filter isn't told
+        BlacklistedToken.objects.create(token=OutstandingToken.objects.get(jti=token['jti']))
+
+        # Accepted until the next sync...
+        BlacklistRefreshToken(str(token))
+        TokenBlacklistFilter._synced_at -= settings.TOKEN_BLACKLIST_FILTER_SYNC_SECONDS
+        # ...and refused once it has run
+        with self.assertRaises(TokenError):
+            BlacklistRefreshToken(str(token))
+
+
+class ClaimsAuthenticationTests(TestCase):
+    """request.user built from the role and status claims of access tokens"""
+
+    def setUp(self):
+        TokenBlacklistFilter._filter = None
+        ClaimsJWTAuthentication._users.clear()
+        self.user = User.objects.create(
+            email='claims@auth.test', full_name='Claims', phone_number='+251900000000', role='merchant', status='active'
+        )
+        self.authenticator = ClaimsJWTAuthentication()
+        TokenBlacklistFilter.might_contain('warm-up')
+
+    def authenticate(self, access):
+        return self.authenticator.get_user(self.authenticator.get_validated_token(access))
+
+    def test_claims_do_not_query(self):
+        access = AuthenticationManager.generate_token(self.user)['access']
+
+        with self.assertNumQueries(0):
+            user = self.authenticate(access)
+        self.assertEqual((user.pk, user.role, user.status), (self.user.pk, 'merchant', 'active'))
+
+    def test_deferred_fields_load_in_one_query(self):
+        user = self.authenticate(AuthenticationManager.generate_token(self.user)['access'])
+
+        with self.assertNumQueries(1):
+            self.assertEqual(user.email, 'claims@auth.test')
+            self.assertEqual(user.full_name, 'Claims')
+            self.assertEqual(user.phone_number, '+251900000000')
+
+    def test_refreshed_token_carries_current_claims(self):
+        tokens = AuthenticationManager.generate_token(self.user)
+        User.objects.filter(pk=self.user.pk).update(role='endUser')
+
+        user = self.authenticate(AuthenticationManager.refresh_token(tokens['refresh'])['access'])
+
+        self.assertEqual(user.role, 'endUser')
+
+    def test_revoked_user_is_refused(self):
+        tokens = AuthenticationManager.generate_token(self.user)
+        User.objects.filter(pk=self.user.pk).update(status='suspended')
+
+        self.assertEqual(AuthenticationManager.revoke_user_tokens(self.user), 1)
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(tokens['access'])
+        with self.assertRaises(TokenError):
+            AuthenticationManager.refresh_token(tokens['refresh'])
+
+    def test_logout_revokes_access_token(self):
+        tokens = AuthenticationManager.generate_token(self.user)
+
+        AuthenticationManager.logout_user(tokens['refresh'])
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(tokens['access'])
+
+    def test_token_without_claims_is_looked_up_once(self):
+        access = str(BlacklistRefreshToken.for_user(self.user).access_token)
+
+        with self.assertNumQueries(1):
+            self.authenticate(access)
+            user = self.authenticate(access)
+        self.assertEqual(user.role, 'merchant')
+
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        ClaimsJWTAuthentication._users.clear()
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate(access)
+
+
+class FailingChannel:
+    def send(self, notifications):
+        return {notification.notification_id: 'gateway down' for notification in notifications}
+
+
+@override_settings(NOTIFICATION_MAX_ATTEMPTS=2)
+class NotificationDispatcherTests(TestCase):
+    """Retry backoff and claim scoping of failed deliveries"""
+
+    def setUp(self):
+        user = User.objects.create(
+            email='notify@dispatch.test', full_name='Notify', phone_number='+251900000000', role='endUser', status='active'
+        )
+        self.notification = Notification.objects.create(user_id=user, message='Hello', type='SMS')
+
+    def dispatcher(self, worker_id='worker-1'):
+        dispatcher = NotificationDispatcher(worker_id=worker_id)
+        dispatcher.channels = {'SMS': FailingChannel()}
+        return dispatcher
+
+    def test_failed_delivery_backs_off_then_fails(self):
+        dispatcher = self.dispatcher()
+
+        self.assertEqual(dispatcher.run_once(), (0, 1))
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.status, 'PENDING')
+        self.assertGreater(self.notification.next_attempt_at, timezone.now())
+        # Not due yet
+        self.assertEqual(dispatcher.run_once(), (0, 0))
+
+        Notification.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(dispatcher.run_once(), (0, 1))
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.status, 'FAILED')
+        self.assertEqual(self.notification.attempts, 2)
+
+    def test_completion_skips_rows_taken_over(self):
+        first = self.dispatcher('worker-1')
+        notifications = first.claim()
+        Notification.objects.update(attempts=1, claimed_by='worker-2')
+
+        first.complete(notifications, first.deliver(notifications))
+
+        self.notification.refresh_from_db()
+        self.assertEqual(self.notification.status, 'PENDING')
+        self.assertEqual(self.notification.claimed_by, 'worker-2')
+
+
+class NotificationDeliveryTests(TestCase):
+    """Batched claims and delivery through the configured channels"""
+
+    def setUp(self):
+        self.user = User.objects.create(
+            email='deliver@dispatch.test', full_name='Deliver', phone_number='+251911111111', role='endUser',
+            status='active'
+        )
+        self.outbox = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(NOTIFICATION_OUTBOX_DIR=self.outbox))
+
+    def notify(self, count, notification_type='SMS'):
+        return Notification.objects.bulk_create([
+            Notification(user_id=self.user, message=f'Message {number}', type=notification_type)
+            for number in range(count)
+        ])
+
+    def test_delivered_notifications_reach_outbox_and_are_sent(self):
+        self.notify(2, 'SMS')
+        self.notify(1, 'EMAIL')
+        self.notify(1, 'IN_APP')
+
+        self.assertEqual(NotificationDispatcher().run_once(), (4, 0))
+
+        self.assertFalse(Notification.objects.exclude(status='SENT').exists())
+        self.assertFalse(Notification.objects.filter(sent_at__isnull=True).exists())
+        with open(os.path.join(self.outbox, 'sms.log')) as outbox_file:
+            sms = [json.loads(line) for line in outbox_file]
+        self.assertEqual([line['to'] for line in sms], ['+251911111111'] * 2)
+        with open(os.path.join(self.outbox, 'email.log')) as outbox_file:
+            self.assertEqual(json.loads(outbox_file.readline())['to'], 'deliver@dispatch.test')
+        self.assertFalse(os.path.exists(os.path.join(self.outbox, 'in_app.log')))
+
+    def test_workers_claim_disjoint_batches(self):
+        self.notify(5)
+        first = NotificationDispatcher(batch_size=3, worker_id='worker-1').claim()
+        second = NotificationDispatcher(batch_size=3, worker_id='worker-2').claim()
+
+        self.assertEqual((len(first), len(second)), (3, 2))
+        self.assertFalse({n.notification_id for n in first} & {n.notification_id for n in second})
+        self.assertEqual(NotificationDispatcher(worker_id='worker-3').claim(), [])
+
+    @override_settings(NOTIFICATION_CLAIM_TIMEOUT=60)
+    def test_stale_claim_is_taken_over(self):
+        self.notify(1)
+        NotificationDispatcher(worker_id='worker-1').claim()
+        Notification.objects.update(claimed_at=timezone.now() - timedelta(seconds=61))
+
+        claimed = NotificationDispatcher(worker_id='worker-2').claim()
+
+        self.assertEqual(len(claimed), 1)
+        self.assertEqual(Notification.objects.get().claimed_by, 'worker-2')
+
+    def test_type_without_channel_fails(self):
+        self.notify(1)
+        dispatcher = NotificationDispatcher()
+        dispatcher.channels = {}
+
+        self.assertEqual(dispatcher.run_once(), (0, 1))
+        self.assertEqual(Notification.objects.get().attempts, 1)
+
+    @override_settings(NOTIFICATION_RETRY_BASE_SECONDS=10, NOTIFICATION_RETRY_MAX_SECONDS=60)
+    def test_retry_delay_doubles_up_to_cap(self):
+        dispatcher = NotificationDispatcher()
+
+        with mock.patch('api.notifications.random.uniform', side_effect=lambda low, high: high):
+            self.assertEqual([dispatcher.retry_delay(attempts) for attempts in range(1, 6)], [10, 20, 40, 60, 60])
+        for _ in range(20):
+            self.assertTrue(5 <= dispatcher.retry_delay(1) <= 10)
+
+    def test_batch_query_count_does_not_grow_with_batch(self):
+        def queries_for(count):
+            Notification.objects.all().delete()
+            self.notify(count, 'SMS')
+            self.notify(count, 'EMAIL')
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(NotificationDispatcher().run_once(), (2 * count, 0))
+            return len(queries)
+
+        self.assertEqual(queries_for(2), queries_for(20))
+
+
+class WebhookTests(TestCase):
+    """Callback URL checks and per-merchant webhook signing"""
+
+    def setUp(self):
+        self.customer = User.objects.create(
+            email='customer@webhooks.test', full_name='Customer', phone_number='+251900000000', role='endUser', status='active'
+        )
+        self.merchant = User.objects.create(
+            email='merchant@webhooks.test', full_name='Merchant', phone_number='+251900000000', role='merchant', status='active'
+        )
+        self.client = APIClient(SERVER_NAME='localhost')
+
+    def queue(self, url):
+        payment = Payment.objects.create(
+            user_id=self.customer, recipient_id=self.merchant, amount='10.00', payment_method='BankTransfer',
+            status='Completed', callback_url=url
+        )
+        return enqueue_payment_event(payment)
+
+    def test_non_public_callback_urls_are_refused(self):
+        for url in (
+            'http://127.0.0.1/hook', 'http://localhost:8000/hook', 'http://10.1.2.3/hook', 'http://192.168.0.1/hook',
+            'http://169.254.169.254/latest/meta-data/', 'http://[::1]/hook', 'http://[::ffff:127.0.0.1]/hook',
+            'http://0.0.0.0/hook', 'ftp://93.184.216.34/hook',
+        ):
+            with self.subTest(url=url):
+                with self.assertRaises(ValidationError):
+                    check_callback_url(url)
+        check_callback_url('https://93.184.216.34/hook')
+
+    def test_check_returns_address_to_pin(self):
+        self.assertEqual(check_callback_url('https://93.184.216.34/hook'), '93.184.216.34')
+        self.assertEqual(
+            pinned_url('https://shop.example:8443/hook?id=1', '2001:db8::1'),
+            ('https://[2001:db8::1]:8443/hook?id=1', 'shop.example:8443')
+        )
+
+    def test_delivery_is_sent_to_checked_address(self):
+        # The host name never resolves again: the request goes to the address the check returned
+        with WebhookStubServer(merchant_secret(self.merchant)) as stub:
+            port = urlsplit(stub.url).port
+            self.queue(f'http://shop.example:{port}/hook')
+            with mock.patch('api.webhooks.check_callback_url', return_value='127.0.0.1'):
+                self.assertEqual(WebhookDispatcher(worker_id='worker-1').run_once(), (1, 0, 0))
+
+        self.assertEqual(stub.received[0]['host'], f'shop.example:{port}')
+
+    def test_pinned_https_verifies_original_host(self):
+        request = requests.Request('POST', 'https://93.184.216.34/hook', headers={'Host': 'shop.example'}).prepare()
+
+        host_params, pool_kwargs = PinnedHostAdapter().build_connection_pool_key_attributes(request, True)
+
+        self.assertEqual(host_params['host'], '93.184.216.34')
+        self.assertEqual(pool_kwargs['server_hostname'], 'shop.example')
+        self.assertEqual(pool_kwargs['assert_hostname'], 'shop.example')
+
+    def test_initiate_payment_refuses_private_callback(self):
+        self.client.force_authenticate(self.customer)
+        response = self.client.post('/api/payment/initiate/', {
+            'amount': '10.00', 'recipientID': str(self.merchant.pk), 'callbackURL': 'http://169.254.169.254/hook'
+        }, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Payment.objects.exists())
+
+    def test_delivery_to_private_address_is_refused_before_sending(self):
+        with WebhookStubServer(merchant_secret(self.merchant)) as stub:
+            self.queue(stub.url)
+            self.assertEqual(WebhookDispatcher(worker_id='worker-1').run_once(), (0, 1, 0))
+
+        self.assertEqual(stub.received, [])
+        self.assertTrue(WebhookDelivery.objects.get().last_error.startswith('Callback URL refused'))
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE_TARGETS=True)
+    def test_delivery_is_signed_with_merchant_secret(self):
+        with WebhookStubServer(merchant_secret(self.merchant)) as stub:
+            self.queue(stub.url)
+            self.assertEqual(WebhookDispatcher(worker_id='worker-1').run_once(), (1, 0, 0))
+
+        self.assertEqual(len(stub.received), 1)
+        self.assertEqual(stub.received[0]['event'], 'payment.completed')
+
+    @override_settings(WEBHOOK_ALLOW_PRIVATE_TARGETS=True)
+    def test_other_secret_is_rejected(self):
+        with WebhookStubServer('not-the-merchant-secret') as stub:
+            self.queue(stub.url)
+            self.assertEqual(WebhookDispatcher(worker_id='worker-1').run_once(), (0, 1, 0))
+
+        self.assertEqual(stub.rejected, 1)
+
+    def test_secret_endpoint(self):
+        self.client.force_authenticate(self.merchant)
+        secret = self.client.get('/api/webhooks/secret/').data['webhookSecret']
+        rotated = self.client.post('/api/webhooks/secret/').data['webhookSecret']
+
+        self.assertEqual(self.client.get('/api/webhooks/secret/').data['webhookSecret'], rotated)
+        self.assertNotEqual(secret, rotated)
+        self.client.force_authenticate(self.customer)
+        self.assertEqual(self.client.get('/api/webhooks/secret/').status_code, 403)
@@ -0,0 +1,145 @@
+# api/tokens.py
+import hashlib
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+# Access token claim naming the refresh token it was issued from, so revoking
+# the refresh token also revokes its access tokens (api.authentication)
+REFRESH_JTI_CLAIM = 'rjti'
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings: no false negatives, error_rate false positives at capacity"""
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(int(capacity), 1)
+        self.size = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hash_count = max(1, round(self.size / self.capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # Double hashing over one 128-bit digest
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hash_count)]
+
+    def add(self, value):
+        for position in self._positions(value):
+            self._bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(value))
+
+
+class TokenBlacklistFilter:
+    """
+    Per-process Bloom filter of blacklisted refresh token ids.
+
+    Built from the unexpired BlacklistedToken rows on first use, it picks up
+    rows blacklisted by other processes every TOKEN_BLACKLIST_FILTER_SYNC_SECONDS
+    (by primary key, so the sync is one indexed range query) and is rebuilt
+    every TOKEN_BLACKLIST_FILTER_REBUILD_SECONDS to drop expired tokens.
+    Tokens blacklisted by this process are added immediately; a token
+    blacklisted by another process can still be refreshed here for up to
+    TOKEN_BLACKLIST_FILTER_SYNC_SECONDS. A jti the filter has not seen is
+    treated as not blacklisted without touching the database, so only filter
+    hits are checked against the blacklist itself.
+    """
+    # Rows are re-read this far below the highest id seen, so a blacklist
+    # entry whose transaction committed after a higher id isn't missed
+    SYNC_OVERLAP = 1000
+
+    _filter = None
+    _last_id = 0
+    _synced_at = 0.0
+    _built_at = 0.0
+    _pid = None
+    _lock = threading.Lock()
+
+    @classmethod
+    def might_contain(cls, jti):
+        """False when jti is certainly not blacklisted"""
+        try:
+            cls._sync()
+        except Exception as e:
+            print(f"Token blacklist filter unavailable: {str(e)}")
+            return True
+        return jti in cls._filter
+
+    @classmethod
+    def add(cls, jti):
+        with cls._lock:
+            if cls._filter is not None and cls._pid == os.getpid():
+                cls._filter.add(jti)
+
+    @classmethod
+    def _sync(cls):
+        now = time.monotonic()
+        sync_seconds = getattr(settings, 'TOKEN_BLACKLIST_FILTER_SYNC_SECONDS', 5)
+        if cls._filter is not None and cls._pid == os.getpid() and now - cls._synced_at < sync_seconds:
+            return
+
+        with cls._lock:
+            if cls._filter is not None and cls._pid == os.getpid() and now - cls._synced_at < sync_seconds:
+                return
+            if (
+                cls._filter is None
+                or cls._pid != os.getpid()
+                or cls._filter.count > cls._filter.capacity
+                or now - cls._built_at >= getattr(settings, 'TOKEN_BLACKLIST_FILTER_REBUILD_SECONDS', 3600)
+            ):
+                cls._rebuild(now)
+            else:
+                cls._read_since(cls._last_id - cls.SYNC_OVERLAP)
+            cls._synced_at = now
+
+    @classmethod
+    def _read_since(cls, last_id):
+        for row_id, jti in BlacklistedToken.objects.filter(id__gt=last_id).values_list('id', 'token__jti'):
+            cls._filter.add(jti)
+            cls._last_id = max(cls._last_id, row_id)
+
+    @classmethod
+    def _rebuild(cls, now):
+        rows = list(
+            BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now()).values_list('id', 'token__jti')
+        )
+        bloom = BloomFilter(
+            max(getattr(settings, 'TOKEN_BLACKLIST_FILTER_CAPACITY', 100000), 2 * len(rows)),
+            getattr(settings, 'TOKEN_BLACKLIST_FILTER_ERROR_RATE', 0.001)
+        )
+        for _, jti in rows:
+            bloom.add(jti)
+        cls._filter = bloom
+        cls._last_id = max((row_id for row_id, _ in rows), default=cls._last_id)
+        cls._built_at = now
+        cls._pid = os.getpid()
+
+
+def is_blacklisted(jti):
+    """Whether refresh token jti is blacklisted - the database is only read on a TokenBlacklistFilter hit"""
+    return TokenBlacklistFilter.might_contain(jti) and BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+class BlacklistRefreshToken(RefreshToken):
+    """Refresh token whose blacklist check only reaches the database on a TokenBlacklistFilter hit"""
+
+    def check_blacklist(self):
+        if TokenBlacklistFilter.might_contain(self.payload[api_settings.JTI_CLAIM]):
+            super().check_blacklist()
+
+    def blacklist(self):
+        blacklisted = super().blacklist()
+        TokenBlacklistFilter.add(self.payload[api_settings.JTI_CLAIM])
+        return blacklisted
@@ -3,8 +3,10 @@ from .views import (
     register, login, logout, refresh_token_view,
     view_dashboard, initiate_payment, process_payment,
     cancel_payment, get_payment_details, get_transaction_details,
-    get_user_transactions, get_receipt_details, get_notifications,
-    calculate_fee, update_fee_rules, get_user_profile
+    get_user_transactions, export_transactions, get_receipt_details, get_notifications,
+    calculate_fee, calculate_fees_batch, update_fee_rules, update_fee_schedule,
+    get_system_log_stats, search_system_logs, get_webhook_stats, get_user_profile, stream_events,
+    webhook_secret
 )
 
 urlpatterns = [
@@ -27,6 +29,7 @@ urlpatterns = [
     # Transaction
     path('transaction/<uuid:transaction_id>/', get_transaction_details, name='get-transaction-details'),
     path('transactions/', get_user_transactions, name='get-user-transactions'),
+    path('transactions/export/', export_transactions, name='export-transactions'),
     
     # Receipt
     path('receipt/<uuid:receipt_id>/', get_receipt_details, name='get-receipt-details'),
@@ -34,7 +37,20 @@ urlpatterns = [
     # Notifications
     path('notifications/', get_notifications, name='get-notifications'),
     
+    # Payment status and notification events (Server-Sent Events)
+    path('events/', stream_events, name='stream-events'),
+    
     # Service Fee
     path('fee/calculate/', calculate_fee, name='calculate-fee'),
+    path('fee/calculate/batch/', calculate_fees_batch, name='calculate-fees-batch'),
     path('fee/update/', update_fee_rules, name='update-fee-rules'),
+    path('fee/schedule/', update_fee_schedule, name='update-fee-schedule'),
+    
+    # System logs
+    path('logs/', search_system_logs, name='search-system-logs'),
+    path('logs/stats/', get_system_log_stats, name='system-log-stats'),
+    
+    # Merchant webhooks
+    path('webhooks/stats/', get_webhook_stats, name='webhook-stats'),
+    path('webhooks/secret/', webhook_secret, name='webhook-secret'),
 ]
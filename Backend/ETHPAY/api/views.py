@@ -1,31 +1,44 @@
 # api/views.py
+from asgiref.sync import sync_to_async
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import AuthenticationFailed
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework_simplejwt.tokens import RefreshToken
 from django.utils import timezone
-from django.http import JsonResponse
+from django.core.handlers.asgi import ASGIRequest
+from django.http import JsonResponse, StreamingHttpResponse
 
 from .serializers import (
     RegisterSerializer, LoginSerializer, UserSerializer, PaymentSerializer,
     TransactionSerializer, ReceiptSerializer, DashboardSerializer,
-    NotificationSerializer, WalletIntegrationSerializer
+    NotificationSerializer, SystemLogSerializer, WalletIntegrationSerializer
 )
 from .models import (
     User, Payment, Transaction, Receipt, Dashboard, Notification,
     WalletIntegration, SystemLog
 )
+from .authentication import ClaimsJWTAuthentication, full_user
+from .events import event_stream, payment_event, publish_notification, publish_payment_status
+from .webhooks import (
+    WebhookDispatcher, check_callback_url, enqueue_payment_event, merchant_secret, rotate_merchant_secret
+)
+from .exports import EXPORT_CONTENT_TYPES, stream_export, time_range_filter
+from .middleware import query_budget
+from .pagination import KeysetPagination
 from .services import (
     AuthenticationManager, SessionManager, Validator,
-    ServiceFeeCalculatorService, SystemLogService
+    ServiceFeeCalculatorService, SystemLogService, SystemLogBuffer, idempotent
 )
 
 # At the top of api/views.py
 import json
+from django.conf import settings
 import secrets
 from django.http import JsonResponse
 from django.contrib.auth import authenticate
+from django.core.exceptions import ValidationError
 from django.utils import timezone
 from datetime import timedelta
 from .services import AuthenticationManager
@@ -182,10 +195,18 @@ def initiate_payment(request):
     recipient_id = request.data.get('recipientID')
     payment_method = request.data.get('paymentMethod', 'Wallet')
     currency = request.data.get('currency', 'ETB')
+    # Merchant webhook endpoint; the shop integration sends it as callback_url
+    callback_url = request.data.get('callbackURL') or request.data.get('callback_url') or ''
     
     if not amount or not recipient_id:
         return Response({"error": "Amount and recipientID are required"}, status=status.HTTP_400_BAD_REQUEST)
     
+    if callback_url:
+        try:
+            check_callback_url(callback_url)
+        except ValidationError:
+            return Response({"error": "callbackURL must be a public http(s) URL"}, status=status.HTTP_400_BAD_REQUEST)
+    
     # Validate amount
     is_valid, errors = Validator.validate_user_input({'amount': amount})
     if not is_valid:
@@ -206,7 +227,8 @@ def initiate_payment(request):
         currency=currency,
         recipient_id=recipient,
         payment_method=payment_method,
-        status='Pending'
+        status='Pending',
+        callback_url=callback_url
     )
     
     SystemLogService.create_log(
@@ -225,6 +247,7 @@ def initiate_payment(request):
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
+@idempotent('payment-process')
 def process_payment(request):
     """ProcessPayment() - Process a pending payment"""
     payment_id = request.data.get('paymentID')
@@ -241,8 +264,8 @@ def process_payment(request):
         return Response({"error": "Payment is not in pending status"}, status=status.HTTP_400_BAD_REQUEST)
     
     # Calculate service fee
-    service_fee = ServiceFeeCalculatorService.calculate_fee(payment.amount)
-    total_amount = float(payment.amount) + service_fee
+    service_fee = ServiceFeeCalculatorService.calculate_fee(payment.amount, payment.recipient_id_id)
+    total_amount = payment.amount + service_fee
     
     # Create transaction
     transaction = Transaction.objects.create(
@@ -275,12 +298,15 @@ def process_payment(request):
     )
     
     # Send notification
-    Notification.objects.create(
+    notification = Notification.objects.create(
         user_id=payment.user_id,
         message=f"Payment of {payment.amount} {payment.currency} processed successfully",
         type='IN_APP',
         status='PENDING'
     )
+    publish_payment_status(payment)
+    publish_notification(notification)
+    enqueue_payment_event(payment)
     
     SystemLogService.create_log(
         user_id=payment.user_id,
@@ -315,6 +341,8 @@ def cancel_payment(request):
     
     payment.status = 'Cancelled'
     payment.save()
+    publish_payment_status(payment)
+    enqueue_payment_event(payment)
     
     SystemLogService.create_log(
         user_id=request.user,
@@ -326,6 +354,7 @@ def cancel_payment(request):
     return Response({"message": "Payment cancelled successfully"}, status=status.HTTP_200_OK)
 
 
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_payment_details(request, payment_id):
@@ -333,7 +362,7 @@ def get_payment_details(request, payment_id):
     try:
         payment = Payment.objects.get(payment_id=payment_id)
         # Check if user has access to this payment
-        if payment.user_id != request.user and payment.recipient_id != request.user:
+        if payment.user_id_id != request.user.pk and payment.recipient_id_id != request.user.pk:
             return Response({"error": "Access denied"}, status=status.HTTP_403_FORBIDDEN)
         
         serializer = PaymentSerializer(payment)
@@ -343,13 +372,14 @@ def get_payment_details(request, payment_id):
 
 
 # TRANSACTION OPERATIONS - CLASS 22
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_transaction_details(request, transaction_id):
     """GetTransactionDetails() - Get transaction details"""
     try:
         transaction = Transaction.objects.get(transaction_id=transaction_id)
-        if transaction.user_id != request.user:
+        if transaction.user_id_id != request.user.pk:
             return Response({"error": "Access denied"}, status=status.HTTP_403_FORBIDDEN)
         
         serializer = TransactionSerializer(transaction)
@@ -358,23 +388,58 @@ def get_transaction_details(request, transaction_id):
         return Response({"error": "Transaction not found"}, status=status.HTTP_404_NOT_FOUND)
 
 
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_user_transactions(request):
-    """Get all transactions for authenticated user"""
-    transactions = Transaction.objects.filter(user_id=request.user).order_by('-created_at')
+    """Get the authenticated user's transactions, newest first, one page per request"""
+    paginator = KeysetPagination('created_at')
+    transactions = paginator.paginate_queryset(Transaction.objects.filter(user_id=request.user), request)
     serializer = TransactionSerializer(transactions, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return paginator.get_paginated_response(serializer.data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_transactions(request):
+    """Stream the authenticated user's transactions as NDJSON or CSV (?output=ndjson|csv&from=&to=)"""
+    output = request.query_params.get('output', 'ndjson')
+    if output not in EXPORT_CONTENT_TYPES:
+        return Response({"error": "output must be ndjson or csv"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        time_range = time_range_filter('created_at', request.query_params.get('from'), request.query_params.get('to'))
+    except ValueError:
+        return Response({"error": "from and to must be ISO dates or datetimes"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    transactions = Transaction.objects.filter(user_id=request.user, **time_range)
+    
+    return stream_export(
+        transactions.order_by('created_at', 'pk'),
+        [
+            ('transactionID', 'transaction_id'),
+            ('paymentID', 'payment_id'),
+            ('amount', 'amount'),
+            ('service_fee', 'service_fee'),
+            ('total_amount', 'total_amount'),
+            ('status', 'status'),
+            ('createdAt', 'created_at'),
+            ('completedAt', 'completed_at'),
+        ],
+        output,
+        'transactions'
+    )
 
 
 # RECEIPT OPERATIONS - CLASS 25
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_receipt_details(request, receipt_id):
     """GetReceiptDetails() - Get receipt details"""
     try:
         receipt = Receipt.objects.get(receipt_id=receipt_id)
-        if receipt.user_id != request.user:
+        if receipt.user_id_id != request.user.pk:
             return Response({"error": "Access denied"}, status=status.HTTP_403_FORBIDDEN)
         
         serializer = ReceiptSerializer(receipt)
@@ -384,16 +449,27 @@ def get_receipt_details(request, receipt_id):
 
 
 # NOTIFICATION OPERATIONS - CLASS 28
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_notifications(request):
-    """Get all notifications for authenticated user"""
-    notifications = Notification.objects.filter(user_id=request.user).order_by('-sent_at')
+    """Get the authenticated user's notifications, newest first, one page per request"""
+    paginator = KeysetPagination('created_at')
+    notifications = paginator.paginate_queryset(Notification.objects.filter(user_id=request.user), request)
     serializer = NotificationSerializer(notifications, many=True)
-    return Response(serializer.data, status=status.HTTP_200_OK)
+    return paginator.get_paginated_response(serializer.data)
 
 
 # SERVICE FEE CALCULATOR - CLASS 19
+def _fee_merchant(request, merchant_id=None):
+    """Merchant whose fee schedule applies to a quote: merchantId if given, else the calling merchant"""
+    if merchant_id:
+        return merchant_id
+    if request.user.role == 'merchant':
+        return request.user.pk
+    return None
+
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def calculate_fee(request):
@@ -404,16 +480,54 @@ def calculate_fee(request):
         return Response({"error": "Amount is required"}, status=status.HTTP_400_BAD_REQUEST)
     
     try:
-        fee = ServiceFeeCalculatorService.calculate_fee(amount)
+        amount = ServiceFeeCalculatorService.validate_amount(amount)
+        merchant = _fee_merchant(request, request.query_params.get('merchantId'))
+        fee = ServiceFeeCalculatorService.calculate_fee(amount, merchant)
         return Response({
             "amount": float(amount),
             "serviceFee": fee,
-            "totalAmount": float(amount) + fee
+            "totalAmount": float(amount) + float(fee)
         }, status=status.HTTP_200_OK)
     except ValueError as e:
         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def calculate_fees_batch(request):
+    """CalculateFees() - Calculate service fees for a list of amounts (cart or price list)"""
+    amounts = request.data.get('amounts')
+    
+    if not isinstance(amounts, list) or not amounts:
+        return Response({"error": "amounts must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    max_items = getattr(settings, 'FEE_BATCH_MAX_ITEMS', 10000)
+    if len(amounts) > max_items:
+        return Response({"error": f"At most {max_items} amounts per request"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        merchant = _fee_merchant(request, request.data.get('merchantId'))
+        quote = ServiceFeeCalculatorService.calculate_fees(amounts, merchant)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    items = []
+    for amount, fee in zip(quote['amounts'], quote['fees']):
+        items.append({
+            "amount": float(amount),
+            "serviceFee": float(fee),
+            "totalAmount": float(amount + fee)
+        })
+    
+    return Response({
+        "items": items,
+        "count": len(items),
+        "totalAmount": float(quote['total_amount']),
+        "totalFees": float(quote['total_fees']),
+        "grandTotal": float(quote['total_amount'] + quote['total_fees'])
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def update_fee_rules(request):
@@ -444,10 +558,203 @@ def update_fee_rules(request):
         return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
 
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def update_fee_schedule(request):
+    """UpdateFeeSchedule() - Replace a merchant's tiered fee schedule (admin only)"""
+    if request.user.role != 'admin':
+        return Response({"error": "Only admins can update fee schedules"}, status=status.HTTP_403_FORBIDDEN)
+    
+    merchant_id = request.data.get('merchantId')
+    tiers = request.data.get('tiers')
+    
+    if not merchant_id or not isinstance(tiers, list):
+        return Response({"error": "merchantId and a list of tiers are required"}, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        merchant = User.objects.get(userId=merchant_id, role='merchant')
+    except (User.DoesNotExist, ValueError, ValidationError):
+        return Response({"error": "Merchant not found"}, status=status.HTTP_404_NOT_FOUND)
+    
+    try:
+        schedule = ServiceFeeCalculatorService.update_fee_schedule(merchant, [
+            {
+                'threshold': tier.get('threshold', 0),
+                'fee_percentage': tier['feePercentage'],
+                'minimum_fee': tier['minimumFee'],
+                'maximum_fee': tier['maximumFee'],
+            }
+            for tier in tiers
+        ])
+    except (KeyError, TypeError, AttributeError):
+        return Response({"error": "Every tier needs feePercentage, minimumFee and maximumFee"}, status=status.HTTP_400_BAD_REQUEST)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    if schedule is None:
+        return Response({"message": "Fee schedule removed", "merchantId": str(merchant.pk)}, status=status.HTTP_200_OK)
+    
+    return Response({
+        "message": "Fee schedule updated successfully",
+        "merchantId": str(merchant.pk),
+        "tiers": [
+            {
+                "threshold": float(tier.threshold),
+                "feePercentage": float(tier.fee_percentage),
+                "minimumFee": float(tier.minimum_fee),
+                "maximumFee": float(tier.maximum_fee)
+            }
+            for tier in schedule.tiers.all()
+        ]
+    }, status=status.HTTP_200_OK)
+
+
+# SYSTEM LOG - CLASS 34
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def search_system_logs(request):
+    """
+    Audit log search (admin only), newest first and keyset-paginated.
+    Filters: userId, action (exact), status, from/to (ISO dates or datetimes,
+    inclusive); archived=1 searches the logs moved out by archive_system_logs.
+    """
+    if request.user.role != 'admin':
+        return Response({"error": "Only admins can search system logs"}, status=status.HTTP_403_FORBIDDEN)
+    
+    params = request.query_params
+    try:
+        time_range = time_range_filter('timestamp', params.get('from'), params.get('to'))
+    except ValueError:
+        return Response({"error": "from and to must be ISO dates or datetimes"}, status=status.HTTP_400_BAD_REQUEST)
+    date_to = time_range.get('timestamp__lte')
+    if 'timestamp__lt' in time_range:
+        date_to = time_range['timestamp__lt'] - timedelta(microseconds=1)
+    
+    search = SystemLogService.filter_archived_logs if params.get('archived') == '1' else SystemLogService.filter_logs
+    try:
+        logs = search(
+            user_id=params.get('userId'),
+            action=params.get('action'),
+            status=params.get('status'),
+            date_from=time_range.get('timestamp__gte'),
+            date_to=date_to
+        )
+        paginator = KeysetPagination('timestamp')
+        page = paginator.paginate_queryset(logs, request)
+    except ValidationError:
+        return Response({"error": "userId must be a valid user ID"}, status=status.HTTP_400_BAD_REQUEST)
+    return paginator.get_paginated_response(SystemLogSerializer(page, many=True).data)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_system_log_stats(request):
+    """Buffered audit-log writer counters for this worker process (admin only)"""
+    if request.user.role != 'admin':
+        return Response({"error": "Only admins can view log writer statistics"}, status=status.HTTP_403_FORBIDDEN)
+    
+    stats = SystemLogBuffer.stats()
+    return Response({
+        "pending": stats['pending'],
+        "queued": stats['queued'],
+        "written": stats['written'],
+        "failed": stats['failed'],
+        "batches": stats['batches'],
+        "lastBatchSize": stats['last_batch_size'],
+        "maxBatchSize": stats['max_batch_size'],
+        "averageBatchSize": round(stats['written'] / stats['batches'], 1) if stats['batches'] else 0
+    }, status=status.HTTP_200_OK)
+
+
+@api_view(['GET', 'POST'])
+@permission_classes([IsAuthenticated])
+def webhook_secret(request):
+    """The merchant's webhook signing secret; POST replaces it with a new one"""
+    if request.user.role != 'merchant':
+        return Response({"error": "Only merchants have a webhook secret"}, status=status.HTTP_403_FORBIDDEN)
+    
+    if request.method == 'POST':
+        secret = rotate_merchant_secret(request.user)
+    else:
+        secret = merchant_secret(request.user)
+    return Response({"webhookSecret": secret}, status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_webhook_stats(request):
+    """Merchant webhook queue counts and delivery latency percentiles (admin only)"""
+    if request.user.role != 'admin':
+        return Response({"error": "Only admins can view webhook statistics"}, status=status.HTTP_403_FORBIDDEN)
+    
+    stats = WebhookDispatcher.stats()
+    return Response({
+        "pending": stats['pending'],
+        "delivered": stats['delivered'],
+        "failed": stats['failed'],
+        "oldestPendingSeconds": stats['oldest_pending_seconds'],
+        "window": stats['window'],
+        "retried": stats['retried'],
+        "deliveryLatencyMs": stats['delivery_ms'],
+        "requestLatencyMs": stats['request_ms']
+    }, status=status.HTTP_200_OK)
+
+
 # USER PROFILE
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_user_profile(request):
     """Get authenticated user profile"""
-    serializer = UserSerializer(request.user)
+    serializer = UserSerializer(full_user(request.user))
     return Response(serializer.data, status=status.HTTP_200_OK)
+
+
+# EVENT STREAM
+def _stream_user(request):
+    """User from the Authorization header, or from ?token= since EventSource cannot send headers"""
+    authenticator = ClaimsJWTAuthentication()
+    header = authenticator.get_header(request)
+    raw_token = authenticator.get_raw_token(header) if header else request.GET.get('token')
+    if not raw_token:
+        raise AuthenticationFailed('Authentication credentials were not provided.')
+    return authenticator.get_user(authenticator.get_validated_token(raw_token))
+
+
+def _payment_snapshot(payment_id):
+    payment = Payment.objects.only(
+        'payment_id', 'status', 'amount', 'currency', 'processed_at', 'user_id', 'recipient_id'
+    ).filter(payment_id=payment_id).first()
+    return [('payment', payment_event(payment))] if payment else []
+
+
+async def stream_events(request):
+    """
+    Server-Sent Events stream of the authenticated user's payment status changes
+    and IN_APP notifications (?payment_id= narrows it to one payment, starting
+    with its current status). Served only by the ASGI application.
+    """
+    if not isinstance(request, ASGIRequest):
+        return JsonResponse({"error": "The event stream is only served by the ASGI application"}, status=501)
+    
+    try:
+        user = await sync_to_async(_stream_user)(request)
+    except AuthenticationFailed as e:
+        return JsonResponse({"error": str(e.detail)}, status=status.HTTP_401_UNAUTHORIZED)
+    
+    snapshot = None
+    topics = [f'user:{user.pk}']
+    payment_id = request.GET.get('payment_id')
+    if payment_id:
+        try:
+            payment = await Payment.objects.only('user_id', 'recipient_id').aget(payment_id=payment_id)
+        except (Payment.DoesNotExist, ValidationError):
+            return JsonResponse({"error": "Payment not found"}, status=status.HTTP_404_NOT_FOUND)
+        if payment.user_id_id != user.pk and payment.recipient_id_id != user.pk:
+            return JsonResponse({"error": "Access denied"}, status=status.HTTP_403_FORBIDDEN)
+        topics = [f'payment:{payment.payment_id}']
+        snapshot = lambda: sync_to_async(_payment_snapshot)(payment.payment_id)
+    
+    response = StreamingHttpResponse(event_stream(topics, snapshot), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,365 @@
+# api/webhooks.py
+import hashlib
+import hmac
+import ipaddress
+import json
+import os
+import random
+import secrets
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.validators import URLValidator
+from django.db import connection, transaction
+from django.db.models import Count, F, Min, Q
+from django.utils import timezone
+
+from .events import payment_event
+from .models import User, WebhookDelivery
+
+SIGNATURE_HEADER = 'X-EthPay-Signature'
+EVENT_HEADER = 'X-EthPay-Event'
+DELIVERY_HEADER = 'X-EthPay-Delivery'
+
+
+# Signing - receivers recompute the HMAC over the raw request body
+def sign(body, timestamp, secret):
+    """Hex HMAC-SHA256 of b'<timestamp>.<body>' with the merchant's webhook secret"""
+    return hmac.new(secret.encode('utf-8'), str(timestamp).encode('ascii') + b'.' + body, hashlib.sha256).hexdigest()
+
+
+def signature_header(body, secret, timestamp=None):
+    timestamp = int(time.time()) if timestamp is None else timestamp
+    return f't={timestamp},v1={sign(body, timestamp, secret)}'
+
+
+def verify_signature(body, header, secret, tolerance=None):
+    """True when header signs body and is no older than tolerance seconds (WEBHOOK_SIGNATURE_TOLERANCE)"""
+    try:
+        parts = dict(part.split('=', 1) for part in header.split(','))
+        timestamp = int(parts['t'])
+    except (AttributeError, KeyError, ValueError):
+        return False
+    tolerance = tolerance if tolerance is not None else getattr(settings, 'WEBHOOK_SIGNATURE_TOLERANCE', 300)
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    return hmac.compare_digest(parts.get('v1', ''), sign(body, timestamp, secret))
+
+
+def merchant_secret(merchant):
+    """merchant's webhook secret, generated on first use"""
+    if not merchant.webhook_secret:
+        # Conditional, so concurrent first uses agree on one secret
+        User.objects.filter(pk=merchant.pk, webhook_secret='').update(webhook_secret=secrets.token_urlsafe(32))
+        merchant.webhook_secret = User.objects.filter(pk=merchant.pk).values_list('webhook_secret', flat=True).get()
+    return merchant.webhook_secret
+
+
+def rotate_merchant_secret(merchant):
+    """Replace merchant's webhook secret - Deliveries sent from now on are signed with the new one"""
+    merchant.webhook_secret = secrets.token_urlsafe(32)
+    User.objects.filter(pk=merchant.pk).update(webhook_secret=merchant.webhook_secret)
+    return merchant.webhook_secret
+
+
+# Callback URLs - merchants choose them, so they must not reach our own network
+def check_callback_url(url):
+    """
+    Raise ValidationError unless url is an http(s) URL whose host resolves only
+    to public addresses - Returns one of those addresses, for the request to be
+    pinned to (see pinned_url), so a second lookup can't be answered with a
+    different one. WEBHOOK_ALLOW_PRIVATE_TARGETS skips the address check (local
+    development against webhook_stub_server) and returns None.
+    """
+    URLValidator(schemes=['http', 'https'])(url)
+    if getattr(settings, 'WEBHOOK_ALLOW_PRIVATE_TARGETS', False):
+        return None
+    parts = urlsplit(url)
+    try:
+        port = parts.port or (443 if parts.scheme == 'https' else 80)
+        addresses = {info[4][0] for info in socket.getaddrinfo(parts.hostname, port, proto=socket.IPPROTO_TCP)}
+    except (OSError, UnicodeError, ValueError):
+        raise ValidationError(f'{parts.hostname} does not resolve')
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%', 1)[0])
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+        # is_global excludes loopback, private, link-local, shared and reserved ranges
+        if not ip.is_global or ip.is_multicast:
+            raise ValidationError(f'{parts.hostname} resolves to non-public address {ip}')
+    return sorted(addresses)[0]
+
+
+def pinned_url(url, address):
+    """
+    url with its host replaced by the already checked address - Returns (url,
+    Host header value). PinnedHostAdapter keeps TLS (SNI and certificate
+    checks) on the original host name.
+    """
+    parts = urlsplit(url)
+    host = f'[{address}]' if ':' in address else address
+    if parts.port:
+        host = f'{host}:{parts.port}'
+    return parts._replace(netloc=host).geturl(), parts.netloc.rsplit('@', 1)[-1]
+
+
+class PinnedHostAdapter(HTTPAdapter):
+    """
+    Connection pools for requests sent to a pinned address (see pinned_url):
+    HTTPS connections present and verify the host name from the Host header,
+    not the address in the URL.
+    """
+
+    def build_connection_pool_key_attributes(self, request, verify, cert=None):
+        host_params, pool_kwargs = super().build_connection_pool_key_attributes(request, verify, cert)
+        host = request.headers.get('Host')
+        if host and host_params['scheme'] == 'https':
+            hostname = urlsplit(f'//{host}').hostname
+            pool_kwargs['server_hostname'] = hostname
+            pool_kwargs['assert_hostname'] = hostname
+        return host_params, pool_kwargs
+
+
+def enqueue_payment_event(payment):
+    """
+    Queue a payment.<status> webhook to payment's callback URL.
+    The row is written in the caller's transaction, so the dispatcher only
+    sees it once the status change commits, and a rollback drops it.
+    """
+    if not payment.callback_url:
+        return None
+    event = f'payment.{payment.status.lower()}'
+    return WebhookDelivery.objects.create(
+        payment_id_id=payment.pk,
+        event=event,
+        url=payment.callback_url,
+        payload={'event': event, **payment_event(payment)}
+    )
+
+
+def _percentile(ordered, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not ordered:
+        return None
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+class WebhookDispatcher:
+    """
+    Delivers queued WebhookDelivery rows to merchant callback URLs.
+
+    Due PENDING deliveries are claimed in batches the same way
+    NotificationDispatcher claims notifications, then POSTed concurrently
+    (WEBHOOK_CONCURRENCY requests at a time) through one pooled HTTP session
+    per process, signed with SIGNATURE_HEADER using the receiving merchant's
+    webhook secret. The callback URL is checked again just before each
+    request, since its host may resolve elsewhere by then, and the request
+    is sent to the address that check approved. Anything but a 2xx
+    response is retried after WEBHOOK_RETRY_BASE_SECONDS * 2^(attempts - 1),
+    capped at WEBHOOK_RETRY_MAX_SECONDS and jittered, until
+    WEBHOOK_MAX_ATTEMPTS attempts have failed and the delivery is marked
+    FAILED. Receivers should dedupe on the DELIVERY_HEADER id: a delivery
+    whose outcome could not be recorded is sent again.
+    """
+    _session = None
+    _pid = None
+    _lock = threading.Lock()
+
+    def __init__(self, batch_size=None, concurrency=None, worker_id=None):
+        self.batch_size = batch_size or getattr(settings, 'WEBHOOK_BATCH_SIZE', 100)
+        self.concurrency = concurrency or getattr(settings, 'WEBHOOK_CONCURRENCY', 10)
+        self.worker_id = worker_id or f'{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+    @classmethod
+    def session(cls):
+        """Process-wide keep-alive HTTP session, recreated in a forked child"""
+        if cls._session is not None and cls._pid == os.getpid():
+            return cls._session
+        with cls._lock:
+            if cls._session is None or cls._pid != os.getpid():
+                pool_size = getattr(settings, 'WEBHOOK_POOL_SIZE', 50)
+                adapter = PinnedHostAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+                session = requests.Session()
+                session.mount('http://', adapter)
+                session.mount('https://', adapter)
+                session.headers['User-Agent'] = 'EthPay-Webhooks/1.0'
+                cls._session = session
+                cls._pid = os.getpid()
+            return cls._session
+
+    def claim(self):
+        """Claim up to batch_size due deliveries, oldest first"""
+        now = timezone.now()
+        claimable = WebhookDelivery.objects.filter(status='PENDING', next_attempt_at__lte=now).filter(
+            Q(claimed_at__isnull=True) |
+            Q(claimed_at__lt=now - timedelta(seconds=getattr(settings, 'WEBHOOK_CLAIM_TIMEOUT', 300)))
+        )
+
+        with transaction.atomic():
+            candidates = claimable.order_by('next_attempt_at')
+            if connection.features.has_select_for_update_skip_locked:
+                candidates = candidates.select_for_update(skip_locked=True)
+            ids = list(candidates.values_list('delivery_id', flat=True)[:self.batch_size])
+            if not ids:
+                return []
+            # Re-checked by the UPDATE itself, so a row another worker claimed in the meantime is skipped
+            claimable.filter(delivery_id__in=ids).update(claimed_by=self.worker_id, claimed_at=now)
+
+        deliveries = list(
+            WebhookDelivery.objects.filter(delivery_id__in=ids, claimed_by=self.worker_id, claimed_at=now)
+            .select_related('payment_id__recipient_id')
+        )
+        # Secrets are created here rather than in the sending threads
+        merchant_secrets = {}
+        for delivery in deliveries:
+            merchant = delivery.payment_id.recipient_id
+            if merchant.pk not in merchant_secrets:
+                merchant_secrets[merchant.pk] = merchant_secret(merchant)
+            merchant.webhook_secret = merchant_secrets[merchant.pk]
+        return deliveries
+
+    def send(self, delivery):
+        """POST one delivery - Returns (response status or None, error or '', latency in ms)"""
+        try:
+            address = check_callback_url(delivery.url)
+        except ValidationError as e:
+            return None, f'Callback URL refused: {e.messages[0]}'[:1000], 0
+
+        url, headers = delivery.url, {}
+        if address is not None:
+            # Connect to the address just checked, not whatever the host resolves to next
+            url, headers['Host'] = pinned_url(delivery.url, address)
+        body = json.dumps(delivery.payload, separators=(',', ':'), default=str).encode('utf-8')
+        headers.update({
+            'Content-Type': 'application/json',
+            EVENT_HEADER: delivery.event,
+            DELIVERY_HEADER: str(delivery.delivery_id),
+            SIGNATURE_HEADER: signature_header(body, delivery.payment_id.recipient_id.webhook_secret),
+        })
+        started = time.perf_counter()
+        try:
+            response = self.session().post(
+                url, data=body, headers=headers,
+                timeout=getattr(settings, 'WEBHOOK_TIMEOUT_SECONDS', 10), allow_redirects=False
+            )
+            response_status = response.status_code
+            error = '' if 200 <= response_status < 300 else f'HTTP {response_status}'
+        except requests.RequestException as e:
+            response_status, error = None, str(e)[:1000]
+        return response_status, error, round((time.perf_counter() - started) * 1000)
+
+    def deliver(self, deliveries):
+        """Send deliveries concurrently - Returns their send() results in order"""
+        if len(deliveries) == 1 or self.concurrency == 1:
+            return [self.send(delivery) for delivery in deliveries]
+        with ThreadPoolExecutor(max_workers=min(self.concurrency, len(deliveries))) as executor:
+            return list(executor.map(self.send, deliveries))
+
+    def retry_delay(self, attempts):
+        """Seconds before retrying a delivery that has failed attempts times"""
+        base = getattr(settings, 'WEBHOOK_RETRY_BASE_SECONDS', 10)
+        delay = min(base * 2 ** (attempts - 1), getattr(settings, 'WEBHOOK_RETRY_MAX_SECONDS', 3600))
+        # Jitter so deliveries that failed together (a merchant outage) don't all retry together
+        return delay * random.uniform(0.5, 1.0)
+
+    def complete(self, deliveries, results):
+        """Record the outcome of a delivered batch - Returns (delivered, retrying, failed)"""
+        now = timezone.now()
+        max_attempts = getattr(settings, 'WEBHOOK_MAX_ATTEMPTS', 8)
+        outcomes = {'DELIVERED': [], 'PENDING': [], 'FAILED': []}
+        for delivery, (response_status, error, latency_ms) in zip(deliveries, results):
+            delivery.response_status = response_status
+            delivery.last_error = error
+            delivery.latency_ms = latency_ms
+            if not error:
+                outcomes['DELIVERED'].append(delivery)
+            elif delivery.attempts + 1 >= max_attempts:
+                outcomes['FAILED'].append(delivery)
+            else:
+                delivery.next_attempt_at = now + timedelta(seconds=self.retry_delay(delivery.attempts + 1))
+                outcomes['PENDING'].append(delivery)
+
+        with transaction.atomic():
+            # Skip rows another worker took over after our claim timed out
+            mine = set(WebhookDelivery.objects.filter(
+                delivery_id__in=[delivery.delivery_id for delivery in deliveries], claimed_by=self.worker_id
+            ).values_list('delivery_id', flat=True))
+            for outcome, batch in outcomes.items():
+                batch = [delivery for delivery in batch if delivery.delivery_id in mine]
+                if not batch:
+                    continue
+                # Values the whole outcome shares in one UPDATE; bulk_update (one CASE per
+                # field and row) only for the values that differ per delivery
+                WebhookDelivery.objects.filter(delivery_id__in=[delivery.delivery_id for delivery in batch]).update(
+                    status=outcome, attempts=F('attempts') + 1, claimed_by='', claimed_at=None,
+                    **({'last_error': '', 'delivered_at': now} if outcome == 'DELIVERED' else {})
+                )
+                per_delivery = ['response_status', 'latency_ms']
+                if outcome != 'DELIVERED':
+                    per_delivery += ['last_error', 'next_attempt_at']
+                WebhookDelivery.objects.bulk_update(batch, per_delivery)
+        return len(outcomes['DELIVERED']), len(outcomes['PENDING']), len(outcomes['FAILED'])
+
+    def run_once(self):
+        """Claim, send and complete one batch - Returns (delivered, retrying, failed), all 0 when nothing was due"""
+        deliveries = self.claim()
+        if not deliveries:
+            return 0, 0, 0
+        return self.complete(deliveries, self.deliver(deliveries))
+
+    def run(self, stop_event=None, idle_seconds=None):
+        """Dispatch until stop_event is set, sleeping idle_seconds whenever nothing is due"""
+        from django.db import close_old_connections
+
+        idle_seconds = idle_seconds if idle_seconds is not None else getattr(settings, 'WEBHOOK_IDLE_SECONDS', 1.0)
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            close_old_connections()
+            try:
+                handled = sum(self.run_once())
+            except Exception as e:
+                print(f"Webhook dispatch failed: {str(e)}")
+                handled = 0
+            if not handled:
+                stop_event.wait(idle_seconds)
+
+    @staticmethod
+    def stats(window=None):
+        """
+        Queue counts, and latency percentiles (ms) over the last window delivered
+        webhooks: 'delivery' from enqueue to delivery (retries included),
+        'request' for the successful HTTP request alone
+        """
+        window = window or getattr(settings, 'WEBHOOK_STATS_WINDOW', 1000)
+        counts = {
+            row['status']: row['count']
+            for row in WebhookDelivery.objects.values('status').annotate(count=Count('pk')).order_by()
+        }
+        oldest_pending = WebhookDelivery.objects.filter(status='PENDING').aggregate(oldest=Min('created_at'))['oldest']
+        recent = list(
+            WebhookDelivery.objects.filter(status='DELIVERED')
+            .order_by('-delivered_at')
+            .values_list('created_at', 'delivered_at', 'latency_ms', 'attempts')[:window]
+        )
+
+        delivery = sorted(round((delivered_at - created_at).total_seconds() * 1000) for created_at, delivered_at, _, _ in recent)
+        request = sorted(latency_ms for _, _, latency_ms, _ in recent if latency_ms is not None)
+        return {
+            'pending': counts.get('PENDING', 0),
+            'delivered': counts.get('DELIVERED', 0),
+            'failed': counts.get('FAILED', 0),
+            'oldest_pending_seconds': round((timezone.now() - oldest_pending).total_seconds(), 1) if oldest_pending else None,
+            'window': len(recent),
+            'retried': sum(1 for _, _, _, attempts in recent if attempts > 1),
+            'delivery_ms': {name: _percentile(delivery, fraction) for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))},
+            'request_ms': {name: _percentile(request, fraction) for name, fraction in (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))},
+        }
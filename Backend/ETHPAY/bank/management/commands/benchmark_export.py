@@ -0,0 +1,123 @@
+import gc
+import os
+import resource
+import time
+import uuid
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import RequestFactory
+from rest_framework.test import force_authenticate
+
+from api.models import User
+from bank.models import BankAccount, BankTransaction
+from bank.views import export_bank_transactions
+
+BENCH_PREFIX = 'BENCHEXP'
+
+
+def rss_mb():
+    """Current resident set size, or the peak where /proc is not available"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except OSError:
+        # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class Command(BaseCommand):
+    help = (
+        'Seed ledger rows into the configured database and stream them through the export endpoint, '
+        'asserting bounded memory. Run it against a scratch database, e.g. --rows 1000000'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, required=True, help='Number of ledger rows to seed')
+        parser.add_argument('--output', choices=['ndjson', 'csv'], default='ndjson')
+        parser.add_argument('--max-rss-growth', type=float, default=64,
+                            help='Fail when RSS grows by more than this many MB while exporting')
+        parser.add_argument('--keep', action='store_true', help='Keep the seeded rows afterwards')
+
+    def handle(self, *args, **options):
+        rows = options['rows']
+        if rows < 1:
+            raise CommandError('--rows must be at least 1')
+        user = User.objects.create(
+            email=f'bench-export-{uuid.uuid4().hex[:8]}@bench.local',
+            full_name='Benchmark merchant',
+            phone_number='+251900000000',
+            role='merchant',
+            status='active'
+        )
+        account = BankAccount.objects.create(
+            user=user,
+            account_number=f'{BENCH_PREFIX}{uuid.uuid4().hex[:8]}',
+            bank_name='Benchmark Bank',
+            account_holder_name='Benchmark merchant',
+            password_hash='!'
+        )
+
+        try:
+            self.stdout.write(f'Seeding {rows} ledger rows...')
+            started = time.perf_counter()
+            batch = 10000
+            for offset in range(0, rows, batch):
+                BankTransaction.objects.bulk_create([
+                    BankTransaction(
+                        bank_account=account,
+                        settlement_id=f'TXN{index:08X}',
+                        payment_reference=f'PAY-{index}',
+                        amount=Decimal('98.00'),
+                        transaction_type='credit',
+                        running_balance=Decimal('98.00') * (index + 1),
+                        description='Payment from customer: 100.00 ETB (-2.00 ETB fee)',
+                        status='completed'
+                    )
+                    for index in range(offset, min(offset + batch, rows))
+                ])
+            self.stdout.write(f'Seeded in {time.perf_counter() - started:.1f}s')
+
+            request = RequestFactory().get(
+                '/api/bank/transactions/export/',
+                {'output': options['output'], 'account': account.account_number}
+            )
+            force_authenticate(request, user=user)
+
+            gc.collect()
+            rss_before = rss_peak = rss_mb()
+            started = time.perf_counter()
+            response = export_bank_transactions(request)
+            if response.status_code != 200:
+                raise CommandError(f'Export failed with status {response.status_code}')
+
+            exported = 0
+            size = 0
+            for chunk in response.streaming_content:
+                size += len(chunk)
+                exported += chunk.count(b'\n')
+                if exported % 10000 == 0:
+                    rss_peak = max(rss_peak, rss_mb())
+            elapsed = time.perf_counter() - started
+            rss_growth = max(rss_peak, rss_mb()) - rss_before
+
+            expected = rows + (1 if options['output'] == 'csv' else 0)
+            if exported != expected:
+                raise CommandError(f'Exported {exported} lines, expected {expected}')
+            if rss_growth > options['max_rss_growth']:
+                raise CommandError(
+                    f'RSS grew by {rss_growth:.1f} MB while exporting (limit {options["max_rss_growth"]} MB)'
+                )
+        finally:
+            if not options['keep']:
+                self._cleanup(user, account)
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Exported {rows} rows ({size / 1024 / 1024:.1f} MB {options["output"]}) in {elapsed:.1f}s '
+            f'({rows / elapsed:.0f} rows/s), RSS grew {rss_growth:.1f} MB'
+        ))
+
+    def _cleanup(self, user, account):
+        # Only what this run seeded; the ledger rows go in one DELETE before the cascade
+        BankTransaction.objects.filter(bank_account=account).delete()
+        user.delete()
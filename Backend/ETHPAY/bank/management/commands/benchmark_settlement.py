@@ -0,0 +1,148 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from api.models import Payment, SystemLog, User
+from api.services import ServiceFeeCalculatorService, SystemLogService
+from bank.models import BankAccount, BankTransaction, MerchantStats
+from bank.services import SETTLEMENT_QUERY_BUDGET, BankPaymentService, SettlementEngine
+
+BENCH_PREFIX = 'BENCH'
+
+
+class Command(BaseCommand):
+    help = 'Fire N parallel settlements against the local database and assert final balances'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=200, help='Number of settlements to run')
+        parser.add_argument('--workers', type=int, default=8, help='Number of concurrent worker threads')
+        parser.add_argument('--amount', type=str, default='150.00', help='Amount of every payment')
+        parser.add_argument('--shards', type=int, default=settings.BANK_HOT_ACCOUNT_SHARDS,
+                            help='Balance shards for the merchant and fee accounts (0 = no striping)')
+        parser.add_argument('--keep', action='store_true', help='Keep the benchmark accounts afterwards')
+
+    def handle(self, *args, **options):
+        payments = options['payments']
+        workers = options['workers']
+        amount = Decimal(options['amount'])
+        fee = ServiceFeeCalculatorService.calculate_fee(amount)
+        # Two extra settlements run up front: one creates the merchant's stats
+        # rows, the next pins the steady-state per-settlement query count
+        settled = payments + 2
+        initial_balance = amount * settled
+
+        customer, merchant, service = self._create_accounts(initial_balance)
+        for account in (merchant, service):
+            SettlementEngine.configure_shards(account, options['shards'])
+
+        warmup = BankPaymentService.settle_payment(f"{BENCH_PREFIX}-warmup", customer, merchant, service, amount)
+        if not warmup['success']:
+            self._cleanup()
+            raise CommandError(f"Settlement failed: {warmup['error']}")
+
+        payment = Payment.objects.create(
+            user_id=customer.user,
+            recipient_id=merchant.user,
+            amount=amount,
+            payment_method='BankTransfer',
+            callback_url='http://127.0.0.1:9/bench-webhook'
+        )
+        with CaptureQueriesContext(connection) as queries:
+            result = BankPaymentService.settle_payment(payment.payment_id, customer, merchant, service, amount)
+        if not result['success']:
+            self._cleanup()
+            raise CommandError(f"Settlement failed: {result['error']}")
+        if len(queries) > SETTLEMENT_QUERY_BUDGET:
+            self._cleanup()
+            raise CommandError(
+                f'Settlement issued {len(queries)} SQL statements, budget is {SETTLEMENT_QUERY_BUDGET}:\n'
+                + '\n'.join(query['sql'] for query in queries.captured_queries)
+            )
+        self.stdout.write(f'Single settlement: {len(queries)} SQL statements (budget {SETTLEMENT_QUERY_BUDGET})')
+
+        def run_settlement(index):
+            try:
+                return BankPaymentService.settle_payment(
+                    f"{BENCH_PREFIX}-{index}", customer, merchant, service, amount
+                )
+            finally:
+                connection.close()
+
+        self.stdout.write(f'Running {payments} settlements on {workers} workers...')
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_settlement, range(payments)))
+        elapsed = time.perf_counter() - started
+
+        failures = [result['error'] for result in results if not result['success']]
+        try:
+            expected = {
+                customer.account_number: Decimal('0.00'),
+                merchant.account_number: (amount - fee) * settled,
+                service.account_number: fee * settled,
+            }
+            for account in BankAccount.objects.filter(account_number__in=expected):
+                if account.total_balance != expected[account.account_number]:
+                    raise CommandError(
+                        f'Balance mismatch on {account.account_number}: '
+                        f'expected {expected[account.account_number]}, got {account.total_balance}'
+                    )
+                SettlementEngine.fold_shards(account)
+                account.refresh_from_db()
+                if account.current_balance != expected[account.account_number]:
+                    raise CommandError(f'Folding shards changed the balance of {account.account_number}')
+            if failures:
+                raise CommandError(f'{len(failures)} settlements failed, first error: {failures[0]}')
+            stats = MerchantStats.objects.get(account=merchant)
+            if (stats.transaction_count, stats.total_received, stats.total_fees) != (settled, amount * settled, fee * settled):
+                raise CommandError(
+                    f'Merchant stats mismatch: {stats.transaction_count} payments, '
+                    f'{stats.total_received} received, {stats.total_fees} fees'
+                )
+        finally:
+            if not options['keep']:
+                self._cleanup()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{payments} settlements in {elapsed:.2f}s with {options["shards"]} shards '
+            f'({payments / elapsed:.1f} settlements/s), final balances and merchant stats verified'
+        ))
+
+    def _create_accounts(self, initial_balance):
+        self._cleanup()
+        run_id = uuid.uuid4().hex[:8]
+        accounts = []
+        for role, suffix, balance in [
+            ('endUser', 'C', initial_balance),
+            ('merchant', 'M', Decimal('0.00')),
+            ('admin', 'F', Decimal('0.00')),
+        ]:
+            user = User.objects.create(
+                email=f'bench-{suffix.lower()}-{run_id}@bench.local',
+                full_name=f'Benchmark {role}',
+                phone_number='+251900000000',
+                role=role,
+                status='active'
+            )
+            accounts.append(BankAccount.objects.create(
+                user=user,
+                account_number=f'{BENCH_PREFIX}{suffix}{run_id}',
+                bank_name='Benchmark Bank',
+                account_holder_name=f'Benchmark {role}',
+                password_hash='!',
+                current_balance=balance
+            ))
+        return accounts
+
+    def _cleanup(self):
+        # Write queued audit logs first so the benchmark's entries are removed too
+        SystemLogService.flush()
+        BankTransaction.objects.filter(bank_account__account_number__startswith=BENCH_PREFIX).delete()
+        SystemLog.objects.filter(user_id__email__endswith='@bench.local').delete()
+        User.objects.filter(email__endswith='@bench.local').delete()
@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from bank.models import BankAccount
+from bank.services import SettlementEngine
+
+
+class Command(BaseCommand):
+    help = 'Fold striped shard balances back into their bank accounts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--account', help='Only fold this account number')
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep running and fold every N seconds (0 = fold once and exit)')
+
+    def handle(self, *args, **options):
+        while True:
+            accounts = BankAccount.objects.filter(shard_count__gt=0)
+            if options['account']:
+                accounts = accounts.filter(account_number=options['account'])
+
+            for account in accounts:
+                folded = SettlementEngine.fold_shards(account)
+                if folded:
+                    self.stdout.write(f'Folded {folded:.2f} ETB into {account.account_number}')
+
+            if not options['interval']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS('Shard balances folded'))
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:14
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank', '0003_bankaccount_shards'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MerchantStats',
+            fields=[
+                ('account', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='bank.bankaccount')),
+                ('total_received', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('total_fees', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('transaction_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MerchantDailyStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField()),
+                ('total_received', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('total_fees', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('transaction_count', models.PositiveIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_stats', to='bank.bankaccount')),
+            ],
+            options={
+                'ordering': ['-day'],
+                'constraints': [models.UniqueConstraint(fields=('account', 'day'), name='unique_merchant_daily_stats')],
+            },
+        ),
+    ]
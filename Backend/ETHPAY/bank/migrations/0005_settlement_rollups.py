@@ -0,0 +1,37 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:16
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank', '0004_merchant_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SettlementRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('granularity', models.CharField(choices=[('hour', 'Hour'), ('day', 'Day'), ('month', 'Month')], max_length=5)),
+                ('bucket_start', models.DateTimeField()),
+                ('total_received', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('total_fees', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('transaction_count', models.PositiveIntegerField(default=0)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='bank.bankaccount')),
+            ],
+            options={
+                'ordering': ['bucket_start'],
+            },
+        ),
+        migrations.DeleteModel(
+            name='MerchantDailyStats',
+        ),
+        migrations.AddConstraint(
+            model_name='settlementrollup',
+            constraint=models.UniqueConstraint(fields=('account', 'granularity', 'bucket_start'), name='unique_settlement_rollup'),
+        ),
+    ]
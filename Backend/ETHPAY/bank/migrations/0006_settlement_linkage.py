@@ -0,0 +1,36 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_feeschedule_feetier'),
+        ('bank', '0005_settlement_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='banktransaction',
+            name='payment_reference',
+            field=models.CharField(blank=True, default='', max_length=100),
+        ),
+        migrations.AddField(
+            model_name='banktransaction',
+            name='settlement_id',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='banktransaction',
+            index=models.Index(fields=['settlement_id', 'transaction_type'], name='bank_txn_settlement_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='banktransaction',
+            index=models.Index(fields=['payment_reference', 'settlement_id'], name='bank_txn_payment_ref_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='banktransaction',
+            index=models.Index(fields=['bank_account', '-created_at'], name='bank_txn_account_recent_idx'),
+        ),
+    ]
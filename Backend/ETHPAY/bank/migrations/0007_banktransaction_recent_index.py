@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_notification_created_at_recent_indexes'),
+        ('bank', '0006_settlement_linkage'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='banktransaction',
+            index=models.Index(fields=['-created_at', '-transaction_id'], name='bank_txn_recent_idx'),
+        ),
+    ]
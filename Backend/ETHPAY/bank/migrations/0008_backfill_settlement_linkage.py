@@ -0,0 +1,68 @@
+import re
+import uuid
+from datetime import timedelta
+
+from django.db import migrations
+
+SERVICE_FEE = re.compile(r'^Service fee collected for payment (?P<reference>\S+)$')
+PURCHASE = re.compile(r'^E-commerce purchase: (?P<amount>[\d.]+) ETB')
+RECEIVED = re.compile(r'^Payment from customer: (?P<amount>[\d.]+) ETB')
+
+# Legs of one settlement were written back to back
+SETTLEMENT_WINDOW = timedelta(seconds=60)
+
+
+def backfill_settlement_linkage(apps, schema_editor):
+    """
+    Link legs written before settlements were stamped. Each such settlement
+    names its payment only in the service fee leg's description; the customer
+    debit and merchant credit are the unlinked legs for the same amount written
+    just before it. Legs that already carry a Payment get its ID as reference.
+    """
+    BankTransaction = apps.get_model('bank', 'BankTransaction')
+    unlinked = BankTransaction.objects.filter(settlement_id='', payment_reference='')
+
+    for leg in unlinked.filter(payment__isnull=False).only('transaction_id', 'payment_id').iterator():
+        BankTransaction.objects.filter(pk=leg.pk).update(payment_reference=str(leg.payment_id)[:100])
+
+    purchases, receipts = [], []
+    for leg in unlinked.filter(description__regex=r'^(E-commerce purchase|Payment from customer): ').order_by('created_at'):
+        match = PURCHASE.match(leg.description) or RECEIVED.match(leg.description)
+        (purchases if leg.transaction_type == 'debit' else receipts).append((leg, match.group('amount')))
+
+    def take(candidates, amount, fee_leg):
+        # The closest earlier leg for the same amount within the settlement window
+        for index in range(len(candidates) - 1, -1, -1):
+            leg, leg_amount = candidates[index]
+            if leg.created_at > fee_leg.created_at:
+                continue
+            if fee_leg.created_at - leg.created_at > SETTLEMENT_WINDOW:
+                return None
+            if amount is None or leg_amount == amount:
+                return candidates.pop(index)[0]
+        return None
+
+    for fee_leg in unlinked.filter(description__startswith='Service fee collected for payment ').order_by('created_at'):
+        match = SERVICE_FEE.match(fee_leg.description)
+        if not match:
+            continue
+        reference = match.group('reference')[:100]
+        customer_leg = take(purchases, None, fee_leg)
+        amount = PURCHASE.match(customer_leg.description).group('amount') if customer_leg else None
+        merchant_leg = take(receipts, amount, fee_leg) if customer_leg else None
+
+        # The original TXN ID was never stored, so the settlement gets a new one
+        settlement_id = f"TXN{str(uuid.uuid4())[:8].upper()}"
+        legs = [leg.pk for leg in (customer_leg, merchant_leg, fee_leg) if leg is not None]
+        BankTransaction.objects.filter(pk__in=legs).update(settlement_id=settlement_id, payment_reference=reference)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank', '0007_banktransaction_recent_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_settlement_linkage, migrations.RunPython.noop),
+    ]
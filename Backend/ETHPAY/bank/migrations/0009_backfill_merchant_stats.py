@@ -0,0 +1,71 @@
+import re
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import migrations
+from django.utils import timezone
+
+RECEIVED = re.compile(r'^Payment from customer: (?P<amount>[\d.]+) ETB')
+ZERO = Decimal('0.00')
+
+
+def backfill_merchant_stats(apps, schema_editor):
+    """
+    Derive each merchant's MerchantStats and hourly SettlementRollups from the
+    ledger, so accounts that settled before the aggregates existed do not start
+    at zero. Every settlement credits the merchant with a 'Payment from
+    customer' leg; its fee is the service fee leg of the same settlement, or for
+    legs 0008 could not link, the gross amount in the description less the
+    credit. The totals replace the stored ones (the legs include every
+    settlement counted since), and stored day and month buckets are dropped so
+    they are derived again from the corrected hours.
+    """
+    BankTransaction = apps.get_model('bank', 'BankTransaction')
+    MerchantStats = apps.get_model('bank', 'MerchantStats')
+    SettlementRollup = apps.get_model('bank', 'SettlementRollup')
+    settled = BankTransaction.objects.exclude(status__in=['failed', 'reversed'])
+
+    fees = dict(
+        settled.filter(transaction_type='credit', description__startswith='Service fee collected for payment ')
+        .exclude(settlement_id='')
+        .values_list('settlement_id', 'amount')
+    )
+
+    stats = defaultdict(lambda: [ZERO, ZERO, 0])
+    hours = defaultdict(lambda: [ZERO, ZERO, 0])
+    credits = settled.filter(transaction_type='credit', description__startswith='Payment from customer: ').only(
+        'bank_account_id', 'settlement_id', 'amount', 'description', 'created_at'
+    )
+    for leg in credits.iterator():
+        fee = fees.get(leg.settlement_id) if leg.settlement_id else None
+        if fee is None:
+            match = RECEIVED.match(leg.description)
+            fee = Decimal(match.group('amount')) - leg.amount if match else ZERO
+        hour = timezone.localtime(leg.created_at).replace(minute=0, second=0, microsecond=0)
+        for totals in (stats[leg.bank_account_id], hours[(leg.bank_account_id, hour)]):
+            totals[0] += leg.amount + fee
+            totals[1] += fee
+            totals[2] += 1
+
+    for account_id, (received, fee, count) in stats.items():
+        MerchantStats.objects.update_or_create(
+            account_id=account_id,
+            defaults={'total_received': received, 'total_fees': fee, 'transaction_count': count}
+        )
+    for (account_id, hour), (received, fee, count) in hours.items():
+        SettlementRollup.objects.update_or_create(
+            account_id=account_id, granularity='hour', bucket_start=hour,
+            defaults={'total_received': received, 'total_fees': fee, 'transaction_count': count}
+        )
+    SettlementRollup.objects.filter(account_id__in=list(stats), granularity__in=['day', 'month']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('bank', '0008_backfill_settlement_linkage'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_merchant_stats, migrations.RunPython.noop),
+    ]
@@ -35,18 +35,89 @@ class BankAccount(models.Model):
     account_holder_name = models.CharField(max_length=200)
     password_hash = models.CharField(max_length=255)  # Hashed password
     current_balance = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    shard_count = models.PositiveSmallIntegerField(default=0)  # 0 = credits go straight to current_balance
     is_active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
+    @property
+    def total_balance(self):
+        """Folded balance plus credits still parked on striped shards"""
+        if not self.shard_count:
+            return self.current_balance
+        return self.current_balance + sum((shard.balance for shard in self.shards.all()), Decimal('0.00'))
+    
     def __str__(self):
         return f"{self.account_number} - {self.bank_name}"
 
+class BankAccountShard(models.Model):
+    """Striped balance slot for hot accounts, folded back into current_balance periodically"""
+    account = models.ForeignKey(BankAccount, on_delete=models.CASCADE, related_name='shards')
+    shard_index = models.PositiveSmallIntegerField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['account', 'shard_index'], name='unique_account_shard')
+        ]
+    
+    def __str__(self):
+        return f"{self.account.account_number} shard {self.shard_index}"
+
+class MerchantStats(models.Model):
+    """Lifetime settlement totals for a merchant account, updated by every settlement"""
+    account = models.OneToOneField(BankAccount, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    total_received = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))  # Gross order totals
+    total_fees = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    transaction_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    @property
+    def net_income(self):
+        return self.total_received - self.total_fees
+    
+    def __str__(self):
+        return f"{self.account.account_number} stats"
+
+class SettlementRollup(models.Model):
+    """Settlement totals for an account over one hour, day or month"""
+    GRANULARITY_CHOICES = [
+        ('hour', 'Hour'),
+        ('day', 'Day'),
+        ('month', 'Month')
+    ]
+    
+    account = models.ForeignKey(BankAccount, on_delete=models.CASCADE, related_name='rollups')
+    granularity = models.CharField(max_length=5, choices=GRANULARITY_CHOICES)
+    bucket_start = models.DateTimeField()
+    total_received = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))  # Gross
+    total_fees = models.DecimalField(max_digits=14, decimal_places=2, default=Decimal('0.00'))
+    transaction_count = models.PositiveIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['bucket_start']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['account', 'granularity', 'bucket_start'],
+                name='unique_settlement_rollup'
+            )
+        ]
+    
+    @property
+    def net_income(self):
+        return self.total_received - self.total_fees
+    
+    def __str__(self):
+        return f"{self.account.account_number} {self.granularity} {self.bucket_start:%Y-%m-%d %H:00}"
+
 class BankTransaction(models.Model):
     """Bank transaction records"""
     transaction_id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     bank_account = models.ForeignKey(BankAccount, on_delete=models.CASCADE)
     payment = models.ForeignKey('api.Payment', on_delete=models.CASCADE, null=True, blank=True)
+    settlement_id = models.CharField(max_length=20, blank=True, default='')  # TXN code shared by every leg of a settlement
+    payment_reference = models.CharField(max_length=100, blank=True, default='')  # Payment ID as sent by the store
     amount = models.DecimalField(max_digits=12, decimal_places=2)
     transaction_type = models.CharField(max_length=10, choices=[
         ('debit', 'Debit'),
@@ -62,5 +133,13 @@ class BankTransaction(models.Model):
     ])
     created_at = models.DateTimeField(auto_now_add=True)
     
+    class Meta:
+        indexes = [
+            models.Index(fields=['settlement_id', 'transaction_type'], name='bank_txn_settlement_idx'),
+            models.Index(fields=['payment_reference', 'settlement_id'], name='bank_txn_payment_ref_idx'),
+            models.Index(fields=['bank_account', '-created_at'], name='bank_txn_account_recent_idx'),
+            models.Index(fields=['-created_at', '-transaction_id'], name='bank_txn_recent_idx'),
+        ]
+    
     def __str__(self):
         return f"{self.transaction_id} - {self.transaction_type} {self.amount}"
\ No newline at end of file
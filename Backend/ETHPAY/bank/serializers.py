@@ -3,7 +3,7 @@ from .models import BankAccount, BankTransaction
 
 class BankAccountSerializer(serializers.ModelSerializer):
     account_id = serializers.UUIDField(read_only=True)
-    current_balance = serializers.DecimalField(max_digits=12, decimal_places=2, read_only=True)
+    current_balance = serializers.DecimalField(source='total_balance', max_digits=12, decimal_places=2, read_only=True)
     created_at = serializers.DateTimeField(read_only=True)
     
     class Meta:
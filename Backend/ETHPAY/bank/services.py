@@ -1,9 +1,20 @@
+from datetime import timedelta
 from decimal import Decimal
-from django.contrib.auth.hashers import check_password, make_password
-from .models import BankAccount, BankTransaction
-from api.models import Payment, Transaction, User, Receipt
+from django.conf import settings
+from django.contrib.auth.hashers import identify_hasher, is_password_usable
+from django.core import signing
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDay
+from .models import BankAccount, BankAccountShard, BankTransaction, MerchantStats, SettlementRollup
+from api.models import IdempotencyKey, Payment, Transaction, User, Receipt
+from api.events import publish_payment_status
+from api.hashing import HashingPoolSaturated, PasswordHashingPolicy
 from api.services import ServiceFeeCalculatorService, SystemLogService
+from api.webhooks import enqueue_payment_event
 from django.utils import timezone
+import random
+import secrets
 import uuid
 
 # Centralised demo account configuration
@@ -15,6 +26,481 @@ CUSTOMER_NAME = "Tsion Alemu"
 CUSTOMER_PASSWORD = "00ldfb@B"
 CUSTOMER_BALANCE = Decimal("10000000.00")
 
+# SQL statements (including BEGIN/COMMIT) one settle_payment() call may issue for
+# an existing Payment with a callback URL (its webhook is queued in the same
+# transaction) and striped merchant and fee accounts whose merchant stats rows
+# for the hour already exist; pinned by `python manage.py benchmark_settlement`.
+# Paying with a verification token adds the INSERT that consumes it
+SETTLEMENT_QUERY_BUDGET = 15
+
+# Daily buckets returned with the merchant dashboard
+MERCHANT_DASHBOARD_DAYS = 30
+
+# PASSWORD_HASHING_POLICY entry used for bank account passwords
+BANK_ACCOUNT_HASHING_ROLE = 'bank_account'
+
+class SettlementError(Exception):
+    """Raised inside a settlement to roll back every leg (e.g. insufficient funds)"""
+
+
+class SettlementEngine:
+    """
+    Applies the debit/credit legs of a settlement in one database transaction.
+    
+    Account rows are locked with select_for_update in account_number order, so two
+    settlements touching the same accounts always queue in the same sequence and
+    cannot deadlock. Balances are written with F() expressions, so every UPDATE
+    applies its delta to the committed balance instead of a stale in-memory copy.
+    
+    Credits to striped accounts (shard_count > 0) never lock the account row: they
+    land on one randomly chosen BankAccountShard, so concurrent settlements into
+    the same hot merchant or fee account only collide when they pick the same shard.
+    Shard updates are applied after the account locks, in (account_number,
+    shard_index) order.
+    """
+    
+    @staticmethod
+    def settle(legs, settlement_id='', payment=None, payment_reference=''):
+        """
+        Apply settlement legs atomically.
+        Each leg is a dict with 'account', 'amount', 'transaction_type'
+        ('debit' or 'credit') and 'description'. Every leg is stamped with
+        settlement_id, payment and payment_reference so all legs of a
+        settlement can be fetched in one indexed query. Returns the
+        BankTransaction rows in the same order as the legs.
+        
+        Statements are batched per model: one locking SELECT, one bulk UPDATE
+        for the locked accounts, one UPDATE per striped credit, one balance
+        snapshot for striped accounts and one bulk INSERT for the ledger legs.
+        Does not open a savepoint when called inside an outer transaction.
+        """
+        locked_legs, striped_legs = [], []
+        for leg in legs:
+            if leg['transaction_type'] == 'credit' and leg['account'].shard_count:
+                striped_legs.append(leg)
+            else:
+                locked_legs.append(leg)
+        
+        with transaction.atomic(savepoint=False):
+            account_numbers = sorted({leg['account'].account_number for leg in locked_legs})
+            locked_accounts = {
+                account.account_number: account
+                for account in BankAccount.objects.select_for_update().filter(
+                    account_number__in=account_numbers,
+                    is_active=True
+                ).order_by('account_number')
+            }
+            
+            running_balances = {}
+            deltas = {}
+            for leg in locked_legs:
+                account = locked_accounts.get(leg['account'].account_number)
+                if account is None:
+                    raise SettlementError(f"Account {leg['account'].account_number} is not available")
+                
+                amount = leg['amount']
+                if leg['transaction_type'] == 'debit':
+                    # Debits only draw on the folded balance, never on unfolded shard credits
+                    if account.current_balance < amount:
+                        raise SettlementError(
+                            f'Insufficient funds. Need {amount:.2f} ETB, have {account.current_balance:.2f} ETB'
+                        )
+                    delta = -amount
+                else:
+                    delta = amount
+                
+                # The row is locked until commit, so the in-memory running balance is exact
+                account.current_balance += delta
+                running_balances[id(leg)] = account.current_balance
+                deltas[account.account_number] = deltas.get(account.account_number, Decimal('0.00')) + delta
+            
+            if deltas:
+                now = timezone.now()
+                updated_accounts = []
+                for account_number, delta in deltas.items():
+                    account = locked_accounts[account_number]
+                    updated_accounts.append(BankAccount(
+                        account_id=account.account_id,
+                        current_balance=F('current_balance') + delta,
+                        updated_at=now
+                    ))
+                BankAccount.objects.bulk_update(updated_accounts, ['current_balance', 'updated_at'])
+            
+            shard_credits = sorted(
+                (
+                    (leg['account'].account_number, random.randrange(leg['account'].shard_count), leg)
+                    for leg in striped_legs
+                ),
+                key=lambda credit: credit[:2]
+            )
+            # One UPDATE per shard, in lock order, so concurrent settlements cannot deadlock
+            for account_number, shard_index, leg in shard_credits:
+                updated = BankAccountShard.objects.filter(
+                    account_id=leg['account'].pk,
+                    shard_index=shard_index
+                ).update(balance=F('balance') + leg['amount'], updated_at=timezone.now())
+                if not updated:
+                    raise SettlementError(f"Account {account_number} has no shard {shard_index}")
+            
+            if striped_legs:
+                # Striped rows are not locked, so this is a point-in-time snapshot of the total
+                striped_totals = {
+                    account_number: balance + (striped or Decimal('0.00'))
+                    for account_number, balance, striped in BankAccount.objects.filter(
+                        pk__in={leg['account'].pk for leg in striped_legs}
+                    ).annotate(
+                        striped=Sum('shards__balance')
+                    ).values_list('account_number', 'current_balance', 'striped')
+                }
+                for leg in striped_legs:
+                    running_balances[id(leg)] = striped_totals[leg['account'].account_number]
+            
+            return BankTransaction.objects.bulk_create([
+                BankTransaction(
+                    bank_account=locked_accounts.get(leg['account'].account_number, leg['account']),
+                    payment=payment,
+                    settlement_id=settlement_id,
+                    payment_reference=payment_reference,
+                    amount=leg['amount'],
+                    transaction_type=leg['transaction_type'],
+                    running_balance=running_balances[id(leg)],
+                    description=leg['description'],
+                    status='completed'
+                )
+                for leg in legs
+            ])
+    
+    @staticmethod
+    def configure_shards(account, shard_count):
+        """Stripe an account over shard_count shards (0 disables striping)"""
+        with transaction.atomic():
+            SettlementEngine.fold_shards(account)
+            BankAccount.objects.filter(pk=account.pk).update(shard_count=shard_count)
+            BankAccountShard.objects.filter(account=account, shard_index__gte=shard_count).delete()
+            BankAccountShard.objects.bulk_create(
+                [BankAccountShard(account=account, shard_index=index) for index in range(shard_count)],
+                ignore_conflicts=True
+            )
+            account.shard_count = shard_count
+        return account
+    
+    @staticmethod
+    def fold_shards(account):
+        """
+        Move every shard balance back into the account's current_balance.
+        Locks the account row first, then its shards in shard_index order - the
+        same order settlements use - and returns the amount folded.
+        """
+        with transaction.atomic():
+            BankAccount.objects.select_for_update().filter(pk=account.pk).first()
+            shards = list(
+                BankAccountShard.objects.select_for_update().filter(account_id=account.pk).order_by('shard_index')
+            )
+            folded = sum((shard.balance for shard in shards), Decimal('0.00'))
+            if folded:
+                BankAccountShard.objects.filter(pk__in=[shard.pk for shard in shards]).update(
+                    balance=Decimal('0.00'),
+                    updated_at=timezone.now()
+                )
+                BankAccount.objects.filter(pk=account.pk).update(
+                    current_balance=F('current_balance') + folded,
+                    updated_at=timezone.now()
+                )
+        return folded
+
+
+class MerchantStatsService:
+    """
+    Maintains the MerchantStats totals and the hourly SettlementRollup buckets.
+    
+    record_settlement runs inside the settlement transaction, so the totals
+    commit or roll back together with the ledger legs. Each aggregate is one
+    F() UPDATE; the row is only inserted the first time an account (or hour)
+    is seen.
+    """
+    
+    @staticmethod
+    def _increment(model, lookup, amount, fee):
+        changes = {
+            'total_received': F('total_received') + amount,
+            'total_fees': F('total_fees') + fee,
+            'transaction_count': F('transaction_count') + 1,
+        }
+        if model is MerchantStats:
+            changes['updated_at'] = timezone.now()
+        if model.objects.filter(**lookup).update(**changes):
+            return
+        try:
+            with transaction.atomic():
+                model.objects.create(total_received=amount, total_fees=fee, transaction_count=1, **lookup)
+        except IntegrityError:
+            # Another settlement created the row first
+            model.objects.filter(**lookup).update(**changes)
+    
+    @staticmethod
+    def record_settlement(account, amount, fee):
+        """Add one settled payment (gross amount and fee) to the account's totals"""
+        MerchantStatsService._increment(MerchantStats, {'account_id': account.pk}, amount, fee)
+        MerchantStatsService._increment(
+            SettlementRollup,
+            {
+                'account_id': account.pk,
+                'granularity': 'hour',
+                'bucket_start': SettlementRollupService.bucket_start(timezone.now(), 'hour')
+            },
+            amount,
+            fee
+        )
+    
+    @staticmethod
+    def get_stats(account, days=MERCHANT_DASHBOARD_DAYS):
+        """Return (MerchantStats, daily SettlementRollups for the last days days) for an account"""
+        stats = MerchantStats.objects.filter(account_id=account.pk).first() or MerchantStats(account=account)
+        now = timezone.now()
+        daily = SettlementRollupService.series(account, 'day', now - timedelta(days=days - 1), now)
+        return stats, daily
+
+
+class SettlementRollupService:
+    """
+    Reads settlement volume per hour, day or month.
+    
+    Only hourly buckets are written by settlements. Day buckets are derived
+    the first time they are read, summed from the hours by the database (one
+    row per day comes back), and month buckets are summed from the days, so
+    a year of months is built from at most 366 day rows. Derived buckets are
+    stored once the period has closed (and CLOSE_GRACE has passed), so later
+    reads use 12 month rows. Buckets that are still open are derived again on
+    every read.
+    """
+    
+    # Most buckets one series() call may return
+    MAX_BUCKETS = {'hour': 24 * 31, 'day': 366, 'month': 120}
+    # A bucket is only stored once it has been closed this long, so settlements
+    # that were in flight at the boundary are included
+    CLOSE_GRACE = timedelta(minutes=5)
+    
+    @staticmethod
+    def bucket_start(when, granularity):
+        """Start of the hour, day or month bucket containing when"""
+        when = timezone.localtime(when)
+        if granularity == 'hour':
+            return when.replace(minute=0, second=0, microsecond=0)
+        start = when.replace(hour=0, minute=0, second=0, microsecond=0)
+        if granularity == 'month':
+            start = start.replace(day=1)
+        return start
+    
+    @staticmethod
+    def next_bucket(start, granularity):
+        """Start of the bucket after the one starting at start"""
+        if granularity == 'hour':
+            return start + timedelta(hours=1)
+        if granularity == 'day':
+            return SettlementRollupService.bucket_start(start + timedelta(days=1, hours=1), 'day')
+        if start.month == 12:
+            return start.replace(year=start.year + 1, month=1)
+        return start.replace(month=start.month + 1)
+    
+    @staticmethod
+    def _buckets(first, last, granularity, limit=None):
+        buckets = []
+        bucket = first
+        while bucket <= last:
+            if limit is not None and len(buckets) == limit:
+                raise ValueError(f"At most {limit} {granularity} buckets per request")
+            buckets.append(bucket)
+            bucket = SettlementRollupService.next_bucket(bucket, granularity)
+        return buckets
+    
+    @staticmethod
+    def _sum_hours(account, start, end):
+        """(total_received, total_fees, transaction_count) per day of the hourly buckets in [start, end)"""
+        days = SettlementRollup.objects.filter(
+            account_id=account.pk,
+            granularity='hour',
+            bucket_start__gte=start,
+            bucket_start__lt=end
+        ).annotate(day=TruncDay('bucket_start')).values('day').annotate(
+            received=Sum('total_received'),
+            fees=Sum('total_fees'),
+            count=Sum('transaction_count')
+        ).order_by()
+        return {row['day']: (row['received'], row['fees'], row['count']) for row in days}
+    
+    @staticmethod
+    def _load(account, granularity, first, last):
+        """Stored or derived rollups keyed by bucket_start for buckets first..last"""
+        rows = {
+            row.bucket_start: row
+            for row in SettlementRollup.objects.filter(
+                account_id=account.pk,
+                granularity=granularity,
+                bucket_start__gte=first,
+                bucket_start__lte=last
+            )
+        }
+        if granularity == 'hour':
+            return rows
+        
+        missing = [
+            bucket for bucket in SettlementRollupService._buckets(first, last, granularity)
+            if bucket not in rows
+        ]
+        if not missing:
+            return rows
+        
+        end = SettlementRollupService.next_bucket(missing[-1], granularity)
+        if granularity == 'day':
+            parts = SettlementRollupService._sum_hours(account, missing[0], end)
+        else:
+            parts = {}
+            for row in SettlementRollupService._load(account, 'day', missing[0], end - timedelta(microseconds=1)).values():
+                totals = parts.setdefault(
+                    SettlementRollupService.bucket_start(row.bucket_start, 'month'), [Decimal('0.00'), Decimal('0.00'), 0]
+                )
+                totals[0] += row.total_received
+                totals[1] += row.total_fees
+                totals[2] += row.transaction_count
+        
+        closed_before = SettlementRollupService.bucket_start(
+            timezone.now() - SettlementRollupService.CLOSE_GRACE, granularity
+        )
+        closed = []
+        for bucket in missing:
+            total_received, total_fees, transaction_count = parts.get(bucket, (Decimal('0.00'), Decimal('0.00'), 0))
+            row = SettlementRollup(
+                account=account,
+                granularity=granularity,
+                bucket_start=bucket,
+                total_received=total_received,
+                total_fees=total_fees,
+                transaction_count=transaction_count
+            )
+            rows[bucket] = row
+            if bucket < closed_before:
+                closed.append(row)
+        SettlementRollup.objects.bulk_create(closed, ignore_conflicts=True)
+        return rows
+    
+    @staticmethod
+    def series(account, granularity, start, end):
+        """
+        Return one SettlementRollup per bucket between start and end, oldest
+        first; buckets without settlements are unsaved zero rows. Raises
+        ValueError for an unknown granularity or too many buckets.
+        """
+        if granularity not in SettlementRollupService.MAX_BUCKETS:
+            raise ValueError(f"Unknown granularity: {granularity}")
+        
+        first = SettlementRollupService.bucket_start(max(start, account.created_at), granularity)
+        last = SettlementRollupService.bucket_start(end, granularity)
+        buckets = SettlementRollupService._buckets(
+            first, last, granularity, SettlementRollupService.MAX_BUCKETS[granularity]
+        )
+        if not buckets:
+            return []
+        
+        rows = SettlementRollupService._load(account, granularity, first, last)
+        return [
+            rows.get(bucket) or SettlementRollup(account=account, granularity=granularity, bucket_start=bucket)
+            for bucket in buckets
+        ]
+
+
+class BankVerificationService:
+    """
+    Short-lived tokens proving that a bank account's password was just checked.
+    
+    /api/bank/verify/ issues one bound to the account, the payment and the
+    amount to pay, and /api/bank/process/ accepts it instead of the password,
+    so a checkout hashes the password once. Tokens are signed, expire after
+    BANK_VERIFICATION_TOKEN_TTL seconds and are single use: the settlement
+    records the token's nonce as an IdempotencyKey in its own transaction, so
+    a second redemption is rejected by the unique constraint in any worker and
+    a settlement that fails leaves the token usable.
+    """
+    salt = 'bank.verification'
+    scope = 'bank-verification'
+    
+    @staticmethod
+    def _normalize_amount(amount):
+        return str(Decimal(str(amount)).quantize(Decimal('0.01')))
+    
+    @classmethod
+    def issue(cls, account, amount, payment_id):
+        """Signed verification token for paying amount from account for payment_id"""
+        return signing.dumps(
+            {
+                'account': account.account_number,
+                'payment': str(payment_id),
+                'amount': cls._normalize_amount(amount),
+                'nonce': secrets.token_urlsafe(16),
+            },
+            salt=cls.salt
+        )
+    
+    @classmethod
+    def redeem(cls, token, account_number, amount, payment_id):
+        """
+        Check token for paying amount from account_number for payment_id - Same
+        result shape as verify_account, plus the 'nonce' to consume() when settling
+        """
+        ttl = getattr(settings, 'BANK_VERIFICATION_TOKEN_TTL', 300)
+        try:
+            data = signing.loads(token, salt=cls.salt, max_age=ttl)
+        except signing.SignatureExpired:
+            return {'verified': False, 'error': 'Verification expired, please verify the account again'}
+        except signing.BadSignature:
+            return {'verified': False, 'error': 'Invalid verification token'}
+        
+        try:
+            amount = cls._normalize_amount(amount)
+        except ArithmeticError:
+            return {'verified': False, 'error': 'Invalid amount format'}
+        if (data.get('account') != account_number or data.get('payment') != str(payment_id)
+                or data.get('amount') != amount):
+            return {'verified': False, 'error': 'Verification token does not match this payment'}
+        
+        account = BankAccount.objects.filter(account_number=account_number, is_active=True).first()
+        if not account:
+            return {'verified': False, 'error': 'Account not found'}
+        return {
+            'verified': True,
+            'account': account,
+            'balance': float(account.total_balance),
+            'nonce': data['nonce']
+        }
+    
+    @classmethod
+    def consume(cls, nonce):
+        """
+        Mark a redeemed token as used - Call inside the settlement's transaction;
+        raises SettlementError when the token was already used
+        """
+        ttl = getattr(settings, 'BANK_VERIFICATION_TOKEN_TTL', 300)
+        try:
+            IdempotencyKey.objects.create(
+                scope=cls.scope,
+                key=nonce,
+                status='COMPLETED',
+                expires_at=timezone.now() + timedelta(seconds=ttl)
+            )
+        except IntegrityError:
+            raise SettlementError('Verification token already used')
+
+
+def _is_plaintext(stored_password):
+    """True for a seeded plain password: usable, but not in any configured hasher's format"""
+    if not is_password_usable(stored_password):
+        return False
+    try:
+        identify_hasher(stored_password)
+    except ValueError:
+        return True
+    return False
+
+
 class BankPaymentService:
     """Service for processing bank payments with fee distribution"""
     
@@ -27,12 +513,28 @@ class BankPaymentService:
                 is_active=True
             )
             
-            # Verify password
-            if check_password(password, account.password_hash) or password == account.password_hash:
+            def rehash(raw_password):
+                # update() so a rehash never writes back a stale balance
+                BankAccount.objects.filter(pk=account.pk).update(
+                    password_hash=PasswordHashingPolicy.make_password(raw_password, BANK_ACCOUNT_HASHING_ROLE)
+                )
+            
+            # Verify password; hashes that don't follow the current policy are replaced
+            verified = PasswordHashingPolicy.check_password(
+                password, account.password_hash, rehash, BANK_ACCOUNT_HASHING_ROLE
+            )
+            if not verified and isinstance(password, str) and _is_plaintext(account.password_hash) and secrets.compare_digest(
+                password.encode('utf-8'), account.password_hash.encode('utf-8')
+            ):
+                # Demo accounts seeded with a plain password get it hashed on first use
+                rehash(password)
+                verified = True
+            
+            if verified:
                 return {
                     'verified': True,
                     'account': account,
-                    'balance': float(account.current_balance)  # Convert to float for JSON
+                    'balance': float(account.total_balance)  # Convert to float for JSON
                 }
             else:
                 return {
@@ -45,6 +547,9 @@ class BankPaymentService:
                 'verified': False,
                 'error': 'Account not found'
             }
+        except HashingPoolSaturated:
+            # Surfaces as a 429 so the client retries
+            raise
         except Exception as e:
             return {
                 'verified': False,
@@ -135,11 +640,15 @@ class BankPaymentService:
                         'user': account_data['user'],
                         'bank_name': account_data['bank_name'],
                         'account_holder_name': account_data['account_holder_name'],
-                        'password_hash': make_password(account_data['password']),
+                        'password_hash': PasswordHashingPolicy.make_password(account_data['password'], BANK_ACCOUNT_HASHING_ROLE),
                         'current_balance': account_data['initial_balance'],
                         'is_active': True
                     }
                 )
+                if account.account_number in (MERCHANT_ACCOUNT_NUMBER, SERVICE_FEE_ACCOUNT_NUMBER):
+                    # Demo reset discards unfolded credits along with the balance
+                    BankAccountShard.objects.filter(account=account).delete()
+                    SettlementEngine.configure_shards(account, settings.BANK_HOT_ACCOUNT_SHARDS)
                 created_accounts.append(account)
             
             return created_accounts
@@ -149,23 +658,22 @@ class BankPaymentService:
             return []
     
     @staticmethod
-    def process_ecommerce_payment(payment_id, account_number, password, amount):
+    def process_ecommerce_payment(payment_id, account_number, password, amount, verification_token=None):
         """
         Process e-commerce payment with fee distribution
         1. Deduct from customer account (order amount)
-        2. Transfer 98% to merchant settlement account
-        3. Route 2% service fee to the system fee account
+        2. Transfer the amount less the service fee to merchant settlement account
+        3. Route the service fee (the merchant's fee schedule, 2% by default) to the system fee account
+        A verification_token from /api/bank/verify/ replaces the password.
         """
         try:
-            print("=" * 60)
-            print(f"PROCESSING E-COMMERCE PAYMENT")
-            print(f"Payment ID: {payment_id}")
-            print(f"Account: {account_number}")
-            print(f"Amount input: {amount}, Type: {type(amount)}")
-            print("=" * 60)
+            print(f"PROCESSING E-COMMERCE PAYMENT {payment_id} from {account_number} ({amount})")
             
-            # Verify customer account
-            verification = BankPaymentService.verify_account(account_number, password)
+            # Verify customer account (password hashing stays outside the settlement transaction)
+            if verification_token:
+                verification = BankVerificationService.redeem(verification_token, account_number, amount, payment_id)
+            else:
+                verification = BankPaymentService.verify_account(account_number, password)
             if not verification['verified']:
                 return {
                     'success': False,
@@ -173,27 +681,25 @@ class BankPaymentService:
                 }
             
             customer_account = verification['account']
-            print(f"Customer account found: {customer_account.account_number}")
-            print(f"Customer balance: {customer_account.current_balance}, Type: {type(customer_account.current_balance)}")
             
-            # Get or create merchant account (your shop)
-            try:
-                merchant_account = BankAccount.objects.get(account_number=MERCHANT_ACCOUNT_NUMBER)
-            except BankAccount.DoesNotExist:
-                print("Merchant account not found, creating demo accounts...")
-                BankPaymentService.create_demo_accounts()
-                merchant_account = BankAccount.objects.get(account_number=MERCHANT_ACCOUNT_NUMBER)
-
-            # Get service fee account
-            try:
-                service_account = BankAccount.objects.get(account_number=SERVICE_FEE_ACCOUNT_NUMBER)
-            except BankAccount.DoesNotExist:
-                print("Service fee account not found, creating demo accounts...")
+            # Get or create merchant account (your shop) and service fee account
+            settlement_accounts = {
+                account.account_number: account
+                for account in BankAccount.objects.filter(
+                    account_number__in=[MERCHANT_ACCOUNT_NUMBER, SERVICE_FEE_ACCOUNT_NUMBER]
+                )
+            }
+            if len(settlement_accounts) < 2:
+                print("Settlement accounts not found, creating demo accounts...")
                 BankPaymentService.create_demo_accounts()
-                service_account = BankAccount.objects.get(account_number=SERVICE_FEE_ACCOUNT_NUMBER)
-            
-            print(f"Merchant account: {merchant_account.account_number}")
-            print(f"Merchant balance: {merchant_account.current_balance}")
+                settlement_accounts = {
+                    account.account_number: account
+                    for account in BankAccount.objects.filter(
+                        account_number__in=[MERCHANT_ACCOUNT_NUMBER, SERVICE_FEE_ACCOUNT_NUMBER]
+                    )
+                }
+            merchant_account = settlement_accounts[MERCHANT_ACCOUNT_NUMBER]
+            service_account = settlement_accounts[SERVICE_FEE_ACCOUNT_NUMBER]
             
             # Ensure amount is Decimal
             if not isinstance(amount, Decimal):
@@ -205,161 +711,13 @@ class BankPaymentService:
                         'error': 'Invalid amount format'
                     }
             
-            print(f"Amount after conversion: {amount}, Type: {type(amount)}")
-            
-            # Calculate fees (2%)
-            print("Calculating service fee...")
-            service_fee = ServiceFeeCalculatorService.calculate_fee(amount)
-            print(f"Service fee: {service_fee}, Type: {type(service_fee)}")
-            
-            # DEBUG: Check if service_fee is Decimal
-            if not isinstance(service_fee, Decimal):
-                print(f"WARNING: service_fee is {type(service_fee)}, converting to Decimal...")
-                service_fee = Decimal(str(service_fee))
-                print(f"Service fee after conversion: {service_fee}, Type: {type(service_fee)}")
-            
-            total_deduction = amount  # Customer pays the order total
-            merchant_receives = amount - service_fee  # Settlement amount
-            print(f"Total deduction (customer pays): {total_deduction}, Type: {type(total_deduction)}")
-            print(f"Merchant receives: {merchant_receives}")
-            
-            # Check customer has sufficient balance
-            if customer_account.current_balance < total_deduction:
-                return {
-                    'success': False,
-                    'error': f'Insufficient funds. Need {total_deduction:.2f} ETB, have {customer_account.current_balance:.2f} ETB'
-                }
-            
-            # Step 1: Deduct from customer (order total)
-            print(f"Deducting {total_deduction} from customer...")
-            customer_account.current_balance -= total_deduction
-            customer_account.save()
-            
-            # Record customer transaction (debit)
-            customer_transaction = BankTransaction.objects.create(
-                bank_account=customer_account,
-                amount=total_deduction,
-                transaction_type='debit',
-                running_balance=customer_account.current_balance,
-                description=f"E-commerce purchase: {amount} ETB (includes 2% fee)",
-                status='completed'
-            )
-            print(f"Customer transaction recorded: {customer_transaction.transaction_id}")
-            
-            # Step 2: Transfer to merchant (98%)
-            print(f"Transferring {merchant_receives} to merchant...")
-            merchant_account.current_balance += merchant_receives
-            merchant_account.save()
-            
-            # Record merchant transaction (credit)
-            merchant_transaction = BankTransaction.objects.create(
-                bank_account=merchant_account,
-                amount=merchant_receives,
-                transaction_type='credit',
-                running_balance=merchant_account.current_balance,
-                description=f"Payment from customer: {amount} ETB (-{service_fee:.2f} ETB fee)",
-                status='completed'
-            )
-            print(f"Merchant transaction recorded: {merchant_transaction.transaction_id}")
-
-            # Step 3: Move service fee to system account
-            print(f"Routing service fee {service_fee} to system account...")
-            service_account.current_balance += service_fee
-            service_account.save()
-            service_transaction = BankTransaction.objects.create(
-                bank_account=service_account,
-                amount=service_fee,
-                transaction_type='credit',
-                running_balance=service_account.current_balance,
-                description=f"Service fee collected for payment {payment_id}",
-                status='completed'
-            )
-            print(f"Service fee transaction recorded: {service_transaction.transaction_id}")
-            
-            # Create transaction ID
-            transaction_id = f"TXN{str(uuid.uuid4())[:8].upper()}"
-
-            # Try to synchronise with Payment/Transaction/Receipt models when payment exists
-            payment_obj = None
-            try:
-                payment_obj = Payment.objects.filter(payment_id=payment_id).first()
-            except Exception:
-                payment_obj = None
-
-            if payment_obj:
-                payment_obj.status = 'Completed'
-                payment_obj.processed_at = timezone.now()
-                payment_obj.save()
-
-                transaction_record = Transaction.objects.create(
-                    payment_id=payment_obj,
-                    user_id=payment_obj.user_id,
-                    amount=amount,
-                    service_fee=service_fee,
-                    total_amount=amount,
-                    status='Success',
-                    completed_at=timezone.now()
-                )
-
-                Receipt.objects.create(
-                    transaction_id=transaction_record,
-                    user_id=payment_obj.user_id,
-                    amount=amount,
-                    service_fee=service_fee,
-                    total_amount=amount
-                )
-            else:
-                transaction_record = None
-            
-            # Log the transaction
-            SystemLogService.create_log(
-                user_id=customer_account.user,
-                action="E-commerce Payment Processed",
-                status="SUCCESS",
-                details=f"Payment {payment_id}: Customer paid {amount} ETB. Merchant received {merchant_receives:.2f} ETB. Fee: {service_fee:.2f} ETB"
+            return BankPaymentService.settle_payment(
+                payment_id, customer_account, merchant_account, service_account, amount,
+                verification_nonce=verification.get('nonce')
             )
             
-            # Also log for merchant
-            SystemLogService.create_log(
-                user_id=merchant_account.user,
-                action="Payment Received from Customer",
-                status="SUCCESS",
-                details=f"Received {merchant_receives:.2f} ETB from customer {customer_account.account_number} for payment {payment_id}"
-            )
-
-            # Log service account movement
-            SystemLogService.create_log(
-                user_id=service_account.user,
-                action="Service Fee Collected",
-                status="SUCCESS",
-                details=f"Service fee {service_fee:.2f} ETB collected for payment {payment_id}"
-            )
-            
-            result = {
-                'success': True,
-                'transaction_id': transaction_id,
-                'customer_transaction_id': str(customer_transaction.transaction_id),
-                'merchant_transaction_id': str(merchant_transaction.transaction_id),
-                'service_fee_transaction_id': str(service_transaction.transaction_id),
-                'amount': float(amount),
-                'service_fee': float(service_fee),
-                'total_deducted': float(total_deduction),
-                'merchant_received': float(merchant_receives),
-                'customer_balance': float(customer_account.current_balance),
-                'merchant_balance': float(merchant_account.current_balance),
-                'service_account_balance': float(service_account.current_balance),
-                'fee_percentage': '2%',
-                'transaction_record_id': str(transaction_record.transaction_id) if transaction_record else None,
-                'message': f'Payment successful! Merchant received ETB {merchant_receives:.2f}'
-            }
-            
-            print("=" * 60)
-            print("PAYMENT SUCCESSFUL!")
-            print(f"Result: {result}")
-            print("=" * 60)
-            
-            return result
-            
+        except HashingPoolSaturated:
+            raise
         except Exception as e:
             print(f"Error in process_ecommerce_payment: {str(e)}")
             import traceback
@@ -369,56 +727,204 @@ class BankPaymentService:
                 'error': str(e)
             }
     
+    @staticmethod
+    def settle_payment(payment_id, customer_account, merchant_account, service_account, amount,
+                       verification_nonce=None):
+        """
+        Settle an already-verified e-commerce payment.
+        The three ledger legs, the Payment/Transaction/Receipt records and the
+        merchant aggregates are written in one database transaction, batched so
+        a settlement stays within SETTLEMENT_QUERY_BUDGET statements. The audit
+        logs are queued for the background log writer once it commits.
+        verification_nonce, from BankVerificationService.redeem(), is consumed in
+        the same transaction.
+        """
+        # Calculate fees from the merchant's fee schedule (2% by default)
+        quote = ServiceFeeCalculatorService.quote_fee(amount, merchant_account.user_id)
+        service_fee = quote['fee']
+        fee_rate = ServiceFeeCalculatorService.format_rate(quote['fee_percentage'])
+        
+        total_deduction = amount  # Customer pays the order total
+        merchant_receives = amount - service_fee  # Settlement amount
+        
+        # Resolve the linked Payment before taking any row locks
+        payment_obj = None
+        try:
+            payment_obj = Payment.objects.filter(payment_id=payment_id).first()
+        except Exception:
+            payment_obj = None
+        
+        # Create transaction ID
+        transaction_id = f"TXN{str(uuid.uuid4())[:8].upper()}"
+        
+        try:
+            with transaction.atomic():
+                if verification_nonce:
+                    BankVerificationService.consume(verification_nonce)
+                customer_transaction, merchant_transaction, service_transaction = SettlementEngine.settle([
+                    {
+                        'account': customer_account,
+                        'amount': total_deduction,
+                        'transaction_type': 'debit',
+                        'description': f"E-commerce purchase: {amount} ETB (includes {fee_rate} fee)",
+                    },
+                    {
+                        'account': merchant_account,
+                        'amount': merchant_receives,
+                        'transaction_type': 'credit',
+                        'description': f"Payment from customer: {amount} ETB (-{service_fee:.2f} ETB fee)",
+                    },
+                    {
+                        'account': service_account,
+                        'amount': service_fee,
+                        'transaction_type': 'credit',
+                        'description': f"Service fee collected for payment {payment_id}",
+                    },
+                ], settlement_id=transaction_id, payment=payment_obj, payment_reference=str(payment_id)[:100])
+                
+                MerchantStatsService.record_settlement(merchant_account, amount, service_fee)
+                
+                # Synchronise with Payment/Transaction/Receipt models when payment exists
+                if payment_obj:
+                    payment_obj.status = 'Completed'
+                    payment_obj.processed_at = timezone.now()
+                    Payment.objects.filter(pk=payment_obj.pk).update(
+                        status=payment_obj.status,
+                        processed_at=payment_obj.processed_at
+                    )
+                    publish_payment_status(payment_obj)
+                    enqueue_payment_event(payment_obj)
+                    
+                    transaction_record = Transaction.objects.create(
+                        payment_id=payment_obj,
+                        user_id_id=payment_obj.user_id_id,
+                        amount=amount,
+                        service_fee=service_fee,
+                        total_amount=amount,
+                        status='Success',
+                        completed_at=payment_obj.processed_at
+                    )
+                    
+                    Receipt.objects.create(
+                        transaction_id=transaction_record,
+                        user_id_id=payment_obj.user_id_id,
+                        amount=amount,
+                        service_fee=service_fee,
+                        total_amount=amount
+                    )
+                else:
+                    transaction_record = None
+                
+                # Customer, merchant and service account logs are queued together on commit
+                SystemLogService.create_logs([
+                    {
+                        'user_id': customer_account.user_id,
+                        'action': "E-commerce Payment Processed",
+                        'status': "SUCCESS",
+                        'details': f"Payment {payment_id}: Customer paid {amount} ETB. Merchant received {merchant_receives:.2f} ETB. Fee: {service_fee:.2f} ETB"
+                    },
+                    {
+                        'user_id': merchant_account.user_id,
+                        'action': "Payment Received from Customer",
+                        'status': "SUCCESS",
+                        'details': f"Received {merchant_receives:.2f} ETB from customer {customer_account.account_number} for payment {payment_id}"
+                    },
+                    {
+                        'user_id': service_account.user_id,
+                        'action': "Service Fee Collected",
+                        'status': "SUCCESS",
+                        'details': f"Service fee {service_fee:.2f} ETB collected for payment {payment_id}"
+                    },
+                ])
+        except SettlementError as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+        
+        return {
+            'success': True,
+            'transaction_id': transaction_id,
+            'customer_transaction_id': str(customer_transaction.transaction_id),
+            'merchant_transaction_id': str(merchant_transaction.transaction_id),
+            'service_fee_transaction_id': str(service_transaction.transaction_id),
+            'amount': float(amount),
+            'service_fee': float(service_fee),
+            'total_deducted': float(total_deduction),
+            'merchant_received': float(merchant_receives),
+            'customer_balance': float(customer_transaction.running_balance),
+            'merchant_balance': float(merchant_transaction.running_balance),
+            'service_account_balance': float(service_transaction.running_balance),
+            'fee_percentage': fee_rate,
+            'fee_version': quote['version'],
+            'transaction_record_id': str(transaction_record.transaction_id) if transaction_record else None,
+            'message': f'Payment successful! Merchant received ETB {merchant_receives:.2f}'
+        }
+    
+    @staticmethod
+    def get_settlement_legs(reference):
+        """
+        Return every ledger leg of the settlement identified by reference: the
+        transaction ID of one leg, a TXN settlement ID or the store's payment ID.
+        """
+        legs = BankTransaction.objects.select_related('bank_account', 'payment').order_by('created_at')
+        
+        if reference.startswith('TXN'):
+            return list(legs.filter(settlement_id=reference))
+        
+        try:
+            leg = legs.filter(transaction_id=uuid.UUID(reference)).first()
+        except ValueError:
+            leg = None
+        if leg:
+            if not leg.settlement_id:
+                # A legacy leg the 0008 backfill could not pair with its settlement
+                return [leg]
+            return list(legs.filter(settlement_id=leg.settlement_id))
+        
+        return list(legs.filter(payment_reference=reference))
+    
+    @staticmethod
+    def get_merchant_account(user):
+        """Bank account that receives the user's settlements (falls back to the demo merchant)"""
+        # Get merchant account
+        merchant_account = BankAccount.objects.filter(
+            user=user,
+            user__role='merchant'
+        ).prefetch_related('shards').first()
+        
+        if not merchant_account:
+            # Try to get by account number
+            merchant_account = BankAccount.objects.filter(
+                account_number=MERCHANT_ACCOUNT_NUMBER
+            ).prefetch_related('shards').first()
+        
+        return merchant_account
+    
     @staticmethod
     def get_merchant_dashboard(user):
         """Get merchant dashboard with transactions"""
         try:
-            # Get merchant account
-            merchant_account = BankAccount.objects.filter(
-                user=user,
-                user__role='merchant'
-            ).first()
-            
-            if not merchant_account:
-                # Try to get by account number
-                merchant_account = BankAccount.objects.filter(
-                    account_number=MERCHANT_ACCOUNT_NUMBER
-                ).first()
-            
+            merchant_account = BankPaymentService.get_merchant_account(user)
             if not merchant_account:
                 return None
             
-            # Get recent transactions
-            transactions = BankTransaction.objects.filter(
-                bank_account=merchant_account
-            ).order_by('-created_at')[:50]
-            
-            # Calculate statistics - ensure all are Decimal
-            total_received = Decimal('0.00')
-            total_fees = Decimal('0.00')
-            
-            for tx in transactions:
-                if tx.transaction_type == 'credit':
-                    total_received += tx.amount
-                    # Calculate fee for each transaction
-                    try:
-                        fee = ServiceFeeCalculatorService.calculate_fee(tx.amount)
-                        total_fees += fee
-                    except:
-                        # If calculation fails, use 2% approximation
-                        total_fees += tx.amount * Decimal('0.02')
+            # Totals come from the aggregates maintained by each settlement
+            stats, daily = MerchantStatsService.get_stats(merchant_account)
             
-            net_income = total_received - total_fees
+            # Recent transactions; the caller pages through them newest first
+            transactions = BankTransaction.objects.filter(bank_account=merchant_account)
             
             return {
                 'account': merchant_account,
                 'transactions': transactions,
+                'daily': daily,
                 'statistics': {
-                    'total_received': total_received,
-                    'total_fees': total_fees,
-                    'net_income': net_income,
-                    'transaction_count': len(transactions),
-                    'current_balance': merchant_account.current_balance
+                    'total_received': stats.total_received,
+                    'total_fees': stats.total_fees,
+                    'net_income': stats.net_income,
+                    'transaction_count': stats.transaction_count,
+                    'current_balance': merchant_account.total_balance
                 }
             }
             
@@ -443,7 +949,7 @@ class BankPaymentService:
                 account_number=account_data['account_number'],
                 bank_name=account_data['bank_name'],
                 account_holder_name=account_data['account_holder_name'],
-                password_hash=make_password(account_data['password']),
+                password_hash=PasswordHashingPolicy.make_password(account_data['password'], BANK_ACCOUNT_HASHING_ROLE),
                 current_balance=account_data['initial_balance'],
                 is_active=True
             )
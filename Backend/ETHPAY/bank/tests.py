@@ -1,3 +1,628 @@
+import re
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from importlib import import_module
+from io import StringIO
+from unittest import mock, skipUnless
+
+from django.apps import apps
+
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from api.models import Payment, User
+from api.services import ServiceFeeCalculatorService
+from .models import BankAccount, BankAccountShard, BankTransaction, MerchantStats, SettlementRollup
+from .services import (
+    SETTLEMENT_QUERY_BUDGET, BankPaymentService, BankVerificationService, SettlementEngine, SettlementError,
+    SettlementRollupService
+)
+
+
+class SettlementFixtures:
+    """A customer, merchant and service account, and helpers to settle between them"""
+
+    def setUp(self):
+        self.customer = self.create_account('customer', 'endUser', '910900001', Decimal('1000.00'))
+        self.merchant = self.create_account('merchant', 'merchant', '910900002')
+        self.service = self.create_account('service', 'admin', '910900003')
+
+    def create_account(self, name, role, account_number, balance=Decimal('0.00')):
+        user = User.objects.create(
+            email=f'{name}@settlement.test',
+            full_name=name.title(),
+            phone_number='+251900000000',
+            role=role,
+            status='active'
+        )
+        return BankAccount.objects.create(
+            user=user,
+            account_number=account_number,
+            bank_name='Test Bank',
+            account_holder_name=name.title(),
+            password_hash='!',
+            current_balance=balance
+        )
+
+    def create_payment(self, amount):
+        return Payment.objects.create(
+            user_id=self.customer.user,
+            recipient_id=self.merchant.user,
+            amount=amount,
+            payment_method='BankTransfer',
+            callback_url='https://shop.example.com/webhook'
+        )
+
+    def settle(self, amount, payment=None):
+        return BankPaymentService.settle_payment(
+            payment.payment_id if payment else 'warmup', self.customer, self.merchant, self.service, amount
+        )
+
+
+class SettlementTests(SettlementFixtures, TestCase):
+    """Settlement correctness and its pinned SQL statement budget"""
+
+    def settle_payment(self):
+        # The first settlement creates the merchant's stats rows for the hour
+        self.assertTrue(self.settle(Decimal('10.00'))['success'])
+        return self.create_payment(Decimal('100.00'))
+
+    def test_settlement_within_query_budget(self):
+        payment = self.settle_payment()
+        with CaptureQueriesContext(connection) as queries:
+            result = self.settle(Decimal('100.00'), payment)
+        self.assertTrue(result['success'], result.get('error'))
+        # Unstriped accounts skip the per-shard statements
+        self.assertLessEqual(len(queries), SETTLEMENT_QUERY_BUDGET)
+        fees = sum(
+            ServiceFeeCalculatorService.calculate_fee(amount, self.merchant.user_id)
+            for amount in (Decimal('10.00'), Decimal('100.00'))
+        )
+
+        self.customer.refresh_from_db()
+        self.merchant.refresh_from_db()
+        self.service.refresh_from_db()
+        self.assertEqual(self.customer.current_balance, Decimal('890.00'))
+        self.assertEqual(self.merchant.current_balance, Decimal('110.00') - fees)
+        self.assertEqual(self.service.current_balance, fees)
+        self.assertEqual(BankTransaction.objects.filter(payment=payment).count(), 3)
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'Completed')
+
+    def test_sharded_settlement_within_query_budget(self):
+        for account in (self.merchant, self.service):
+            SettlementEngine.configure_shards(account, 4)
+
+        payment = self.settle_payment()
+        # The budget is pinned on this path: striped merchant and fee accounts
+        with self.assertNumQueries(SETTLEMENT_QUERY_BUDGET):
+            result = self.settle(Decimal('100.00'), payment)
+        self.assertTrue(result['success'], result.get('error'))
+
+        stats = MerchantStats.objects.get(account=self.merchant)
+        self.assertEqual(stats.transaction_count, 2)
+        self.assertEqual(stats.total_received, Decimal('110.00'))
+        # Credits landed on the shards, not on the account rows
+        self.merchant.refresh_from_db()
+        self.assertEqual(self.merchant.current_balance, Decimal('0.00'))
+        merchant_total = SettlementEngine.fold_shards(self.merchant)
+        service_total = SettlementEngine.fold_shards(self.service)
+        self.assertEqual(merchant_total + service_total, Decimal('110.00'))
+
+    def test_insufficient_funds_rolls_back(self):
+        payment = self.create_payment(Decimal('5000.00'))
+
+        result = self.settle(Decimal('5000.00'), payment)
+
+        self.assertFalse(result['success'])
+        self.assertIn('Insufficient funds', result['error'])
+        self.customer.refresh_from_db()
+        self.assertEqual(self.customer.current_balance, Decimal('1000.00'))
+        self.assertFalse(BankTransaction.objects.exists())
+        self.assertFalse(MerchantStats.objects.filter(account=self.merchant).exists())
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'Pending')
+        self.assertFalse(payment.webhook_deliveries.exists())
+
+    def test_settlement_reports_merchant_fee_rate(self):
+        self.addCleanup(ServiceFeeCalculatorService.invalidate_rules)
+        ServiceFeeCalculatorService.update_fee_schedule(self.merchant.user, [
+            {'threshold': '0', 'fee_percentage': '0.015', 'minimum_fee': '0.10', 'maximum_fee': '50.00'},
+        ])
+        payment = self.create_payment(Decimal('200.00'))
+
+        result = self.settle(Decimal('200.00'), payment)
+
+        self.assertEqual(result['service_fee'], 3.0)
+        self.assertEqual(result['fee_percentage'], '1.5%')
+        self.assertEqual(result['fee_version'], ServiceFeeCalculatorService.get_calculator().version)
+        debit = BankTransaction.objects.get(payment=payment, transaction_type='debit')
+        self.assertEqual(debit.description, 'E-commerce purchase: 200.00 ETB (includes 1.5% fee)')
+
+    def pay_with_token(self, token, payment, amount):
+        verification = BankVerificationService.redeem(token, self.customer.account_number, amount, payment.payment_id)
+        if not verification['verified']:
+            return {'success': False, 'error': verification['error']}
+        return BankPaymentService.settle_payment(
+            payment.payment_id, verification['account'], self.merchant, self.service, amount,
+            verification_nonce=verification['nonce']
+        )
+
+    def test_verification_token_is_single_use(self):
+        payment = self.create_payment(Decimal('100.00'))
+        token = BankVerificationService.issue(self.customer, Decimal('100.00'), payment.payment_id)
+
+        self.assertTrue(self.pay_with_token(token, payment, Decimal('100.00'))['success'])
+        replay = self.pay_with_token(token, payment, Decimal('100.00'))
+
+        self.assertFalse(replay['success'])
+        self.assertEqual(replay['error'], 'Verification token already used')
+        self.assertEqual(BankTransaction.objects.filter(payment=payment).count(), 3)
+
+    def test_verification_token_survives_failed_settlement(self):
+        payment = self.create_payment(Decimal('500.00'))
+        token = BankVerificationService.issue(self.customer, Decimal('500.00'), payment.payment_id)
+        BankAccount.objects.filter(pk=self.customer.pk).update(current_balance=Decimal('100.00'))
+        self.customer.refresh_from_db()
+
+        self.assertIn('Insufficient funds', self.pay_with_token(token, payment, Decimal('500.00'))['error'])
+        BankAccount.objects.filter(pk=self.customer.pk).update(current_balance=Decimal('1000.00'))
+        self.customer.refresh_from_db()
+
+        self.assertTrue(self.pay_with_token(token, payment, Decimal('500.00'))['success'])
+
+    def test_verification_token_is_bound_to_payment(self):
+        payment = self.create_payment(Decimal('100.00'))
+        other = self.create_payment(Decimal('100.00'))
+        token = BankVerificationService.issue(self.customer, Decimal('100.00'), payment.payment_id)
+
+        result = self.pay_with_token(token, other, Decimal('100.00'))
+
+        self.assertEqual(result['error'], 'Verification token does not match this payment')
+
+
+def shard_updates(queries):
+    """(account pk hex, shard_index) of each shard balance UPDATE in queries, in execution order"""
+    return [
+        (match.group(1).replace('-', ''), int(match.group(2)))
+        for match in (
+            re.search(r'"account_id" = \'([0-9a-f-]+)\' AND "bank_bankaccountshard"."shard_index" = (\d+)', query['sql'])
+            for query in queries if query['sql'].startswith('UPDATE "bank_bankaccountshard"')
+        )
+        if match
+    ]
+
+
+def locked_accounts(queries):
+    """Account numbers named by each locking SELECT of SettlementEngine.settle in queries"""
+    return [
+        re.findall(r"'(\d+)'", query['sql'].split(' IN (', 1)[1].split(')', 1)[0])
+        for query in queries
+        if query['sql'].startswith('SELECT') and 'ORDER BY "bank_bankaccount"."account_number" ASC' in query['sql']
+    ]
+
+
+class SettlementEngineTests(SettlementFixtures, TestCase):
+    """Row locks taken in a fixed order and legs applied atomically to the committed balances"""
+
+    def leg(self, account, amount, transaction_type):
+        return {'account': account, 'amount': Decimal(amount), 'transaction_type': transaction_type, 'description': ''}
+
+    def balance(self, account):
+        return BankAccount.objects.get(pk=account.pk).current_balance
+
+    def test_accounts_are_locked_in_account_number_order(self):
+        legs = [
+            self.leg(self.service, '2.00', 'credit'),
+            self.leg(self.merchant, '98.00', 'credit'),
+            self.leg(self.customer, '100.00', 'debit'),
+        ]
+
+        with CaptureQueriesContext(connection) as queries:
+            service, merchant, customer = SettlementEngine.settle(legs)
+
+        self.assertEqual(locked_accounts(queries), [['910900001', '910900002', '910900003']])
+        # Legs are returned in the order given
+        self.assertEqual(
+            [leg.bank_account_id for leg in (service, merchant, customer)],
+            [self.service.pk, self.merchant.pk, self.customer.pk]
+        )
+
+    def test_shard_credits_are_applied_in_lock_order(self):
+        SettlementEngine.configure_shards(self.merchant, 4)
+        SettlementEngine.configure_shards(self.service, 4)
+        legs = [
+            self.leg(self.service, '2.00', 'credit'),
+            self.leg(self.merchant, '49.00', 'credit'),
+            self.leg(self.merchant, '49.00', 'credit'),
+            self.leg(self.customer, '100.00', 'debit'),
+        ]
+
+        with mock.patch('bank.services.random.randrange', side_effect=[0, 3, 1]):
+            with CaptureQueriesContext(connection) as queries:
+                SettlementEngine.settle(legs)
+
+        self.assertEqual(locked_accounts(queries), [['910900001']])
+        self.assertEqual(
+            shard_updates(queries),
+            [(self.merchant.pk.hex, 1), (self.merchant.pk.hex, 3), (self.service.pk.hex, 0)]
+        )
+
+    def test_balances_are_applied_to_the_committed_row(self):
+        BankAccount.objects.filter(pk=self.customer.pk).update(current_balance=Decimal('500.00'))
+        # self.customer still holds the 1000.00 it was created with
+        legs = [self.leg(self.customer, '100.00', 'debit'), self.leg(self.customer, '30.00', 'credit')]
+
+        debit, credit = SettlementEngine.settle(legs)
+
+        self.assertEqual((debit.running_balance, credit.running_balance), (Decimal('400.00'), Decimal('430.00')))
+        self.assertEqual(self.balance(self.customer), Decimal('430.00'))
+
+    def test_failed_leg_rolls_back_the_others(self):
+        legs = [self.leg(self.merchant, '10.00', 'credit'), self.leg(self.customer, '5000.00', 'debit')]
+
+        with self.assertRaisesMessage(SettlementError, 'Insufficient funds'), transaction.atomic():
+            SettlementEngine.settle(legs)
+
+        self.assertEqual(self.balance(self.merchant), Decimal('0.00'))
+        self.assertEqual(self.balance(self.customer), Decimal('1000.00'))
+        self.assertFalse(BankTransaction.objects.exists())
+
+    def test_inactive_account_is_refused(self):
+        BankAccount.objects.filter(pk=self.merchant.pk).update(is_active=False)
+        legs = [self.leg(self.customer, '10.00', 'debit'), self.leg(self.merchant, '10.00', 'credit')]
+
+        with self.assertRaisesMessage(SettlementError, 'Account 910900002 is not available'), transaction.atomic():
+            SettlementEngine.settle(legs)
+
+        self.assertEqual(self.balance(self.customer), Decimal('1000.00'))
+
+
+class ShardedAccountTests(SettlementFixtures, TestCase):
+    """Credits to striped accounts land on shards and are folded back into the balance"""
+
+    def setUp(self):
+        super().setUp()
+        SettlementEngine.configure_shards(self.merchant, 4)
+
+    def credit_merchant(self, amount, shard_index):
+        with mock.patch('bank.services.random.randrange', return_value=shard_index):
+            return SettlementEngine.settle([
+                {'account': self.customer, 'amount': amount, 'transaction_type': 'debit', 'description': 'Out'},
+                {'account': self.merchant, 'amount': amount, 'transaction_type': 'credit', 'description': 'In'},
+            ])
+
+    def shard_balances(self):
+        return list(BankAccountShard.objects.filter(account=self.merchant).order_by('shard_index')
+                    .values_list('balance', flat=True))
+
+    def test_credit_lands_on_one_shard_without_locking_the_account(self):
+        self.credit_merchant(Decimal('30.00'), 1)
+        with CaptureQueriesContext(connection) as queries:
+            debit, credit = self.credit_merchant(Decimal('20.00'), 2)
+
+        self.assertEqual(locked_accounts(queries), [[self.customer.account_number]])
+        self.assertEqual(shard_updates(queries), [(self.merchant.pk.hex, 2)])
+        self.assertEqual(self.shard_balances(), [Decimal('0.00'), Decimal('30.00'), Decimal('20.00'), Decimal('0.00')])
+        merchant = BankAccount.objects.get(pk=self.merchant.pk)
+        self.assertEqual(merchant.current_balance, Decimal('0.00'))
+        self.assertEqual(merchant.total_balance, Decimal('50.00'))
+        self.assertEqual(credit.running_balance, Decimal('50.00'))
+        self.assertEqual(debit.running_balance, Decimal('950.00'))
+
+    def test_debit_only_draws_on_folded_balance(self):
+        self.credit_merchant(Decimal('30.00'), 0)
+        refund = [
+            {'account': self.merchant, 'amount': Decimal('10.00'), 'transaction_type': 'debit', 'description': 'Refund'}
+        ]
+
+        # settle() joins the caller's transaction, so the failure is rolled back with it
+        with self.assertRaisesMessage(SettlementError, 'Insufficient funds'), transaction.atomic():
+            SettlementEngine.settle(refund)
+
+        self.assertEqual(SettlementEngine.fold_shards(self.merchant), Decimal('30.00'))
+        SettlementEngine.settle(refund)
+        self.assertEqual(BankAccount.objects.get(pk=self.merchant.pk).current_balance, Decimal('20.00'))
+
+    def test_missing_shard_rolls_back_the_settlement(self):
+        BankAccountShard.objects.filter(account=self.merchant, shard_index=3).delete()
+
+        with self.assertRaisesMessage(SettlementError, 'has no shard 3'), transaction.atomic():
+            self.credit_merchant(Decimal('30.00'), 3)
+
+        self.assertEqual(BankAccount.objects.get(pk=self.customer.pk).current_balance, Decimal('1000.00'))
+        self.assertFalse(BankTransaction.objects.exists())
+
+    def test_fold_moves_shard_balances_into_account(self):
+        self.credit_merchant(Decimal('30.00'), 0)
+        self.credit_merchant(Decimal('20.00'), 3)
+        out = StringIO()
+
+        call_command('fold_account_shards', account=self.merchant.account_number, stdout=out)
+
+        self.assertIn(f'Folded 50.00 ETB into {self.merchant.account_number}', out.getvalue())
+        self.assertEqual(self.shard_balances(), [Decimal('0.00')] * 4)
+        merchant = BankAccount.objects.get(pk=self.merchant.pk)
+        self.assertEqual((merchant.current_balance, merchant.total_balance), (Decimal('50.00'), Decimal('50.00')))
+        self.assertEqual(SettlementEngine.fold_shards(self.merchant), Decimal('0.00'))
+
+    def test_reconfiguring_folds_and_resizes_shards(self):
+        self.credit_merchant(Decimal('30.00'), 3)
+
+        SettlementEngine.configure_shards(self.merchant, 2)
+
+        self.assertEqual(self.shard_balances(), [Decimal('0.00')] * 2)
+        self.assertEqual(BankAccount.objects.get(pk=self.merchant.pk).current_balance, Decimal('30.00'))
+
+        SettlementEngine.configure_shards(self.merchant, 0)
+        self.credit_merchant(Decimal('5.00'), 0)
+        self.assertEqual(self.shard_balances(), [])
+        self.assertEqual(BankAccount.objects.get(pk=self.merchant.pk).current_balance, Decimal('35.00'))
+
+
+class SettlementLookupTests(SettlementFixtures, TestCase):
+    """Settlement legs found by leg, settlement or store payment ID through the linkage indexes"""
+
+    def setUp(self):
+        super().setUp()
+        self.result = BankPaymentService.settle_payment(
+            'PAY-STORE-1', self.customer, self.merchant, self.service, Decimal('100.00')
+        )
+        self.assertTrue(self.result['success'], self.result.get('error'))
+
+    def assert_settlement(self, legs):
+        self.assertEqual(len(legs), 3)
+        self.assertEqual({leg.settlement_id for leg in legs}, {self.result['transaction_id']})
+
+    def test_lookup_by_settlement_id(self):
+        with self.assertNumQueries(1):
+            self.assert_settlement(BankPaymentService.get_settlement_legs(self.result['transaction_id']))
+
+    def test_lookup_by_leg_id(self):
+        with self.assertNumQueries(2):
+            self.assert_settlement(BankPaymentService.get_settlement_legs(self.result['merchant_transaction_id']))
+
+    def test_lookup_by_store_payment_id(self):
+        with self.assertNumQueries(1):
+            legs = BankPaymentService.get_settlement_legs('PAY-STORE-1')
+        self.assert_settlement(legs)
+        self.assertEqual({leg.payment_reference for leg in legs}, {'PAY-STORE-1'})
+
+    def test_unlinked_leg_is_found_alone(self):
+        BankTransaction.objects.filter(transaction_id=self.result['customer_transaction_id']).update(settlement_id='')
+
+        legs = BankPaymentService.get_settlement_legs(self.result['customer_transaction_id'])
+
+        self.assertEqual([str(leg.transaction_id) for leg in legs], [self.result['customer_transaction_id']])
+        self.assertEqual(BankPaymentService.get_settlement_legs('PAY-UNKNOWN'), [])
+
+    def test_payment_endpoint_accepts_store_payment_id(self):
+        response = APIClient(SERVER_NAME='localhost').get('/api/bank/payment/PAY-STORE-1/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['settlement_id'], self.result['transaction_id'])
+        self.assertEqual(response.data['payment']['payment_id'], 'PAY-STORE-1')
+
+    @skipUnless(connection.vendor == 'sqlite', 'other planners may scan tables this small')
+    def test_lookups_use_their_indexes(self):
+        legs = BankTransaction.objects.order_by('created_at')
+        for queryset, index in (
+            (legs.filter(settlement_id=self.result['transaction_id']), 'bank_txn_settlement_idx'),
+            (legs.filter(payment_reference='PAY-STORE-1'), 'bank_txn_payment_ref_idx'),
+            (BankTransaction.objects.filter(bank_account=self.merchant).order_by('-created_at')[:10],
+             'bank_txn_account_recent_idx'),
+            (BankTransaction.objects.order_by('-created_at', '-transaction_id')[:10], 'bank_txn_recent_idx'),
+        ):
+            with self.subTest(index=index):
+                self.assertIn(index, queryset.explain())
+
+
+class MerchantStatsBackfillTests(SettlementFixtures, TestCase):
+    """bank.0009 derives merchant aggregates from the ledger"""
+
+    def backfill(self):
+        import_module('bank.migrations.0009_backfill_merchant_stats').backfill_merchant_stats(apps, None)
+
+    def legacy_settlement(self, amount, fee):
+        # Written before settlements were linked: only the descriptions tie the legs together
+        for account, leg_amount, transaction_type, description in (
+            (self.customer, amount, 'debit', f"E-commerce purchase: {amount} ETB (includes 2% fee)"),
+            (self.merchant, amount - fee, 'credit', f"Payment from customer: {amount} ETB (-{fee} ETB fee)"),
+            (self.service, fee, 'credit', "Service fee collected for payment legacy"),
+        ):
+            BankTransaction.objects.create(
+                bank_account=account, amount=leg_amount, transaction_type=transaction_type,
+                running_balance=Decimal('0.00'), description=description, status='completed'
+            )
+
+    def test_backfill_matches_settled_totals(self):
+        for amount in (Decimal('10.00'), Decimal('250.00')):
+            self.assertTrue(self.settle(amount, self.create_payment(amount))['success'])
+        expected = MerchantStats.objects.get(account=self.merchant)
+        hourly = list(SettlementRollup.objects.filter(account=self.merchant).values_list(
+            'granularity', 'bucket_start', 'total_received', 'total_fees', 'transaction_count'
+        ))
+        MerchantStats.objects.all().delete()
+        SettlementRollup.objects.all().delete()
+
+        self.backfill()
+
+        stats = MerchantStats.objects.get(account=self.merchant)
+        self.assertEqual(
+            (stats.total_received, stats.total_fees, stats.transaction_count),
+            (expected.total_received, expected.total_fees, expected.transaction_count)
+        )
+        self.assertEqual(list(SettlementRollup.objects.filter(account=self.merchant).values_list(
+            'granularity', 'bucket_start', 'total_received', 'total_fees', 'transaction_count'
+        )), hourly)
+        self.assertFalse(MerchantStats.objects.filter(account=self.service).exists())
+
+    def test_backfill_counts_unlinked_legs_and_replaces_stored_totals(self):
+        self.legacy_settlement(Decimal('100.00'), Decimal('2.00'))
+        self.assertTrue(self.settle(Decimal('50.00'), self.create_payment(Decimal('50.00')))['success'])
+        fee = MerchantStats.objects.get(account=self.merchant).total_fees
+        SettlementRollup.objects.create(account=self.merchant, granularity='day', bucket_start=timezone.now())
+
+        self.backfill()
+        self.backfill()
+
+        stats = MerchantStats.objects.get(account=self.merchant)
+        self.assertEqual(stats.total_received, Decimal('150.00'))
+        self.assertEqual(stats.total_fees, fee + Decimal('2.00'))
+        self.assertEqual(stats.transaction_count, 2)
+        # Derived buckets are dropped and derived again from the backfilled hours
+        self.assertFalse(SettlementRollup.objects.filter(account=self.merchant, granularity='day').exists())
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+class SettlementRollupTests(TestCase):
+    """Day and month buckets derived from the hourly rollups"""
+
+    def setUp(self):
+        user = User.objects.create(
+            email='rollups@settlement.test', full_name='Rollups', phone_number='+251900000000', role='merchant', status='active'
+        )
+        self.account = BankAccount.objects.create(
+            user=user, account_number='910600001', bank_name='Test Bank', account_holder_name='Rollups', password_hash='!'
+        )
+        BankAccount.objects.filter(pk=self.account.pk).update(created_at=utc(2025, 1, 1))
+        self.account.refresh_from_db()
+
+    def settled(self, hour, count=1):
+        SettlementRollup.objects.create(
+            account=self.account, granularity='hour', bucket_start=hour,
+            total_received=Decimal('100.00') * count, total_fees=Decimal('2.00') * count, transaction_count=count
+        )
+
+    def series(self, granularity, start, end, now):
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            return [
+                (row.bucket_start, row.transaction_count)
+                for row in SettlementRollupService.series(self.account, granularity, start, end)
+            ]
+
+    def stored(self, granularity):
+        return list(SettlementRollup.objects.filter(account=self.account, granularity=granularity).values_list(
+            'bucket_start', 'transaction_count'
+        ))
+
+    def test_hours_roll_up_into_days(self):
+        self.settled(utc(2026, 2, 10, 0))
+        self.settled(utc(2026, 2, 10, 23), count=2)
+        self.settled(utc(2026, 2, 11, 0))
+
+        days = self.series('day', utc(2026, 2, 10), utc(2026, 2, 11), now=utc(2026, 2, 20, 12))
+
+        self.assertEqual(days, [(utc(2026, 2, 10), 3), (utc(2026, 2, 11), 1)])
+        self.assertEqual(self.stored('day'), days)
+        day = SettlementRollup.objects.get(account=self.account, granularity='day', bucket_start=utc(2026, 2, 10))
+        self.assertEqual((day.total_received, day.total_fees), (Decimal('300.00'), Decimal('6.00')))
+
+    def test_open_day_is_derived_on_every_read(self):
+        self.settled(utc(2026, 2, 11, 9))
+        now = utc(2026, 2, 11, 10, 30)
+
+        self.assertEqual(self.series('day', utc(2026, 2, 10), now, now), [(utc(2026, 2, 10), 0), (utc(2026, 2, 11), 1)])
+        self.settled(utc(2026, 2, 11, 10))
+
+        self.assertEqual(self.series('day', utc(2026, 2, 10), now, now), [(utc(2026, 2, 10), 0), (utc(2026, 2, 11), 2)])
+        # Only the closed day was stored
+        self.assertEqual(self.stored('day'), [(utc(2026, 2, 10), 0)])
+
+    def test_buckets_are_stored_once_closed_past_grace(self):
+        self.settled(utc(2026, 2, 28, 23))
+        just_closed = utc(2026, 3, 1, 0, 3)
+
+        self.assertEqual(self.series('month', utc(2026, 2, 1), just_closed, just_closed), [(utc(2026, 2, 1), 1), (utc(2026, 3, 1), 0)])
+        # A settlement still in flight at midnight may yet land in February
+        self.assertEqual(self.stored('month'), [])
+        self.assertNotIn(utc(2026, 2, 28), [bucket for bucket, _ in self.stored('day')])
+
+        later = just_closed + SettlementRollupService.CLOSE_GRACE
+        self.series('month', utc(2026, 2, 1), later, later)
+        self.assertEqual(self.stored('month'), [(utc(2026, 2, 1), 1)])
+        self.assertIn((utc(2026, 2, 28), 1), self.stored('day'))
+
+    def test_months_are_built_from_stored_days(self):
+        for hour in (utc(2026, 1, 31, 23), utc(2026, 2, 1, 0), utc(2026, 2, 28, 23)):
+            self.settled(hour)
+        now = utc(2026, 3, 15, 12)
+        self.series('day', utc(2026, 1, 1), now, now)
+        # Months no longer need the hours once the days are stored
+        SettlementRollup.objects.filter(granularity='hour').delete()
+
+        months = self.series('month', utc(2026, 1, 1), now, now)
+
+        self.assertEqual(months, [(utc(2026, 1, 1), 1), (utc(2026, 2, 1), 2), (utc(2026, 3, 1), 0)])
+        # Stored months, this month's stored days and today's hours
+        with self.assertNumQueries(3):
+            self.assertEqual(self.series('month', utc(2026, 1, 1), now, now), months)
+
+    def test_bucket_rollover(self):
+        next_bucket = SettlementRollupService.next_bucket
+        self.assertEqual(next_bucket(utc(2025, 12, 31, 23), 'hour'), utc(2026, 1, 1, 0))
+        self.assertEqual(next_bucket(utc(2025, 12, 31), 'day'), utc(2026, 1, 1))
+        self.assertEqual(next_bucket(utc(2026, 2, 28), 'day'), utc(2026, 3, 1))
+        self.assertEqual(next_bucket(utc(2025, 12, 1), 'month'), utc(2026, 1, 1))
+        self.assertEqual(SettlementRollupService.bucket_start(utc(2026, 1, 31, 23, 59, 59), 'month'), utc(2026, 1, 1))
+
+
+class AccountVerificationTests(TestCase):
+    """Bank account password checks"""
+
+    def setUp(self):
+        user = User.objects.create(
+            email='holder@verify.test', full_name='Holder', phone_number='+251900000000', role='endUser', status='active'
+        )
+        self.account = BankAccount.objects.create(
+            user=user, account_number='910700001', bank_name='Test Bank', account_holder_name='Holder',
+            password_hash=make_password('secret-1')
+        )
+
+    def verify(self, password):
+        return BankPaymentService.verify_account(self.account.account_number, password)['verified']
+
+    def test_hashed_password(self):
+        self.assertTrue(self.verify('secret-1'))
+        self.assertFalse(self.verify('secret-2'))
+
+    def test_stored_hash_is_not_a_password(self):
+        stored = self.account.password_hash
+
+        self.assertFalse(self.verify(stored))
+        self.account.refresh_from_db()
+        self.assertTrue(check_password('secret-1', self.account.password_hash))
+
+    def test_seeded_plain_password_is_hashed_on_first_use(self):
+        BankAccount.objects.filter(pk=self.account.pk).update(password_hash='demo-pass')
+
+        self.assertTrue(self.verify('demo-pass'))
+        self.account.refresh_from_db()
+        self.assertNotEqual(self.account.password_hash, 'demo-pass')
+        self.assertTrue(self.verify('demo-pass'))
+        self.assertFalse(self.verify(self.account.password_hash))
+
+
+class BenchmarkExportTests(SettlementFixtures, TestCase):
+    """benchmark_export seeds only the rows it is asked for and removes only those"""
+
+    def test_row_count_is_required(self):
+        with self.assertRaises(CommandError):
+            call_command('benchmark_export', stdout=StringIO())
+
+    def test_removes_only_its_own_rows(self):
+        self.settle(Decimal('10.00'))
+        ledger = set(BankTransaction.objects.values_list('pk', flat=True))
+        out = StringIO()
+
+        call_command('benchmark_export', rows=25, output='csv', max_rss_growth=1024, stdout=out)
 
-# Create your tests here.
+        self.assertIn('Exported 25 rows', out.getvalue())
+        self.assertEqual(set(BankTransaction.objects.values_list('pk', flat=True)), ledger)
+        self.assertFalse(User.objects.filter(email__endswith='@bench.local').exists())
@@ -5,7 +5,7 @@ from .views import (
     process_bank_payment, verify_bank_account,
     create_demo_accounts, get_bank_accounts,
     bank_payment_page, get_merchant_dashboard,
-    create_bank_account
+    get_merchant_analytics, export_bank_transactions, create_bank_account
 )
 
 urlpatterns = [
@@ -14,7 +14,10 @@ urlpatterns = [
     path('create-demo/', create_demo_accounts, name='create-demo-accounts'),
     path('create/', create_bank_account, name='create-bank-account'),
     path('accounts/', get_bank_accounts, name='get-bank-accounts'),
+    path('transactions/export/', export_bank_transactions, name='export-bank-transactions'),
     path('merchant/dashboard/', get_merchant_dashboard, name='merchant-dashboard'),
+    path('merchant/analytics/', get_merchant_analytics, name='merchant-analytics'),
     path('bank-payment/', bank_payment_page, name='bank-payment-page'),
     path('transaction/<str:transaction_id>/', views.get_transaction_details, name='get_transaction_details'),
+    path('payment/<str:payment_id>/', views.get_transaction_by_payment_id, name='get_transaction_by_payment_id'),
 ]
\ No newline at end of file
@@ -3,7 +3,15 @@ from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
 from rest_framework import status
-from .services import BankPaymentService
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .services import BankPaymentService, BankVerificationService, SettlementRollupService, SERVICE_FEE_ACCOUNT_NUMBER
+from api.exports import EXPORT_CONTENT_TYPES, parse_time_param, stream_export, time_range_filter
+from api.hashing import HashingPoolSaturated
+from api.middleware import query_budget
+from api.pagination import KeysetPagination
+from api.services import idempotent
 from .models import BankAccount, BankTransaction
 from .serializers import BankAccountSerializer, BankTransactionSerializer
 from django.shortcuts import render
@@ -11,6 +19,7 @@ import uuid
 
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@idempotent('bank-process', key_fields=('account_number',))
 def process_bank_payment(request):
     """Process e-commerce payment with fee distribution"""
     try:
@@ -22,13 +31,14 @@ def process_bank_payment(request):
         payment_id = request.data.get('payment_id')
         account_number = request.data.get('account_number')
         password = request.data.get('password')
+        verification_token = request.data.get('verification_token')
         amount = request.data.get('amount', '0')
         
-        if not all([payment_id, account_number, password, amount]):
+        if not all([payment_id, account_number, password or verification_token, amount]):
             print("Missing required fields")
             return Response({
                 'success': False,
-                'error': 'Missing required fields: payment_id, account_number, password, amount'
+                'error': 'Missing required fields: payment_id, account_number, password (or verification_token), amount'
             }, status=status.HTTP_400_BAD_REQUEST)
         
         # Convert amount to Decimal
@@ -42,7 +52,7 @@ def process_bank_payment(request):
         
         # Process payment with fee distribution
         result = BankPaymentService.process_ecommerce_payment(
-            payment_id, account_number, password, amount_decimal
+            payment_id, account_number, password, amount_decimal, verification_token
         )
         
         if result['success']:
@@ -52,6 +62,9 @@ def process_bank_payment(request):
             print("Payment failed:", result)
             return Response(result, status=status.HTTP_400_BAD_REQUEST)
             
+    except HashingPoolSaturated:
+        # Rendered as 429 by DRF
+        raise
     except Exception as e:
         print(f"Exception in process_bank_payment: {str(e)}")
         import traceback
@@ -61,103 +74,82 @@ def process_bank_payment(request):
             'error': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+def _settlement_response(legs, transaction=None):
+    """Build the transaction lookup response from all legs of one settlement"""
+    customer_transaction = next((leg for leg in legs if leg.transaction_type == 'debit'), None)
+    credits = [leg for leg in legs if leg.transaction_type == 'credit']
+    service_transaction = next(
+        (leg for leg in credits if leg.bank_account.account_number == SERVICE_FEE_ACCOUNT_NUMBER), None
+    )
+    merchant_transaction = next((leg for leg in credits if leg is not service_transaction), None)
+    transaction = transaction or customer_transaction or legs[0]
+    
+    response_data = {
+        'success': True,
+        'settlement_id': transaction.settlement_id or None,
+        'transaction': {
+            'transaction_id': str(transaction.transaction_id),
+            'payment_id': str(transaction.payment.payment_id) if transaction.payment else (transaction.payment_reference or None),
+            'account_number': transaction.bank_account.account_number,
+            'account_holder': transaction.bank_account.account_holder_name,
+            'amount': float(transaction.amount),
+            'transaction_type': transaction.transaction_type,
+            'description': transaction.description,
+            'running_balance': float(transaction.running_balance),
+            'status': transaction.status,
+            'created_at': transaction.created_at.isoformat(),
+            'bank_name': transaction.bank_account.bank_name
+        }
+    }
+    
+    if customer_transaction:
+        response_data['customer_transaction'] = {
+            'transaction_id': str(customer_transaction.transaction_id),
+            'amount': float(customer_transaction.amount),
+            'running_balance': float(customer_transaction.running_balance),
+            'description': customer_transaction.description
+        }
+    
+    if merchant_transaction:
+        response_data['merchant_transaction'] = {
+            'transaction_id': str(merchant_transaction.transaction_id),
+            'amount': float(merchant_transaction.amount),
+            'merchant_received': float(merchant_transaction.amount),
+            'merchant_balance': float(merchant_transaction.running_balance),
+            'description': merchant_transaction.description
+        }
+        
+        # Calculate fee breakdown
+        if customer_transaction:
+            total_amount = float(customer_transaction.amount)
+            merchant_received = float(merchant_transaction.amount)
+            service_fee = total_amount - merchant_received
+            response_data['fee_breakdown'] = {
+                'total_amount': total_amount,
+                'merchant_received': merchant_received,
+                'service_fee': service_fee,
+                'fee_percentage': f"{(service_fee/total_amount*100):.1f}%"
+            }
+    
+    if service_transaction:
+        response_data['service_transaction'] = {
+            'transaction_id': str(service_transaction.transaction_id),
+            'amount': float(service_transaction.amount),
+            'description': service_transaction.description
+        }
+    
+    return response_data
+
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_transaction_details(request, transaction_id):
-    """Get transaction details by ID or payment ID"""
+    """Get transaction details by leg ID, settlement (TXN) ID or payment ID"""
     try:
         print(f"Looking up transaction: {transaction_id}")
         
-        # Try to find by transaction_id first
-        try:
-            # Check if it's a UUID
-            transaction_uuid = uuid.UUID(transaction_id)
-            transaction = BankTransaction.objects.filter(transaction_id=transaction_uuid).first()
-        except ValueError:
-            # Not a UUID, try as string
-            transaction = BankTransaction.objects.filter(transaction_id__icontains=transaction_id).first()
-        
-        if not transaction:
-            # Try to find by payment reference
-            from api.models import Payment
-            
-            # Check if it's a payment ID (starts with PAY-)
-            if transaction_id.startswith('PAY-'):
-                payment = Payment.objects.filter(payment_id=transaction_id).first()
-                if payment:
-                    transaction = BankTransaction.objects.filter(payment=payment).first()
-            else:
-                # Try to find by transaction ID pattern (TXN)
-                if transaction_id.startswith('TXN'):
-                    transaction = BankTransaction.objects.filter(transaction_id__icontains=transaction_id).first()
-        
-        if transaction:
-            # Get related transaction for merchant if this is customer transaction
-            merchant_transaction = None
-            service_transaction = None
-            
-            if transaction.transaction_type == 'debit':
-                # This is customer debit, find merchant credit
-                merchant_transaction = BankTransaction.objects.filter(
-                    description__icontains=transaction.bank_account.account_number,
-                    transaction_type='credit'
-                ).order_by('-created_at').first()
-                
-                # Find service fee transaction
-                service_transaction = BankTransaction.objects.filter(
-                    description__icontains='service fee',
-                    created_at__gte=transaction.created_at
-                ).order_by('-created_at').first()
-            
-            response_data = {
-                'success': True,
-                'transaction': {
-                    'transaction_id': str(transaction.transaction_id),
-                    'payment_id': str(transaction.payment.payment_id) if transaction.payment else None,
-                    'account_number': transaction.bank_account.account_number,
-                    'account_holder': transaction.bank_account.account_holder_name,
-                    'amount': float(transaction.amount),
-                    'transaction_type': transaction.transaction_type,
-                    'description': transaction.description,
-                    'running_balance': float(transaction.running_balance),
-                    'status': transaction.status,
-                    'created_at': transaction.created_at.isoformat(),
-                    'bank_name': transaction.bank_account.bank_name
-                }
-            }
-            
-            # Add merchant transaction details if found
-            if merchant_transaction:
-                response_data['merchant_transaction'] = {
-                    'transaction_id': str(merchant_transaction.transaction_id),
-                    'amount': float(merchant_transaction.amount),
-                    'merchant_received': float(merchant_transaction.amount),
-                    'merchant_balance': float(merchant_transaction.running_balance),
-                    'description': merchant_transaction.description
-                }
-                
-                # Calculate service fee
-                if transaction.transaction_type == 'debit':
-                    total_amount = float(transaction.amount)
-                    merchant_received = float(merchant_transaction.amount)
-                    service_fee = total_amount - merchant_received
-                    response_data['fee_breakdown'] = {
-                        'total_amount': total_amount,
-                        'merchant_received': merchant_received,
-                        'service_fee': service_fee,
-                        'fee_percentage': f"{(service_fee/total_amount*100):.1f}%"
-                    }
-            
-            # Add service transaction if found
-            if service_transaction:
-                response_data['service_transaction'] = {
-                    'transaction_id': str(service_transaction.transaction_id),
-                    'amount': float(service_transaction.amount),
-                    'description': service_transaction.description
-                }
-            
-            return Response(response_data)
-        else:
+        legs = BankPaymentService.get_settlement_legs(transaction_id)
+        if not legs:
             return Response({
                 'success': False,
                 'error': 'Transaction not found',
@@ -167,6 +159,10 @@ def get_transaction_details(request, transaction_id):
                     'Try using the payment ID instead'
                 ]
             }, status=status.HTTP_404_NOT_FOUND)
+        
+        # Report the leg that was asked for when looking up by leg ID
+        transaction = next((leg for leg in legs if str(leg.transaction_id) == transaction_id.lower()), None)
+        return Response(_settlement_response(legs, transaction))
             
     except Exception as e:
         print(f"Error in get_transaction_details: {str(e)}")
@@ -177,6 +173,7 @@ def get_transaction_details(request, transaction_id):
             'error': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_transaction_by_payment_id(request, payment_id):
@@ -184,91 +181,34 @@ def get_transaction_by_payment_id(request, payment_id):
     try:
         print(f"Looking up transaction by payment ID: {payment_id}")
         
-        from api.models import Payment
-        from .models import BankTransaction
-        
-        # Find payment
-        payment = Payment.objects.filter(payment_id=payment_id).first()
-        
-        if not payment:
-            return Response({
-                'success': False,
-                'error': f'Payment with ID {payment_id} not found'
-            }, status=status.HTTP_404_NOT_FOUND)
-        
-        # Find bank transaction for this payment
-        transaction = BankTransaction.objects.filter(payment=payment).first()
+        legs = list(
+            BankTransaction.objects.filter(payment_reference=payment_id)
+            .select_related('bank_account', 'payment')
+            .order_by('created_at')
+        )
         
-        if not transaction:
+        if not legs:
             return Response({
                 'success': False,
                 'error': f'No bank transaction found for payment {payment_id}'
             }, status=status.HTTP_404_NOT_FOUND)
         
-        # Find related transactions
-        customer_transaction = BankTransaction.objects.filter(
-            bank_account__account_number__in=['910000001', '100035366'],
-            description__icontains=payment_id,
-            transaction_type='debit'
-        ).first()
-        
-        merchant_transaction = BankTransaction.objects.filter(
-            bank_account__account_number='200000001',
-            description__icontains=payment_id,
-            transaction_type='credit'
-        ).first()
-        
-        service_transaction = BankTransaction.objects.filter(
-            bank_account__account_number='900000001',
-            description__icontains=payment_id,
-            transaction_type='credit'
-        ).first()
-        
-        response_data = {
-            'success': True,
-            'payment': {
+        response_data = _settlement_response(legs)
+        payment = legs[0].payment
+        if payment:
+            response_data['payment'] = {
                 'payment_id': str(payment.payment_id),
                 'amount': float(payment.amount),
                 'status': payment.status,
                 'created_at': payment.created_at.isoformat()
             }
-        }
-        
-        if customer_transaction:
-            response_data['customer_transaction'] = {
-                'transaction_id': str(customer_transaction.transaction_id),
-                'amount': float(customer_transaction.amount),
-                'running_balance': float(customer_transaction.running_balance),
-                'description': customer_transaction.description
-            }
-        
-        if merchant_transaction:
-            response_data['merchant_transaction'] = {
-                'transaction_id': str(merchant_transaction.transaction_id),
-                'amount': float(merchant_transaction.amount),
-                'merchant_received': float(merchant_transaction.amount),
-                'merchant_balance': float(merchant_transaction.running_balance),
-                'description': merchant_transaction.description
-            }
-            
-            # Calculate fee breakdown
-            if customer_transaction and merchant_transaction:
-                total_amount = float(customer_transaction.amount)
-                merchant_received = float(merchant_transaction.amount)
-                service_fee = total_amount - merchant_received
-                
-                response_data['fee_breakdown'] = {
-                    'total_amount': total_amount,
-                    'merchant_received': merchant_received,
-                    'service_fee': service_fee,
-                    'fee_percentage': f"{(service_fee/total_amount*100):.1f}%"
-                }
-        
-        if service_transaction:
-            response_data['service_transaction'] = {
-                'transaction_id': str(service_transaction.transaction_id),
-                'amount': float(service_transaction.amount),
-                'description': service_transaction.description
+        else:
+            # Store-side payment IDs have no Payment row; describe the settlement instead
+            response_data['payment'] = {
+                'payment_id': payment_id,
+                'amount': response_data['transaction']['amount'],
+                'status': 'Completed',
+                'created_at': legs[0].created_at.isoformat()
             }
         
         return Response(response_data)
@@ -291,7 +231,7 @@ def create_demo_accounts(request):
             account_info.append({
                 'account_number': account.account_number,
                 'account_holder': account.account_holder_name,
-                'balance': float(account.current_balance),
+                'balance': float(account.total_balance),
                 'user_role': account.user.role,
                 'user_email': account.user.email
             })
@@ -308,6 +248,7 @@ def create_demo_accounts(request):
             'error': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@query_budget(10)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_merchant_dashboard(request):
@@ -326,16 +267,19 @@ def get_merchant_dashboard(request):
         transactions = dashboard_data['transactions']
         stats = dashboard_data['statistics']
         
-        # Serialize transactions
-        transaction_serializer = BankTransactionSerializer(transactions, many=True)
+        # Serialize one page of transactions
+        paginator = KeysetPagination('created_at')
+        transaction_serializer = BankTransactionSerializer(
+            paginator.paginate_queryset(transactions, request), many=True
+        )
         
-        return Response({
+        return paginator.get_paginated_response({
             'success': True,
             'account': {
                 'account_number': account.account_number,
                 'account_holder_name': account.account_holder_name,
                 'bank_name': account.bank_name,
-                'current_balance': float(account.current_balance)
+                'current_balance': float(account.total_balance)
             },
             'statistics': {
                 'total_received': float(stats['total_received']),
@@ -344,6 +288,16 @@ def get_merchant_dashboard(request):
                 'transaction_count': stats['transaction_count'],
                 'current_balance': float(stats['current_balance'])
             },
+            'daily_statistics': [
+                {
+                    'day': bucket.bucket_start.date().isoformat(),
+                    'total_received': float(bucket.total_received),
+                    'total_fees': float(bucket.total_fees),
+                    'net_income': float(bucket.net_income),
+                    'transaction_count': bucket.transaction_count
+                }
+                for bucket in dashboard_data['daily']
+            ],
             'recent_transactions': transaction_serializer.data
         })
         
@@ -353,19 +307,160 @@ def get_merchant_dashboard(request):
             'error': str(e)
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+# Period covered by /merchant/analytics/ when no start is given
+ANALYTICS_DEFAULT_RANGES = {
+    'hour': timedelta(hours=23),
+    'day': timedelta(days=29),
+    'month': timedelta(days=365),
+}
+
+@query_budget(10)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def get_merchant_analytics(request):
+    """Get settlement volume and fees per hour, day or month"""
+    granularity = request.query_params.get('granularity', 'day')
+    if granularity not in ANALYTICS_DEFAULT_RANGES:
+        return Response({
+            'success': False,
+            'error': 'granularity must be hour, day or month'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        end = parse_time_param(request.query_params.get('end'), timezone.now())
+        start = parse_time_param(
+            request.query_params.get('start'),
+            end - ANALYTICS_DEFAULT_RANGES[granularity]
+        )
+    except ValueError:
+        return Response({
+            'success': False,
+            'error': 'start and end must be ISO dates or datetimes'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    account = BankPaymentService.get_merchant_account(request.user)
+    if not account:
+        return Response({
+            'success': False,
+            'error': 'No merchant account found'
+        }, status=status.HTTP_404_NOT_FOUND)
+    
+    try:
+        buckets = SettlementRollupService.series(account, granularity, start, end)
+    except ValueError as e:
+        return Response({
+            'success': False,
+            'error': str(e)
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    total_received = sum((bucket.total_received for bucket in buckets), Decimal('0.00'))
+    total_fees = sum((bucket.total_fees for bucket in buckets), Decimal('0.00'))
+    return Response({
+        'success': True,
+        'account_number': account.account_number,
+        'granularity': granularity,
+        'buckets': [
+            {
+                'start': bucket.bucket_start.isoformat(),
+                'total_received': float(bucket.total_received),
+                'total_fees': float(bucket.total_fees),
+                'net_income': float(bucket.net_income),
+                'transaction_count': bucket.transaction_count
+            }
+            for bucket in buckets
+        ],
+        'totals': {
+            'total_received': float(total_received),
+            'total_fees': float(total_fees),
+            'net_income': float(total_received - total_fees),
+            'transaction_count': sum(bucket.transaction_count for bucket in buckets)
+        }
+    })
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_bank_transactions(request):
+    """Stream ledger rows of the user's accounts as NDJSON or CSV (?output=ndjson|csv&account=&from=&to=)"""
+    output = request.query_params.get('output', 'ndjson')
+    if output not in EXPORT_CONTENT_TYPES:
+        return Response({
+            'success': False,
+            'error': 'output must be ndjson or csv'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    try:
+        time_range = time_range_filter('created_at', request.query_params.get('from'), request.query_params.get('to'))
+    except ValueError:
+        return Response({
+            'success': False,
+            'error': 'from and to must be ISO dates or datetimes'
+        }, status=status.HTTP_400_BAD_REQUEST)
+    
+    transactions = BankTransaction.objects.all()
+    if request.user.role != 'admin':
+        # Finance admins may export any account; everyone else only their own
+        transactions = transactions.filter(bank_account__user=request.user)
+    account_number = request.query_params.get('account')
+    if account_number:
+        transactions = transactions.filter(bank_account__account_number=account_number)
+    transactions = transactions.filter(**time_range)
+    
+    return stream_export(
+        transactions.order_by('created_at', 'pk'),
+        [
+            ('transaction_id', 'transaction_id'),
+            ('settlement_id', 'settlement_id'),
+            ('payment_reference', 'payment_reference'),
+            ('account_number', 'bank_account__account_number'),
+            ('transaction_type', 'transaction_type'),
+            ('amount', 'amount'),
+            ('running_balance', 'running_balance'),
+            ('status', 'status'),
+            ('description', 'description'),
+            ('created_at', 'created_at'),
+        ],
+        output,
+        f"ledger-{account_number or 'all'}"
+    )
+
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
 def verify_bank_account(request):
-    """Verify bank account credentials"""
+    """
+    Verify bank account credentials. When the payment and the amount to pay are
+    given, the response carries a verification_token that /api/bank/process/
+    accepts instead of the password for that account, payment and amount.
+    """
     account_number = request.data.get('account_number')
     password = request.data.get('password')
+    payment_id = request.data.get('payment_id')
+    amount = request.data.get('amount')
     
     if not account_number or not password:
         return Response({'error': 'Account number and password required'}, status=400)
+    if amount and not payment_id:
+        return Response({'error': 'payment_id required with amount'}, status=400)
     
     result = BankPaymentService.verify_account(account_number, password)
+    if not result['verified']:
+        return Response(result, status=200)
     
-    return Response(result, status=200)
+    account = result['account']
+    response_data = {
+        'verified': True,
+        'account_number': account.account_number,
+        'account_holder_name': account.account_holder_name,
+        'bank_name': account.bank_name,
+        'balance': result['balance']
+    }
+    if amount:
+        try:
+            response_data['verification_token'] = BankVerificationService.issue(account, amount, payment_id)
+        except ArithmeticError:
+            return Response({'error': 'Invalid amount format'}, status=400)
+        response_data['expires_in'] = settings.BANK_VERIFICATION_TOKEN_TTL
+    
+    return Response(response_data, status=200)
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -394,22 +489,25 @@ def create_bank_account(request):
     else:
         return Response(result, status=400)
 
+@query_budget(3)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_bank_accounts(request):
     """Get user's bank accounts"""
-    accounts = BankAccount.objects.filter(user=request.user, is_active=True)
+    accounts = BankAccount.objects.filter(user=request.user, is_active=True).prefetch_related('shards')
     serializer = BankAccountSerializer(accounts, many=True)
     return Response(serializer.data, status=200)
 
+@query_budget(2)
 @api_view(['GET'])
 @permission_classes([AllowAny])
 def get_recent_transactions(request):
     """Get recent transactions for all accounts"""
     try:
-        limit = int(request.GET.get('limit', 10))
-        
-        transactions = BankTransaction.objects.all().order_by('-created_at')[:limit]
+        paginator = KeysetPagination('created_at', page_size=10)
+        transactions = paginator.paginate_queryset(
+            BankTransaction.objects.select_related('bank_account'), request
+        )
         
         transaction_data = []
         for tx in transactions:
@@ -425,7 +523,7 @@ def get_recent_transactions(request):
                 'status': tx.status
             })
         
-        return Response({
+        return paginator.get_paginated_response({
             'success': True,
             'transactions': transaction_data,
             'count': len(transaction_data)
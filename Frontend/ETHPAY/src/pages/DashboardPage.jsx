@@ -1,14 +1,20 @@
-import { useEffect, useState } from "react";
+import { useEffect, useRef, useState } from "react";
 import { useNavigate } from "react-router-dom";
-import { getDashboard, getTransactions, getNotifications } from "../service/userService";
+import { getDashboard, getTransactions, getNotifications, subscribeToEvents } from "../service/userService";
 import { logout, getCurrentUser } from "../service/authService";
 import PaymentForm from "../components/PaymentForm";
 import TransactionList from "../components/TransactionList";
 
+// Transactions settle with their payment's status
+const TRANSACTION_STATUS = { Pending: "Pending", Completed: "Success", Failed: "Failed" };
+
 function DashboardPage() {
   const navigate = useNavigate();
   const [dashboard, setDashboard] = useState(null);
   const [transactions, setTransactions] = useState([]);
+  const [transactionsCursor, setTransactionsCursor] = useState(null);
+  const listedPayments = useRef(new Set());
+  const [loadingMore, setLoadingMore] = useState(false);
   const [notifications, setNotifications] = useState([]);
   const [loading, setLoading] = useState(true);
   const [user, setUser] = useState(null);
@@ -22,8 +28,42 @@ function DashboardPage() {
 
     setUser(currentUser);
     loadDashboardData();
+
+    // Status changes are pushed over the event stream instead of re-fetched
+    return subscribeToEvents({
+      onPayment: (payment) => {
+        if (!listedPayments.current.has(payment.paymentID)) {
+          // A payment that is not listed yet (e.g. one received) - reload the first page
+          refreshTransactions();
+          return;
+        }
+        const status = TRANSACTION_STATUS[payment.status];
+        setTransactions((loaded) =>
+          loaded.map((transaction) =>
+            transaction.paymentID === payment.paymentID && status ? { ...transaction, status } : transaction
+          )
+        );
+      },
+      onNotification: (notification) => {
+        setNotifications((loaded) => [notification, ...loaded]);
+      },
+    });
   }, [navigate]);
 
+  useEffect(() => {
+    listedPayments.current = new Set(transactions.map((transaction) => transaction.paymentID));
+  }, [transactions]);
+
+  const refreshTransactions = async () => {
+    try {
+      const page = await getTransactions();
+      setTransactions(page.items);
+      setTransactionsCursor(page.nextCursor);
+    } catch (error) {
+      console.error("Error loading transactions:", error);
+    }
+  };
+
   const loadDashboardData = async () => {
     try {
       const [dashboardData, transactionsData, notificationsData] = await Promise.all([
@@ -32,8 +72,9 @@ function DashboardPage() {
         getNotifications(),
       ]);
       setDashboard(dashboardData);
-      setTransactions(transactionsData);
-      setNotifications(notificationsData);
+      setTransactions(transactionsData.items);
+      setTransactionsCursor(transactionsData.nextCursor);
+      setNotifications(notificationsData.items);
     } catch (error) {
       console.error("Error loading dashboard:", error);
     } finally {
@@ -41,6 +82,19 @@ function DashboardPage() {
     }
   };
 
+  const loadMoreTransactions = async () => {
+    setLoadingMore(true);
+    try {
+      const page = await getTransactions(transactionsCursor);
+      setTransactions((loaded) => [...loaded, ...page.items]);
+      setTransactionsCursor(page.nextCursor);
+    } catch (error) {
+      console.error("Error loading transactions:", error);
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleLogout = async () => {
     await logout();
     navigate("/login");
@@ -136,6 +190,15 @@ function DashboardPage() {
         <div className="bg-white p-6 rounded-lg shadow-md">
           <h2 className="text-xl font-semibold mb-4">All Transactions</h2>
           <TransactionList transactions={transactions} />
+          {transactionsCursor && (
+            <button
+              onClick={loadMoreTransactions}
+              disabled={loadingMore}
+              className="mt-4 bg-indigo-600 text-white px-4 py-2 rounded-md hover:bg-indigo-700 disabled:opacity-50"
+            >
+              {loadingMore ? "Loading..." : "Load more"}
+            </button>
+          )}
         </div>
       </main>
     </div>
@@ -1,5 +1,15 @@
 import api from "./api";
 
+// Keyset-paginated lists return one page per request and the next page's
+// cursor in the X-Next-Cursor header (absent on the last page)
+const getPage = async (url, cursor) => {
+  const response = await api.get(url, { params: cursor ? { cursor } : {} });
+  return {
+    items: response.data,
+    nextCursor: response.headers["x-next-cursor"] || null,
+  };
+};
+
 export const getUserProfile = async () => {
   const response = await api.get("auth/profile/");
   return response.data;
@@ -39,9 +49,8 @@ export const getPaymentDetails = async (paymentID) => {
   return response.data;
 };
 
-export const getTransactions = async () => {
-  const response = await api.get("transactions/");
-  return response.data;
+export const getTransactions = async (cursor = null) => {
+  return getPage("transactions/", cursor);
 };
 
 export const getTransactionDetails = async (transactionID) => {
@@ -54,12 +63,31 @@ export const getReceiptDetails = async (receiptID) => {
   return response.data;
 };
 
-export const getNotifications = async () => {
-  const response = await api.get("notifications/");
-  return response.data;
+export const getNotifications = async (cursor = null) => {
+  return getPage("notifications/", cursor);
 };
 
 export const calculateFee = async (amount) => {
   const response = await api.get(`fee/calculate/?amount=${amount}`);
   return response.data;
 };
+
+// Live payment status changes and notifications from the /api/events/
+// Server-Sent Events stream (EventSource cannot send headers, so the access
+// token goes in the query string). paymentID narrows the stream to one payment
+// and starts it with that payment's current status. Returns a function that
+// closes the stream; the browser reconnects on its own if it drops.
+export const subscribeToEvents = ({ paymentID = null, onPayment, onNotification } = {}) => {
+  const params = new URLSearchParams({ token: localStorage.getItem("accessToken") || "" });
+  if (paymentID) {
+    params.set("payment_id", paymentID);
+  }
+  const source = new EventSource(`${api.defaults.baseURL}events/?${params}`);
+  if (onPayment) {
+    source.addEventListener("payment", (event) => onPayment(JSON.parse(event.data)));
+  }
+  if (onNotification) {
+    source.addEventListener("notification", (event) => onNotification(JSON.parse(event.data)));
+  }
+  return () => source.close();
+};
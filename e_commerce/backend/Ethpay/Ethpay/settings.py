@@ -38,6 +38,10 @@ CORS_ALLOW_ALL_ORIGINS = True
 ETHPAY_BASE_URL = 'http://localhost:8001'  # Your EthPay gateway URL
 ETHPAY_API_KEY = 'ecommerce-secret-key-123'  # Should match EthPay's merchant key
 ETHPAY_MERCHANT_ID = 'ECOMMERCE_001'
+# Webhook signing secret shown by EthPay at /api/webhooks/secret/; payment
+# status changes arrive at /api/payment/callback/ signed with it
+ETHPAY_WEBHOOK_SECRET = os.getenv('ETHPAY_WEBHOOK_SECRET', '')
+ETHPAY_WEBHOOK_TOLERANCE = 300
 
 # Your e-commerce URLs
 BASE_URL = 'http://localhost:8000'  # Your e-commerce backend
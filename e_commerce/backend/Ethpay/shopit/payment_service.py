@@ -1,5 +1,8 @@
+import hashlib
+import hmac
 import requests
 import json
+import time
 from django.conf import settings
 
 class EthPayPaymentService:
@@ -104,6 +107,26 @@ class EthPayPaymentService:
             print(f"Error verifying payment: {str(e)}")
             return None
     
+    @classmethod
+    def verify_webhook(cls, body, header):
+        """
+        True when the X-EthPay-Signature header ('t=<timestamp>,v1=<hex>') is
+        EthPay's HMAC-SHA256 of b'<timestamp>.<raw body>' with
+        ETHPAY_WEBHOOK_SECRET and is recent enough to not be a replay
+        """
+        secret = getattr(settings, 'ETHPAY_WEBHOOK_SECRET', '')
+        if not secret:
+            return False
+        try:
+            parts = dict(part.split('=', 1) for part in header.split(','))
+            timestamp = int(parts['t'])
+        except (AttributeError, KeyError, ValueError):
+            return False
+        if abs(time.time() - timestamp) > getattr(settings, 'ETHPAY_WEBHOOK_TOLERANCE', 300):
+            return False
+        expected = hmac.new(secret.encode('utf-8'), str(timestamp).encode('ascii') + b'.' + body, hashlib.sha256).hexdigest()
+        return hmac.compare_digest(parts.get('v1', ''), expected)
+    
     @classmethod
     def process_bank_payment(cls, payment_id, bank_account, bank_password):
         """
@@ -112,10 +112,16 @@ def create_order(request):
 @api_view(['POST'])
 @permission_classes([AllowAny])
 def payment_callback(request):
-    """Handle payment callback from EthPay"""
+    """
+    Handle payment status webhooks from EthPay - the only place an order's
+    payment_status changes, so check_payment_status can answer from the order
+    """
     try:
+        if not EthPayPaymentService.verify_webhook(request.body, request.headers.get('X-EthPay-Signature')):
+            return Response({'error': 'Invalid signature'}, status=401)
+        
         data = request.data
-        payment_id = data.get('payment_id')
+        payment_id = data.get('paymentID') or data.get('payment_id')
         status = data.get('status')
         transaction_id = data.get('transaction_id')
         
@@ -130,6 +136,9 @@ def payment_callback(request):
         
         # Update order status
         status_map = {
+            'Completed': 'paid',
+            'Failed': 'failed',
+            'Cancelled': 'cancelled',
             'completed': 'paid',
             'success': 'paid',
             'failed': 'failed',
@@ -137,7 +146,8 @@ def payment_callback(request):
         }
         
         order.payment_status = status_map.get(status, 'processing')
-        order.transaction_id = transaction_id
+        if transaction_id:
+            order.transaction_id = transaction_id
         order.save()
         
         # TODO: Send confirmation email to customer
@@ -150,18 +160,15 @@ def payment_callback(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def check_payment_status(request, payment_id):
-    """Check payment status"""
+    """Check payment status - kept current by EthPay's webhooks, so EthPay is not asked on every check"""
     try:
         order = Order.objects.get(payment_id=payment_id, user=request.user)
         
-        # Verify with EthPay
-        payment_info = EthPayPaymentService.verify_payment(payment_id)
-        
         return Response({
             'order_id': str(order.order_id),
             'payment_id': payment_id,
             'status': order.payment_status,
-            'payment_info': payment_info,
+            'transaction_id': str(order.transaction_id) if order.transaction_id else None,
             'total_amount': str(order.total_amount)
         })
         